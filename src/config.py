@@ -14,13 +14,50 @@ class Settings(BaseSettings):
     # Gemini API
     gemini_api_key: str = ""
     gemini_model: str = "gemini-2.0-flash-exp"
+    gemini_cascade_models: str = "" # Comma-separated models, cheapest first; escalate only when a result fails validation
+    gemini_batch_size: int = 0 # Submit pending invoices as Gemini Batch API jobs of this size (0 = synchronous calls)
+    gemini_batch_poll_seconds: int = 30
+    gemini_batch_timeout_seconds: int = 6 * 3600
+    gemini_batch_max_request_bytes: int = 15 * 1024 * 1024 # Encoded PDF bytes per Batch API job; larger batches are split into several jobs (inline limit ~20 MB)
+    gemini_pack_size: int = 1 # PDFs sent together in one generate_content call (1 = one invoice per request)
+    gemini_max_workers: int = 1 # Invoices extracted concurrently (1 = sequential)
+    gemini_requests_per_minute: int = 0 # Request quota shared by all workers (0 = unlimited)
+    gemini_tokens_per_minute: int = 0 # Input token quota shared by all workers (0 = unlimited)
+    gemini_tokens_per_request: int = 3000 # Estimated input tokens per invoice, used for the token quota
+    gemini_max_attempts: int = 5 # LLM calls per invoice when throttled, before it is left for the next run
+    gemini_throttle_pause_seconds: float = 10.0 # Shared pause after a 429, doubling while throttling continues
+    gemini_max_throttle_pause_seconds: float = 120.0
+    gemini_context_cache_enabled: bool = False # Cache the prompt prefix (instruction, categories, schema) as Gemini cached content
+    gemini_context_cache_ttl_seconds: int = 3600
+    gemini_context_cache_min_tokens: int = 1024 # Smallest prefix the model accepts for caching (Gemini 2.5 Flash: 1024, Pro: 4096)
+    pdf_preprocess_enabled: bool = False # Drop appendix pages and downsample images before sending PDFs (requires pypdf)
+    pdf_max_image_dpi: int = 150 # Embedded images above this resolution are downsampled (requires pillow)
+    pdf_preprocess_fallback: bool = True # Re-extract from the full PDF if the reduced one gives an implausible result
+    extraction_cache_enabled: bool = True # Reuse extraction results for unchanged PDF, prompt, categories and model
+    extraction_cache_memory_entries: int = 256 # Size of the in-memory LRU tier
+    text_layer_enabled: bool = False # Extract repeat-vendor digital PDFs from their text layer (requires pypdf)
+    text_layer_min_confirmations: int = 2 # LLM results a vendor layout must reproduce before it is trusted
     
     # Gmail Settings
     gmail_credentials_path: str = ""
     gmail_token_json: str = "" # Content of token.json for cloud deployment
+    gmail_batch_size: int = 0 # Messages per Gmail HTTP batch request (0 disables batching, max 100)
+    gmail_incremental_sync: bool = False # Fetch only mail added since the stored historyId checkpoint
+    gmail_download_workers: int = 1 # Parallel attachment download/upload workers (1 downloads sequentially)
+    gmail_max_inflight_bytes: int = 64 * 1024 * 1024 # Cap on attachment bytes held in memory by the workers
     
     # Firestore
     firestore_database: str = "ciekawa-invoices-db"
+    firestore_write_batch_size: int = 0 # Buffer status updates and send them with a BulkWriter in batches of this size (0 writes each one immediately)
+    firestore_write_flush_seconds: float = 5.0 # Longest time a buffered status update waits before its batch is written
+    firestore_page_size: int = 500 # Documents per page when pending/unsynced invoices are read with query cursors
+    
+    # Workflow
+    pipeline_enabled: bool = False # Overlap retrieval, extraction and Sheets export instead of running them one after another
+    pipeline_queue_size: int = 100 # Invoices buffered between two pipeline stages before the faster stage waits
+    claim_batch_size: int = 0 # Lease pending work in batches of this size so parallel job tasks never share an invoice (0 = read everything)
+    claim_lease_seconds: int = 900 # Claimed invoices not finished within this time are claimed again by any task
+    retrieval_wait_seconds: int = 600 # Parallel job tasks wait up to this long for task 0 to finish reading the mailbox
     
     # Google Sheets
     google_sheets_id: str = ""
@@ -48,6 +85,10 @@ class Settings(BaseSettings):
         "NETO BAR"
     ]
     
+    def get_cascade_models(self) -> list[str]:
+        """Parse cascade models from comma-separated string."""
+        return [model.strip() for model in self.gemini_cascade_models.split(',') if model.strip()]
+
     def get_notification_emails(self) -> list[str]:
         """Parse notification emails from comma-separated string."""
         return [email.strip() for email in self.notification_email.split(',') if email.strip()]
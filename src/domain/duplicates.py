@@ -0,0 +1,101 @@
+"""Normalized invoice identity used to detect duplicates despite LLM reading variations."""
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from difflib import SequenceMatcher
+from src.domain.entities import InvoiceData
+
+# Company-form words that vendors print inconsistently ("Sp. z o.o.", "S.A.", "sp.j.")
+LEGAL_FORM_TOKENS = frozenset({
+    'sp', 'z', 'o', 'oo', 'spzoo', 'spolka', 'ograniczona', 'odpowiedzialnoscia', 'sa', 'akcyjna',
+    'sj', 'spj', 'jawna', 'sk', 'spk', 'komandytowa', 'ska', 'ltd', 'gmbh', 'inc', 'llc'
+})
+# Characters the LLM confuses when reading invoice numbers
+NUMBER_CONFUSABLES = str.maketrans({'O': '0', 'Q': '0', 'I': '1', 'L': '1'})
+VENDOR_SIMILARITY = 0.85
+# Shorter numbers are too likely to be contained in an unrelated one
+MIN_CONTAINED_NUMBER_LENGTH = 5
+
+
+def normalize_vendor(name: str | None) -> str:
+    """'Bukat Sp. z o.o.' -> 'bukat', 'EURO-MEAT S.A.' -> 'euromeat'."""
+    text = unicodedata.normalize('NFKD', (name or '').casefold().replace('ł', 'l'))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    # Dots are dropped first so that 'S.A.' reads as one token
+    tokens = re.findall(r'[a-z0-9]+', text.replace('.', ''))
+    return ''.join(token for token in tokens if token not in LEGAL_FORM_TOKENS)
+
+
+def normalize_invoice_number(number: str | None) -> str:
+    """'F/0019864/2025', 'F 0019864/2025' and 'f-OO19864-2025' all become 'F00198642025'."""
+    return re.sub(r'[^A-Z0-9]', '', (number or '').upper()).translate(NUMBER_CONFUSABLES)
+
+
+def vendors_match(first: str, second: str) -> bool:
+    """Compares normalized vendor names; an unknown vendor matches any."""
+    if not first or not second or first == second:
+        return True
+    if first in second or second in first:
+        return True
+    return SequenceMatcher(None, first, second).ratio() >= VENDOR_SIMILARITY
+
+
+def numbers_overlap(first: str, second: str) -> bool:
+    """True if one normalized number contains the other, e.g. a dropped 'F' prefix."""
+    shorter, longer = sorted((first, second), key=len)
+    return len(shorter) >= MIN_CONTAINED_NUMBER_LENGTH and shorter in longer
+
+
+@dataclass(frozen=True, slots=True)
+class InvoiceKey:
+    """
+    The fields that identify an invoice, normalized for duplicate detection.
+
+    Attributes:
+        vendor: Normalized vendor name (empty if unknown).
+        number: Normalized invoice number.
+        gross_cents: Gross amount in cents (None if unknown).
+        invoice_date: Issue date (None if unknown).
+        invoice_number: The number as extracted, for error messages.
+    """
+    vendor: str
+    number: str
+    gross_cents: int | None
+    invoice_date: date | None
+    invoice_number: str = field(default='', compare=False)
+
+    @classmethod
+    def from_fields(cls, vendor_name: str | None, invoice_number: str | None, gross_amount=None, invoice_date=None) -> 'InvoiceKey':
+        """Builds a key from stored or extracted values; dates may be datetimes or ISO strings."""
+        if isinstance(invoice_date, str):
+            invoice_date = datetime.fromisoformat(invoice_date)
+        if isinstance(invoice_date, datetime):
+            invoice_date = invoice_date.date()
+        return cls(
+            vendor=normalize_vendor(vendor_name),
+            number=normalize_invoice_number(invoice_number),
+            gross_cents=round(float(gross_amount) * 100) if gross_amount is not None else None,
+            invoice_date=invoice_date,
+            invoice_number=invoice_number or ''
+        )
+
+    @classmethod
+    def from_invoice(cls, invoice: InvoiceData) -> 'InvoiceKey':
+        return cls.from_fields(invoice.vendor_name, invoice.invoice_number, invoice.gross_amount, invoice.invoice_date)
+
+    def matches(self, other: 'InvoiceKey') -> bool:
+        """
+        Same invoice if the vendors match and either the numbers are equal, or
+        one number contains the other and amount and date are equal too.
+        """
+        if not vendors_match(self.vendor, other.vendor):
+            return False
+        if self.number and self.number == other.number:
+            return True
+        return (
+            self.gross_cents is not None
+            and self.invoice_date is not None
+            and (self.gross_cents, self.invoice_date) == (other.gross_cents, other.invoice_date)
+            and numbers_overlap(self.number, other.number)
+        )
@@ -1,15 +1,18 @@
+from collections.abc import Callable
 from enum import Enum
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 
 class ProcessingStatus(Enum):
     PENDING = "PENDING"
+    IN_PROGRESS = "IN_PROGRESS" # Leased by a worker, see InvoiceRepository.claim_raw_invoices
     PROCESSED = "PROCESSED"
     FAILED = "FAILED"
     RETRY = "RETRY"
 
 class SyncStatus(Enum):
     NOT_SYNCED = "NOT_SYNCED"
+    IN_PROGRESS = "IN_PROGRESS" # Leased by a worker, see InvoiceRepository.claim_unsynced_processed_invoices
     SYNCED = "SYNCED"
     FAILED = "FAILED"
 
@@ -25,6 +28,9 @@ class Email:
         date: The date and time the email was received.
         attachment_path: File system path to the saved PDF attachment.
         content: The body content of the email (optional).
+        content_hash: SHA-256 hex digest of the PDF attachment (optional).
+        attachment_filename: Original filename of the attachment, if the stored
+            path does not end with it (content-addressed storage).
     """
     id: str
     sender: str
@@ -32,6 +38,8 @@ class Email:
     date: datetime
     attachment_path: str  # Path to the saved PDF
     content: str | None = None # Email body content if needed
+    content_hash: str | None = None
+    attachment_filename: str | None = None
 
 @dataclass(slots=True)
 class InvoiceItem:
@@ -105,7 +113,7 @@ class ProcessedInvoice:
     Represents a processed invoice with extracted data.
 
     Attributes:
-        id: Unique identifier for the processed invoice (UUID).
+        id: Unique identifier for the processed invoice; the id of its raw invoice.
         raw_invoice_id: ID of the source raw invoice.
         extracted_data: The structured data extracted from the invoice.
         sync_status: Current synchronization status with external systems.
@@ -120,3 +128,63 @@ class ProcessedInvoice:
     created_at: datetime
     updated_at: datetime
     error_message: str | None = None
+
+@dataclass(slots=True)
+class RawInvoiceRow(RawInvoice):
+    """
+    A raw invoice as read by a projection query, for scanning large queues.
+
+    Only the fields processing needs are filled in: `email_data.content` is
+    None even if the stored email has a body. `load()` returns the complete
+    invoice, reading it on first use.
+
+    Attributes:
+        loader: Reads the complete invoice; None if the row is already complete.
+    """
+    loader: Callable[[], RawInvoice] | None = field(default=None, repr=False, compare=False)
+    _full: RawInvoice | None = field(default=None, init=False, repr=False, compare=False)
+
+    def load(self) -> RawInvoice:
+        if self._full is None:
+            self._full = self.loader() if self.loader else self
+        return self._full
+
+@dataclass(slots=True)
+class ProcessedInvoiceRow(ProcessedInvoice):
+    """
+    A processed invoice as read by a projection query, for scanning large queues.
+
+    `extracted_data` holds the header fields only (`items` is None). `load()`
+    returns the complete invoice, reading it on first use.
+
+    Attributes:
+        loader: Reads the complete invoice; None if the row is already complete.
+    """
+    loader: Callable[[], ProcessedInvoice] | None = field(default=None, repr=False, compare=False)
+    _full: ProcessedInvoice | None = field(default=None, init=False, repr=False, compare=False)
+
+    def load(self) -> ProcessedInvoice:
+        if self._full is None:
+            self._full = self.loader() if self.loader else self
+        return self._full
+
+# Repository error for a leased status update that was skipped because the lease was lost
+LEASE_LOST = "Lease no longer held; update skipped"
+
+
+@dataclass(slots=True)
+class StatusUpdate:
+    """
+    A pending status change of one raw or processed invoice, for bulk writes.
+
+    Attributes:
+        invoice_id: ID of the invoice to update.
+        status: New status value.
+        error: Error message to store with the status (optional).
+        lease_owner: If set, the update only applies while the invoice is still
+            leased to this worker (see `InvoiceRepository.claim_raw_invoices`).
+    """
+    invoice_id: str
+    status: str
+    error: str | None = None
+    lease_owner: str | None = None
@@ -26,3 +26,11 @@ class InvoiceExtraction(BaseModel):
     payment_date: date = Field(
         description="Payment due date (Termin płatności/Data płatności)"
     )
+
+
+class PackedInvoiceExtraction(InvoiceExtraction):
+    """One entry of a response covering several PDFs sent in a single request."""
+
+    document_index: int = Field(
+        description="1-based position of the PDF document this entry was extracted from"
+    )
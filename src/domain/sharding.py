@@ -0,0 +1,54 @@
+"""Deterministic partitioning of invoices across parallel job tasks."""
+import os
+from dataclasses import dataclass
+
+# Width of the id prefix the shard boundaries are computed on (hex digits)
+BOUNDARY_DIGITS = 8
+
+
+@dataclass(frozen=True, slots=True)
+class Shard:
+    """
+    One of `count` disjoint slices of the document id space.
+
+    The slices are contiguous ranges of ids, split evenly over their leading
+    hex digits. Invoice ids are random UUID4s, so every slice gets an equal
+    share of the invoices; an id of any other form still falls into exactly
+    one slice. Because a slice is a range, repositories can filter on it in the
+    query itself instead of reading every document.
+
+    Attributes:
+        index: This shard's position, from 0 to count - 1.
+        count: Total number of shards.
+    """
+    index: int = 0
+    count: int = 1
+
+    def __post_init__(self):
+        if not 0 <= self.index < self.count:
+            raise ValueError(f"Shard index {self.index} is outside 0..{self.count - 1}")
+
+    @classmethod
+    def from_env(cls) -> 'Shard':
+        """The shard of the current Cloud Run job task; the whole id space elsewhere."""
+        return cls(
+            index=int(os.environ.get('CLOUD_RUN_TASK_INDEX', 0)),
+            count=int(os.environ.get('CLOUD_RUN_TASK_COUNT', 1))
+        )
+
+    @property
+    def is_partial(self) -> bool:
+        return self.count > 1
+
+    def bounds(self) -> tuple[str | None, str | None]:
+        """Returns the inclusive lower and exclusive upper id bound; None means unbounded."""
+        return self._boundary(self.index), self._boundary(self.index + 1)
+
+    def contains(self, document_id: str) -> bool:
+        lower, upper = self.bounds()
+        return (lower is None or document_id >= lower) and (upper is None or document_id < upper)
+
+    def _boundary(self, position: int) -> str | None:
+        if position <= 0 or position >= self.count:
+            return None
+        return format(position * 16 ** BOUNDARY_DIGITS // self.count, f'0{BOUNDARY_DIGITS}x')
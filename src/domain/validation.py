@@ -0,0 +1,74 @@
+"""Mapping and sanity checks for LLM extraction results."""
+import logging
+from datetime import datetime
+from src.domain.entities import InvoiceData
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y', '%Y/%m/%d', '%d-%m-%Y')
+
+
+def parse_date(date_str: str) -> datetime:
+    """Robust date parsing with fallbacks."""
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(date_str, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Unknown date format: {date_str}")
+
+
+def map_extraction(data: dict) -> InvoiceData:
+    """
+    Maps an LLM extraction result to InvoiceData.
+
+    Raises:
+        ValueError: If dates or amounts cannot be parsed.
+    """
+    try:
+        return InvoiceData(
+            invoice_date=parse_date(data.get('invoice_date', '')),
+            category=data.get('category', 'UNCATEGORIZED'),
+            vendor_name=data.get('vendor', 'Unknown'),
+            net_amount=float(data.get('net_amount', 0.0)),
+            gross_amount=float(data.get('gross_amount', 0.0)),
+            invoice_number=data.get('invoice_number', 'UNKNOWN'),
+            due_date=parse_date(data.get('payment_date', '')),
+            items=[],
+            currency=data.get('currency', 'PLN'),
+            tax_amount=float(data.get('tax_amount', 0.0))
+        )
+    except (ValueError, TypeError, KeyError) as e:
+        logger.error(f"Data validation failed: {e}. Raw data: {data}")
+        raise ValueError(f"Invalid invoice data structure: {e}")
+
+
+def check_amounts(invoice: InvoiceData) -> list[str]:
+    """
+    Returns the arithmetic problems of an invoice (empty if its amounts are consistent).
+
+    Credit notes carry negative amounts; they are accepted as long as net and
+    gross have the same sign and the net amount is not larger in magnitude.
+    """
+    problems = []
+    if invoice.net_amount == 0:
+        problems.append("net amount is zero")
+    elif invoice.net_amount * invoice.gross_amount < 0:
+        problems.append("net and gross amounts have opposite signs")
+    elif abs(invoice.net_amount) > abs(invoice.gross_amount):
+        problems.append("net amount exceeds gross amount")
+    return problems
+
+
+def validate_extraction(data: dict) -> InvoiceData:
+    """
+    Maps an extraction result and checks that its amounts add up.
+
+    Raises:
+        ValueError: If the result cannot be mapped or its amounts are inconsistent.
+    """
+    invoice = map_extraction(data)
+    problems = check_amounts(invoice)
+    if problems:
+        raise ValueError(f"Implausible invoice data: {', '.join(problems)}")
+    return invoice
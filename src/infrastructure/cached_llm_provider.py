@@ -0,0 +1,151 @@
+"""Caching decorator for LLMProvider keyed by PDF content, prompt, categories and model."""
+import copy
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from src.domain.validation import validate_extraction
+from src.ports.interfaces import LLMProvider, InvoiceRepository
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+class CachedLLMProvider(LLMProvider):
+    """
+    Memoizes extraction results of another LLMProvider.
+
+    Results are looked up in a bounded in-memory LRU first, then in the
+    repository's persistent cache (Firestore or the local JSON DB). The key
+    covers the PDF bytes, the instruction file, the categories file and the
+    model name, so editing the prompt or categories invalidates old entries.
+    Only results that pass `validate_extraction` are stored, so a bad answer
+    is asked again next time instead of being replayed. The provider is
+    thread-safe if the wrapped provider is.
+    """
+
+    def __init__(
+        self,
+        llm_provider: LLMProvider,
+        invoice_repo: InvoiceRepository | None = None,
+        max_memory_entries: int | None = None,
+        instruction_file: str | None = None,
+        categories_file: str | None = None,
+        model_name: str | None = None
+    ):
+        self.llm_provider = llm_provider
+        self.invoice_repo = invoice_repo
+        self.max_memory_entries = max_memory_entries or settings.extraction_cache_memory_entries
+        self.instruction_file = instruction_file or settings.instruction_file
+        self.categories_file = categories_file or settings.categories_file
+        self.model_name = model_name or getattr(llm_provider, 'model_name', type(llm_provider).__name__)
+        self.stats = {'memory_hits': 0, 'store_hits': 0, 'misses': 0}
+        self._memory: OrderedDict[str, dict] = OrderedDict()
+        # Guards the LRU and the stats across extraction worker threads
+        self._lock = threading.Lock()
+        # (path, mtime_ns, size) -> digest, so unchanged files are hashed once
+        self._file_digests: dict[tuple[str, int, int], str] = {}
+
+    def extract_invoice_data(self, file_path: str) -> dict:
+        """Extract invoice data, reusing a cached result for an identical PDF and prompt version."""
+        if not Path(file_path).exists():
+            # Nothing to hash (e.g. a gs:// URI); let the wrapped provider handle it
+            return self.llm_provider.extract_invoice_data(file_path)
+
+        cache_key = self.cache_key(file_path)
+        cached = self._lookup(cache_key, file_path)
+        if cached is not None:
+            return cached
+
+        self._count('misses')
+        result = self.llm_provider.extract_invoice_data(file_path)
+        self._store(cache_key, result)
+        return copy.deepcopy(result)
+
+    def extract_invoice_data_batch(self, file_paths: dict[str, str]) -> dict[str, dict | Exception]:
+        """Serve cached items directly and send only the misses to the wrapped provider in one bulk call."""
+        results: dict[str, dict | Exception] = {}
+        misses = {}
+        cache_keys = {}
+        for key, file_path in file_paths.items():
+            if Path(file_path).exists():
+                cache_keys[key] = self.cache_key(file_path)
+                cached = self._lookup(cache_keys[key], file_path)
+                if cached is not None:
+                    results[key] = cached
+                    continue
+                self._count('misses')
+            misses[key] = file_path
+
+        if misses:
+            for key, result in self.llm_provider.extract_invoice_data_batch(misses).items():
+                if key in cache_keys and not isinstance(result, Exception):
+                    self._store(cache_keys[key], result)
+                results[key] = result
+        return results
+
+    def cache_key(self, file_path: str) -> str:
+        """Returns the cache key for a PDF under the current prompt, categories and model."""
+        parts = [
+            self._file_digest(file_path),
+            self._file_digest(self.instruction_file),
+            self._file_digest(self.categories_file),
+            self.model_name
+        ]
+        return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+    def _file_digest(self, path: str) -> str:
+        stat = Path(path).stat()
+        memo_key = (str(path), stat.st_mtime_ns, stat.st_size)
+        if memo_key not in self._file_digests:
+            self._file_digests[memo_key] = hashlib.sha256(Path(path).read_bytes()).hexdigest()
+        return self._file_digests[memo_key]
+
+    def _lookup(self, cache_key: str, file_path: str) -> dict | None:
+        """Returns a copy of the cached result from the memory or persistent tier, or None."""
+        with self._lock:
+            cached = self._memory.get(cache_key)
+            if cached is not None:
+                self._memory.move_to_end(cache_key)
+                self.stats['memory_hits'] += 1
+        if cached is not None:
+            logger.info(f"Extraction cache hit (memory) for {file_path}")
+            return copy.deepcopy(cached)
+
+        if self.invoice_repo:
+            try:
+                cached = self.invoice_repo.get_cached_extraction(cache_key)
+            except Exception as e:
+                logger.warning(f"Extraction cache lookup failed: {e}")
+                cached = None
+            if cached is not None:
+                self._count('store_hits')
+                logger.info(f"Extraction cache hit (store) for {file_path}")
+                self._remember(cache_key, cached)
+                return copy.deepcopy(cached)
+        return None
+
+    def _store(self, cache_key: str, result: dict):
+        try:
+            validate_extraction(result)
+        except Exception as e:
+            logger.info(f"Not caching extraction result that fails validation: {e}")
+            return
+        self._remember(cache_key, result)
+        if self.invoice_repo:
+            try:
+                self.invoice_repo.save_cached_extraction(cache_key, result)
+            except Exception as e:
+                logger.warning(f"Failed to store extraction result in cache: {e}")
+
+    def _remember(self, cache_key: str, result: dict):
+        result = copy.deepcopy(result)
+        with self._lock:
+            self._memory[cache_key] = result
+            self._memory.move_to_end(cache_key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def _count(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
@@ -0,0 +1,89 @@
+"""Model cascade for LLMProvider: a cheap model first, stronger models only when its result is implausible."""
+import logging
+import threading
+import time
+from src.domain.validation import validate_extraction
+from src.ports.interfaces import LLMProvider
+
+logger = logging.getLogger(__name__)
+
+class CascadeLLMProvider(LLMProvider):
+    """
+    Tries LLM providers in order, cheapest first.
+
+    A result is accepted when it maps to InvoiceData and its amounts add up
+    (see `validate_extraction`). Otherwise, including unparseable output, the
+    invoice is re-extracted by the next tier. The last tier's result is returned
+    as is, so the caller's own validation reports the failure. API errors such
+    as quota exhaustion are raised immediately instead of escalating.
+    """
+
+    def __init__(self, tiers: list[LLMProvider]):
+        if not tiers:
+            raise ValueError("CascadeLLMProvider needs at least one tier")
+        self.tiers = tiers
+        self.tier_names = [getattr(tier, 'model_name', type(tier).__name__) for tier in tiers]
+        self.model_name = "cascade:" + "+".join(self.tier_names)
+        self.stats = {name: {'calls': 0, 'escalations': 0, 'seconds': 0.0} for name in self.tier_names}
+        self._lock = threading.Lock()
+
+    def extract_invoice_data(self, file_path: str) -> dict:
+        """Extract with the first tier whose result passes validation."""
+        for level, tier in enumerate(self.tiers):
+            start = time.perf_counter()
+            try:
+                result = tier.extract_invoice_data(file_path)
+                problem = self._problem(result)
+            except ValueError as e:
+                result, problem = None, e
+            finally:
+                self._record(level, time.perf_counter() - start)
+
+            if problem is None or level == len(self.tiers) - 1:
+                if result is None:
+                    raise problem
+                return result
+            self._escalate(level, file_path, problem)
+
+    def extract_invoice_data_batch(self, file_paths: dict[str, str]) -> dict[str, dict | Exception]:
+        """Extract all files with the first tier, then send only the implausible ones to the next tier in bulk."""
+        results: dict[str, dict | Exception] = {}
+        pending = dict(file_paths)
+        for level, tier in enumerate(self.tiers):
+            start = time.perf_counter()
+            tier_results = tier.extract_invoice_data_batch(pending)
+            self._record(level, time.perf_counter() - start, calls=len(pending))
+
+            last = level == len(self.tiers) - 1
+            retry = {}
+            for key, result in tier_results.items():
+                problem = result if isinstance(result, ValueError) else None
+                if not isinstance(result, Exception):
+                    problem = self._problem(result)
+                if problem is None or last:
+                    results[key] = result
+                else:
+                    self._escalate(level, pending[key], problem)
+                    retry[key] = pending[key]
+            if not retry:
+                break
+            pending = retry
+        return results
+
+    def _problem(self, result: dict) -> ValueError | None:
+        try:
+            validate_extraction(result)
+        except ValueError as e:
+            return e
+        return None
+
+    def _record(self, level: int, seconds: float, calls: int = 1):
+        with self._lock:
+            tier_stats = self.stats[self.tier_names[level]]
+            tier_stats['calls'] += calls
+            tier_stats['seconds'] += seconds
+
+    def _escalate(self, level: int, file_path: str, problem: Exception):
+        logger.warning(f"{self.tier_names[level]} result for {file_path} rejected ({problem}). Escalating to {self.tier_names[level + 1]}.")
+        with self._lock:
+            self.stats[self.tier_names[level]]['escalations'] += 1
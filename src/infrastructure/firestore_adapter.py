@@ -1,13 +1,36 @@
 import logging
-from datetime import datetime
+from collections.abc import Callable, Iterator
+from datetime import datetime, timedelta, timezone
 from dataclasses import asdict
 from google.cloud import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
 from src.ports.interfaces import InvoiceRepository
-from src.domain.entities import RawInvoice, ProcessedInvoice, ProcessingStatus, SyncStatus, Email, InvoiceData, InvoiceItem
+from src.domain.entities import RawInvoice, ProcessedInvoice, ProcessingStatus, SyncStatus, Email, InvoiceData, InvoiceItem, StatusUpdate, RawInvoiceRow, ProcessedInvoiceRow, LEASE_LOST
+from src.domain.duplicates import InvoiceKey
+from src.domain.sharding import Shard
 from src.config import settings
 
 logger = logging.getLogger(__name__)
 
+# gRPC codes of bulk write failures worth retrying (DEADLINE_EXCEEDED, RESOURCE_EXHAUSTED, ABORTED, INTERNAL, UNAVAILABLE)
+RETRYABLE_WRITE_CODES = {4, 8, 10, 13, 14}
+MAX_WRITE_ATTEMPTS = 5
+# Query-and-claim rounds before a worker losing every candidate to others gives up
+MAX_CLAIM_ROUNDS = 3
+
+# Fields read by the row queries; the email body and the line items are left out
+RAW_INVOICE_ROW_FIELDS = [
+    "id", "email_id", "status", "created_at", "updated_at", "error_message",
+    "email_data.id", "email_data.sender", "email_data.subject", "email_data.date",
+    "email_data.attachment_path", "email_data.content_hash", "email_data.attachment_filename"
+]
+PROCESSED_INVOICE_ROW_FIELDS = [
+    "id", "raw_invoice_id", "sync_status", "created_at", "updated_at", "error_message",
+    "extracted_data.invoice_date", "extracted_data.category", "extracted_data.vendor_name",
+    "extracted_data.net_amount", "extracted_data.gross_amount", "extracted_data.invoice_number",
+    "extracted_data.due_date", "extracted_data.currency", "extracted_data.tax_amount"
+]
+
 class FirestoreAdapter(InvoiceRepository):
     """Firestore implementation of InvoiceRepository."""
 
@@ -57,13 +80,53 @@ class FirestoreAdapter(InvoiceRepository):
         doc_ref.set(data)
         logger.info(f"Saved raw invoice {invoice.id} to Firestore.")
 
-    def get_pending_raw_invoices(self, statuses: list[ProcessingStatus] = None) -> list[RawInvoice]:
+    def get_pending_raw_invoices(self, statuses: list[ProcessingStatus] = None, shard: Shard | None = None) -> list[RawInvoice]:
         """
         Retrieves all raw invoices with specified statuses (default: PENDING).
 
+        Args:
+            statuses: Statuses to include.
+            shard: If given, only invoices whose id falls into this shard are read.
+
         Returns:
             List of pending raw invoices.
         """
+        docs = self._pending_raw_query(statuses, shard).stream()
+        return [self._raw_invoice_from_dict(doc.to_dict()) for doc in docs]
+
+    def get_pending_raw_invoice_rows(self, statuses: list[ProcessingStatus] | None = None, shard: Shard | None = None) -> list[RawInvoiceRow]:
+        """
+        Retrieves raw invoices with specified statuses (default: PENDING) through a
+        projection query, so the email body is neither downloaded nor decoded.
+
+        Args:
+            statuses: Statuses to include.
+            shard: If given, only invoices whose id falls into this shard are read.
+
+        Returns:
+            List of rows; `load()` on a row reads its full document.
+        """
+        docs = self._pending_raw_query(statuses, shard).select(RAW_INVOICE_ROW_FIELDS).stream()
+        return [self._raw_invoice_row(doc.to_dict()) for doc in docs]
+
+    def iter_pending_raw_invoice_rows(
+        self,
+        statuses: list[ProcessingStatus] | None = None,
+        shard: Shard | None = None,
+        page_size: int = 500
+    ) -> Iterator[RawInvoiceRow]:
+        """
+        Yields the rows of `get_pending_raw_invoice_rows` one page at a time.
+
+        Args:
+            statuses: Statuses to include.
+            shard: If given, only invoices whose id falls into this shard are read.
+            page_size: Documents read per query.
+        """
+        query = self._pending_raw_query(statuses, shard).select(RAW_INVOICE_ROW_FIELDS)
+        return self._paged(query, page_size, self._raw_invoice_row)
+
+    def _pending_raw_query(self, statuses: list[ProcessingStatus] | None, shard: Shard | None):
         self._check_client()
         
         if statuses is None:
@@ -72,30 +135,33 @@ class FirestoreAdapter(InvoiceRepository):
         # Firestore 'in' query allows up to 10 values
         status_values = [s.value for s in statuses]
         
-        docs = self.client.collection("raw_invoices").where(
-            filter=firestore.FieldFilter("status", "in", status_values)
-        ).stream()
-        
-        pending = []
-        for doc in docs:
-            data = doc.to_dict()
-            # Reconstruct objects
-            email_data = data['email_data']
-            email = Email(**email_data)
-            
-            raw = RawInvoice(
-                id=data['id'],
-                email_id=data['email_id'],
-                email_data=email,
-                status=ProcessingStatus(data['status']),
-                created_at=data['created_at'],
-                updated_at=data['updated_at'],
-                error_message=data.get('error_message')
-            )
-            pending.append(raw)
-        return pending
-
-    def update_raw_invoice_status(self, invoice_id: str, status: str, error: str | None = None):
+        collection_ref = self.client.collection("raw_invoices")
+        query = collection_ref.where(filter=firestore.FieldFilter("status", "in", status_values))
+        return self._in_shard(query, collection_ref, shard)
+
+    def claim_raw_invoices(self, owner: str, limit: int, lease_seconds: int, updated_before: datetime | None = None) -> list[RawInvoice]:
+        """
+        Leases up to `limit` PENDING/RETRY raw invoices, or ones whose lease expired, to `owner`.
+
+        Filtering on `updated_before` needs a composite index on (status, updated_at).
+
+        Args:
+            owner: Identifier of the claiming worker.
+            limit: Maximum number of invoices to claim.
+            lease_seconds: How long the invoices stay reserved for `owner`.
+            updated_before: Skip invoices updated at or after this time.
+
+        Returns:
+            The claimed invoices, with status IN_PROGRESS. Empty when nothing is left to claim.
+        """
+        claimed = self._claim(
+            "raw_invoices", "status",
+            [ProcessingStatus.PENDING.value, ProcessingStatus.RETRY.value], ProcessingStatus.IN_PROGRESS.value,
+            owner, limit, lease_seconds, updated_before
+        )
+        return [self._raw_invoice_from_dict(data) for data in claimed]
+
+    def update_raw_invoice_status(self, invoice_id: str, status: str, error: str | None = None, lease_owner: str | None = None) -> bool:
         """
         Updates the status of a raw invoice in Firestore.
 
@@ -103,19 +169,53 @@ class FirestoreAdapter(InvoiceRepository):
             invoice_id: ID of the invoice to update.
             status: New status.
             error: Optional error message.
+            lease_owner: Worker that must still hold the invoice's lease; checked
+                in a transaction together with the write.
+
+        Returns:
+            False if the lease was lost and nothing was written, otherwise True.
         """
         self._check_client()
         doc_ref = self.client.collection("raw_invoices").document(invoice_id)
         
         update_data = {
             "status": status,
-            "updated_at": datetime.now()
+            "updated_at": datetime.now(),
+            # Any status change ends the lease
+            "lease_owner": firestore.DELETE_FIELD,
+            "lease_expires_at": firestore.DELETE_FIELD
         }
         if error:
             update_data["error_message"] = error
-            
-        doc_ref.update(update_data)
+
+        if lease_owner is None:
+            doc_ref.update(update_data)
+        else:
+            @firestore.transactional
+            def update(transaction) -> bool:
+                snapshot = doc_ref.get(transaction=transaction)
+                if (snapshot.to_dict() or {}).get("lease_owner") != lease_owner:
+                    return False
+                transaction.update(doc_ref, update_data)
+                return True
+
+            if not update(self.client.transaction()):
+                logger.warning(f"{lease_owner} lost the lease on raw invoice {invoice_id}; status {status} not saved.")
+                return False
         logger.info(f"Updated raw invoice {invoice_id} status to {status}.")
+        return True
+
+    def update_raw_invoice_statuses(self, updates: list[StatusUpdate]) -> dict[str, str]:
+        """
+        Updates the status of several raw invoices with a BulkWriter.
+
+        Args:
+            updates: Status changes to apply.
+
+        Returns:
+            Error messages of the updates that failed, keyed by invoice id.
+        """
+        return self._bulk_update("raw_invoices", "status", updates)
 
     def save_processed_invoice(self, invoice: ProcessedInvoice):
         """
@@ -133,49 +233,114 @@ class FirestoreAdapter(InvoiceRepository):
         doc_ref.set(data)
         logger.info(f"Saved processed invoice {invoice.id} to Firestore.")
 
-    def get_unsynced_processed_invoices(self) -> list[ProcessedInvoice]:
+    def commit_processed_invoice(self, invoice: ProcessedInvoice, lease_owner: str | None = None) -> bool:
+        """
+        Saves a processed invoice and marks its raw invoice PROCESSED in one
+        atomic batch commit (a single round trip). With `lease_owner`, a
+        transaction first checks that the raw invoice is still leased to it.
+
+        Args:
+            invoice: The processed invoice to save.
+            lease_owner: Worker that must still hold the raw invoice's lease.
+
+        Returns:
+            False if the lease was lost and nothing was written, otherwise True.
+        """
+        self._check_client()
+        data = asdict(invoice)
+        data['sync_status'] = invoice.sync_status.value
+        processed_ref = self.client.collection("processed_invoices").document(invoice.id)
+        raw_ref = self.client.collection("raw_invoices").document(invoice.raw_invoice_id)
+        raw_update = {
+            "status": ProcessingStatus.PROCESSED.value,
+            "updated_at": datetime.now(),
+            "lease_owner": firestore.DELETE_FIELD,
+            "lease_expires_at": firestore.DELETE_FIELD
+        }
+
+        if lease_owner is None:
+            batch = self.client.batch()
+            batch.set(processed_ref, data)
+            batch.update(raw_ref, raw_update)
+            batch.commit()
+        else:
+            @firestore.transactional
+            def commit(transaction) -> bool:
+                snapshot = raw_ref.get(transaction=transaction)
+                if (snapshot.to_dict() or {}).get("lease_owner") != lease_owner:
+                    return False
+                transaction.set(processed_ref, data)
+                transaction.update(raw_ref, raw_update)
+                return True
+
+            if not commit(self.client.transaction()):
+                logger.warning(f"{lease_owner} lost the lease on raw invoice {invoice.raw_invoice_id}; processed invoice {invoice.id} not saved.")
+                return False
+        logger.info(f"Saved processed invoice {invoice.id} and marked raw invoice {invoice.raw_invoice_id} processed.")
+        return True
+
+    def get_unsynced_processed_invoices(self, shard: Shard | None = None) -> list[ProcessedInvoice]:
         """
         Retrieves all processed invoices that have not been synced from Firestore.
 
+        Args:
+            shard: If given, only invoices whose id falls into this shard are read.
+
         Returns:
             List of unsynced processed invoices.
         """
+        docs = self._unsynced_processed_query(shard).stream()
+        return [self._processed_invoice_from_dict(doc.to_dict()) for doc in docs]
+
+    def get_unsynced_processed_invoice_rows(self, shard: Shard | None = None) -> list[ProcessedInvoiceRow]:
+        """
+        Retrieves unsynced processed invoices through a projection query that
+        leaves out the line items.
+
+        Args:
+            shard: If given, only invoices whose id falls into this shard are read.
+
+        Returns:
+            List of rows; `load()` on a row reads its full document.
+        """
+        docs = self._unsynced_processed_query(shard).select(PROCESSED_INVOICE_ROW_FIELDS).stream()
+        return [self._processed_invoice_row(doc.to_dict()) for doc in docs]
+
+    def iter_unsynced_processed_invoice_rows(self, shard: Shard | None = None, page_size: int = 500) -> Iterator[ProcessedInvoiceRow]:
+        """
+        Yields the rows of `get_unsynced_processed_invoice_rows` one page at a time.
+
+        Args:
+            shard: If given, only invoices whose id falls into this shard are read.
+            page_size: Documents read per query.
+        """
+        query = self._unsynced_processed_query(shard).select(PROCESSED_INVOICE_ROW_FIELDS)
+        return self._paged(query, page_size, self._processed_invoice_row)
+
+    def _unsynced_processed_query(self, shard: Shard | None):
         self._check_client()
-        docs = self.client.collection("processed_invoices").where(
-            filter=firestore.FieldFilter("sync_status", "==", SyncStatus.NOT_SYNCED.value)
-        ).stream()
-        
-        unsynced = []
-        for doc in docs:
-            data = doc.to_dict()
-            inv_data = data['extracted_data']
-            
-            # Reconstruct nested objects
-            items = [InvoiceItem(**i) for i in inv_data.get('items', [])] if inv_data.get('items') else None
-            invoice_data = InvoiceData(
-                invoice_date=inv_data['invoice_date'],
-                category=inv_data['category'],
-                vendor_name=inv_data['vendor_name'],
-                net_amount=inv_data['net_amount'],
-                gross_amount=inv_data['gross_amount'],
-                invoice_number=inv_data['invoice_number'],
-                due_date=inv_data['due_date'],
-                items=items,
-                currency=inv_data.get('currency', 'PLN'),
-                tax_amount=inv_data.get('tax_amount', 0.0)
-            )
-            
-            processed = ProcessedInvoice(
-                id=data['id'],
-                raw_invoice_id=data['raw_invoice_id'],
-                extracted_data=invoice_data,
-                sync_status=SyncStatus(data['sync_status']),
-                created_at=data['created_at'],
-                updated_at=data['updated_at'],
-                error_message=data.get('error_message')
-            )
-            unsynced.append(processed)
-        return unsynced
+        collection_ref = self.client.collection("processed_invoices")
+        query = collection_ref.where(filter=firestore.FieldFilter("sync_status", "==", SyncStatus.NOT_SYNCED.value))
+        return self._in_shard(query, collection_ref, shard)
+
+    def claim_unsynced_processed_invoices(self, owner: str, limit: int, lease_seconds: int) -> list[ProcessedInvoice]:
+        """
+        Leases up to `limit` NOT_SYNCED processed invoices, or ones whose lease expired, to `owner`.
+
+        Args:
+            owner: Identifier of the claiming worker.
+            limit: Maximum number of invoices to claim.
+            lease_seconds: How long the invoices stay reserved for `owner`.
+
+        Returns:
+            The claimed invoices, with sync status IN_PROGRESS. Empty when nothing is left to claim.
+        """
+        claimed = self._claim(
+            "processed_invoices", "sync_status",
+            [SyncStatus.NOT_SYNCED.value], SyncStatus.IN_PROGRESS.value,
+            owner, limit, lease_seconds
+        )
+        return [self._processed_invoice_from_dict(data) for data in claimed]
 
     def update_processed_invoice_sync_status(self, invoice_id: str, status: str, error: str | None = None):
         """
@@ -191,7 +356,9 @@ class FirestoreAdapter(InvoiceRepository):
         
         update_data = {
             "sync_status": status,
-            "updated_at": datetime.now()
+            "updated_at": datetime.now(),
+            "lease_owner": firestore.DELETE_FIELD,
+            "lease_expires_at": firestore.DELETE_FIELD
         }
         if error:
             update_data["error_message"] = error
@@ -199,6 +366,110 @@ class FirestoreAdapter(InvoiceRepository):
         doc_ref.update(update_data)
         logger.info(f"Updated processed invoice {invoice_id} sync status to {status}.")
     
+    def update_processed_invoice_sync_statuses(self, updates: list[StatusUpdate]) -> dict[str, str]:
+        """
+        Updates the sync status of several processed invoices with a BulkWriter.
+
+        Args:
+            updates: Status changes to apply.
+
+        Returns:
+            Error messages of the updates that failed, keyed by invoice id.
+        """
+        return self._bulk_update("processed_invoices", "sync_status", updates)
+
+    def content_hash_processed(self, content_hash: str) -> bool:
+        """Check if a PDF with the given SHA-256 digest already produced a processed invoice."""
+        self._check_client()
+        docs = self.client.collection("raw_invoices").where(
+            filter=firestore.FieldFilter("email_data.content_hash", "==", content_hash)
+        ).where(
+            filter=firestore.FieldFilter("status", "==", ProcessingStatus.PROCESSED.value)
+        ).limit(1).stream()
+        
+        return any(True for _ in docs)
+
+    def get_cached_extraction(self, cache_key: str) -> dict | None:
+        """
+        Retrieves a cached LLM extraction result from Firestore.
+
+        Args:
+            cache_key: Key derived from the PDF content, prompt, categories and model.
+
+        Returns:
+            The extraction result, or None on a cache miss.
+        """
+        self._check_client()
+        doc = self.client.collection("extraction_cache").document(cache_key).get()
+        return doc.to_dict().get('result') if doc.exists else None
+
+    def save_cached_extraction(self, cache_key: str, data: dict):
+        """
+        Saves an LLM extraction result to the Firestore cache.
+
+        Args:
+            cache_key: Key derived from the PDF content, prompt, categories and model.
+            data: The extraction result.
+        """
+        self._check_client()
+        self.client.collection("extraction_cache").document(cache_key).set({
+            "result": data,
+            "created_at": datetime.now()
+        })
+
+    def get_vendor_layouts(self) -> dict[str, dict]:
+        """
+        Retrieves all learned text-layer vendor layouts from Firestore.
+
+        Returns:
+            Layouts keyed by vendor.
+        """
+        self._check_client()
+        return {doc.id: doc.to_dict().get('layout', {}) for doc in self.client.collection("vendor_layouts").stream()}
+
+    def save_vendor_layout(self, vendor_key: str, layout: dict):
+        """
+        Saves a learned text-layer layout for one vendor to Firestore.
+
+        Args:
+            vendor_key: Normalized vendor identifier.
+            layout: Extraction rules for the vendor's invoices.
+        """
+        self._check_client()
+        self.client.collection("vendor_layouts").document(vendor_key).set({
+            "layout": layout,
+            "updated_at": datetime.now()
+        })
+
+    def get_sync_checkpoint(self, name: str) -> str | None:
+        """
+        Retrieves a sync checkpoint (e.g. the last Gmail historyId) from Firestore.
+
+        Args:
+            name: Name of the checkpoint.
+
+        Returns:
+            The stored value, or None if the checkpoint was never saved.
+        """
+        self._check_client()
+        doc = self.client.collection("sync_checkpoints").document(name).get()
+        return doc.to_dict().get('value') if doc.exists else None
+
+    def save_sync_checkpoint(self, name: str, value: str):
+        """
+        Saves a sync checkpoint to Firestore.
+
+        Args:
+            name: Name of the checkpoint.
+            value: Checkpoint value.
+        """
+        self._check_client()
+        self.client.collection("sync_checkpoints").document(name).set({
+            "value": value,
+            "updated_at": datetime.now()
+        })
+        logger.info(f"Saved sync checkpoint {name}={value}.")
+    
     def invoice_number_exists(self, invoice_number: str) -> bool:
         """Check if an invoice with the given invoice number already exists."""
         self._check_client()
@@ -207,3 +478,246 @@ class FirestoreAdapter(InvoiceRepository):
         ).limit(1).stream()
         
         return any(True for _ in docs)
+
+    def get_invoice_keys(self, invoice_number: str | None = None) -> list[InvoiceKey]:
+        """
+        Retrieves the identifying fields of all processed invoices in one query.
+
+        Only vendor, number, gross amount and date are downloaded (projection),
+        not the whole documents.
+
+        Args:
+            invoice_number: If given, only invoices with exactly this number are read.
+
+        Returns:
+            Normalized keys of the processed invoices.
+        """
+        self._check_client()
+        query = self.client.collection("processed_invoices")
+        if invoice_number is not None:
+            query = query.where(filter=firestore.FieldFilter("extracted_data.invoice_number", "==", invoice_number))
+        docs = query.select([
+            "extracted_data.vendor_name",
+            "extracted_data.invoice_number",
+            "extracted_data.gross_amount",
+            "extracted_data.invoice_date"
+        ]).stream()
+        keys = []
+        for doc in docs:
+            inv_data = doc.to_dict().get('extracted_data') or {}
+            keys.append(InvoiceKey.from_fields(
+                inv_data.get('vendor_name'),
+                inv_data.get('invoice_number'),
+                inv_data.get('gross_amount'),
+                inv_data.get('invoice_date')
+            ))
+        return keys
+
+    def _bulk_update(self, collection: str, status_field: str, updates: list[StatusUpdate]) -> dict[str, str]:
+        """
+        Sends status updates through a BulkWriter, which packs them into batched
+        write RPCs. Unlike a WriteBatch, each document succeeds or fails on its
+        own; transient failures are retried, the rest are returned. Updates whose
+        lease was lost are not sent and are returned as failures.
+        """
+        self._check_client()
+        if not updates:
+            return {}
+        failures = {}
+
+        def on_error(failure, _writer) -> bool:
+            if failure.code in RETRYABLE_WRITE_CODES and failure.attempts < MAX_WRITE_ATTEMPTS:
+                return True
+            failures[failure.operation.reference.id] = failure.message
+            return False
+
+        collection_ref = self.client.collection(collection)
+        # Leased updates are only sent while the lease is held, with the read's update
+        # time as a precondition so a claim in between makes the write fail
+        owned = [collection_ref.document(update.invoice_id) for update in updates if update.lease_owner]
+        snapshots = {snapshot.id: snapshot for snapshot in self.client.get_all(owned, field_paths=["lease_owner"])} if owned else {}
+
+        writer = self.client.bulk_writer()
+        writer.on_write_error(on_error)
+        now = datetime.now()
+        for update in updates:
+            option = None
+            if update.lease_owner:
+                snapshot = snapshots.get(update.invoice_id)
+                if snapshot is None or not snapshot.exists or (snapshot.to_dict() or {}).get("lease_owner") != update.lease_owner:
+                    failures[update.invoice_id] = LEASE_LOST
+                    continue
+                option = self.client.write_option(last_update_time=snapshot.update_time)
+            data = {
+                status_field: update.status,
+                "updated_at": now,
+                "lease_owner": firestore.DELETE_FIELD,
+                "lease_expires_at": firestore.DELETE_FIELD
+            }
+            if update.error:
+                data["error_message"] = update.error
+            writer.update(collection_ref.document(update.invoice_id), data, option=option)
+        writer.close()
+
+        logger.info(f"Bulk updated {len(updates) - len(failures)}/{len(updates)} documents in {collection}.")
+        return failures
+
+    def _paged(self, query, page_size: int, to_row: Callable[[dict], object]) -> Iterator:
+        """
+        Reads `query` in pages ordered by document id, each starting after the last
+        document of the previous one. Every page is fetched completely before its
+        rows are yielded, so no stream stays open while the caller works on them.
+        """
+        query = query.order_by(FieldPath.document_id()).limit(page_size)
+        cursor = None
+        while True:
+            page = list((query.start_after(cursor) if cursor else query).stream())
+            for doc in page:
+                yield to_row(doc.to_dict())
+            if len(page) < page_size:
+                return
+            cursor = page[-1]
+
+    def _in_shard(self, query, collection_ref, shard: Shard | None):
+        """Restricts a query to the document-id range of `shard`; served by the single-field indexes."""
+        if shard is None or not shard.is_partial:
+            return query
+        lower, upper = shard.bounds()
+        if lower is not None:
+            query = query.where(filter=firestore.FieldFilter(FieldPath.document_id(), ">=", collection_ref.document(lower)))
+        if upper is not None:
+            query = query.where(filter=firestore.FieldFilter(FieldPath.document_id(), "<", collection_ref.document(upper)))
+        return query
+
+    def _claim(
+        self,
+        collection: str,
+        status_field: str,
+        claimable: list[str],
+        in_progress: str,
+        owner: str,
+        limit: int,
+        lease_seconds: int,
+        updated_before: datetime | None = None
+    ) -> list[dict]:
+        """
+        Moves up to `limit` documents to `in_progress` under a lease, in one transaction.
+
+        Candidates are read outside the transaction and checked again inside it,
+        so a document claimed by another worker in the meantime is skipped. If
+        every candidate was lost that way, the query is repeated (the lost ones
+        no longer match it), up to MAX_CLAIM_ROUNDS times. After that nothing is
+        returned and the remaining work is left to the workers that won it.
+        """
+        self._check_client()
+        collection_ref = self.client.collection(collection)
+        for _ in range(MAX_CLAIM_ROUNDS):
+            now = datetime.now(timezone.utc)
+            candidates = {}
+            # Leases abandoned by crashed or timed-out workers come first
+            expired = collection_ref.where(filter=firestore.FieldFilter("lease_expires_at", "<", now)).limit(limit)
+            for doc in expired.stream():
+                candidates[doc.id] = doc.reference
+            if len(candidates) < limit:
+                query = collection_ref.where(filter=firestore.FieldFilter(status_field, "in", claimable))
+                if updated_before:
+                    query = query.where(filter=firestore.FieldFilter("updated_at", "<", updated_before))
+                for doc in query.limit(limit - len(candidates)).stream():
+                    candidates.setdefault(doc.id, doc.reference)
+            if not candidates:
+                return []
+
+            lease = {
+                status_field: in_progress,
+                "lease_owner": owner,
+                "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                "updated_at": now
+            }
+
+            @firestore.transactional
+            def claim(transaction) -> list[dict]:
+                claimed = []
+                for snapshot in transaction.get_all(list(candidates.values())):
+                    data = snapshot.to_dict() if snapshot.exists else None
+                    if data and self._is_claimable(data, status_field, claimable, in_progress, now, updated_before):
+                        transaction.update(snapshot.reference, lease)
+                        claimed.append({**data, **lease})
+                return claimed
+
+            claimed = claim(self.client.transaction())
+            if claimed:
+                logger.info(f"{owner} claimed {len(claimed)} documents from {collection}.")
+                return claimed
+        logger.warning(f"{owner} lost every {collection} candidate to other workers {MAX_CLAIM_ROUNDS} times. Claiming nothing.")
+        return []
+
+    def _is_claimable(
+        self,
+        data: dict,
+        status_field: str,
+        claimable: list[str],
+        in_progress: str,
+        now: datetime,
+        updated_before: datetime | None
+    ) -> bool:
+        if data.get(status_field) == in_progress:
+            expires_at = data.get('lease_expires_at')
+            return expires_at is not None and expires_at < now
+        if data.get(status_field) not in claimable:
+            return False
+        return updated_before is None or data.get('updated_at') is None or data['updated_at'] < updated_before
+
+    def _raw_invoice_row(self, data: dict) -> RawInvoiceRow:
+        row = self._raw_invoice_from_dict(data, RawInvoiceRow)
+        row.loader = lambda: self._get_document("raw_invoices", row.id, self._raw_invoice_from_dict)
+        return row
+
+    def _processed_invoice_row(self, data: dict) -> ProcessedInvoiceRow:
+        row = self._processed_invoice_from_dict(data, ProcessedInvoiceRow)
+        row.loader = lambda: self._get_document("processed_invoices", row.id, self._processed_invoice_from_dict)
+        return row
+
+    def _get_document(self, collection: str, document_id: str, from_dict):
+        doc = self.client.collection(collection).document(document_id).get()
+        if not doc.exists:
+            raise KeyError(f"Document {collection}/{document_id} not found")
+        return from_dict(doc.to_dict())
+
+    def _raw_invoice_from_dict(self, data: dict, cls: type[RawInvoice] = RawInvoice) -> RawInvoice:
+        return cls(
+            id=data['id'],
+            email_id=data['email_id'],
+            email_data=Email(**data['email_data']),
+            status=ProcessingStatus(data['status']),
+            created_at=data['created_at'],
+            updated_at=data['updated_at'],
+            error_message=data.get('error_message')
+        )
+
+    def _processed_invoice_from_dict(self, data: dict, cls: type[ProcessedInvoice] = ProcessedInvoice) -> ProcessedInvoice:
+        inv_data = data['extracted_data']
+
+        # Reconstruct nested objects
+        items = [InvoiceItem(**i) for i in inv_data.get('items', [])] if inv_data.get('items') else None
+        invoice_data = InvoiceData(
+            invoice_date=inv_data['invoice_date'],
+            category=inv_data['category'],
+            vendor_name=inv_data['vendor_name'],
+            net_amount=inv_data['net_amount'],
+            gross_amount=inv_data['gross_amount'],
+            invoice_number=inv_data['invoice_number'],
+            due_date=inv_data['due_date'],
+            items=items,
+            currency=inv_data.get('currency', 'PLN'),
+            tax_amount=inv_data.get('tax_amount', 0.0)
+        )
+
+        return cls(
+            id=data['id'],
+            raw_invoice_id=data['raw_invoice_id'],
+            extracted_data=invoice_data,
+            sync_status=SyncStatus(data['sync_status']),
+            created_at=data['created_at'],
+            updated_at=data['updated_at'],
+            error_message=data.get('error_message')
+        )
@@ -1,23 +1,64 @@
 """Gemini LLM Adapter using google-genai SDK with structured output."""
+import hashlib
 import logging
-import base64
 import json
+import threading
+import time
+from datetime import datetime, timezone
 from pathlib import Path
 from google import genai
-from google.genai import types
+from google.genai import errors, types
 from src.ports.interfaces import LLMProvider
-from src.domain.invoice_schema import InvoiceExtraction
+from src.domain.invoice_schema import InvoiceExtraction, PackedInvoiceExtraction
+from src.domain.validation import validate_extraction
+from src.infrastructure.pdf_preprocessor import PdfPreprocessor
 from src.config import settings
 
 logger = logging.getLogger(__name__)
 
+EXTRACTION_PROMPT = "Extract the invoice information from this PDF."
+PACKED_EXTRACTION_PROMPT = (
+    "Each of the {count} PDF documents above is a separate invoice. "
+    "Extract the invoice information from every document and return exactly one entry per document, "
+    "with document_index set to the number of the document it comes from."
+)
+
+# Status codes of a request whose cached content expired or was deleted
+CACHED_CONTENT_GONE_CODES = {403, 404}
+
+# Batch jobs in these states will not change any more
+BATCH_DONE_STATES = {
+    types.JobState.JOB_STATE_SUCCEEDED,
+    types.JobState.JOB_STATE_PARTIALLY_SUCCEEDED,
+    types.JobState.JOB_STATE_FAILED,
+    types.JobState.JOB_STATE_CANCELLED,
+    types.JobState.JOB_STATE_EXPIRED,
+}
+
 class GeminiAdapter(LLMProvider):
     """Gemini LLM adapter for invoice extraction with structured output."""
-    
-    def __init__(self, api_key: str | None = None, model: str | None = None):
+
+    def __init__(
+        self,
+        api_key: str | None = None,
+        model: str | None = None,
+        context_cache: bool | None = None,
+        pack_size: int | None = None,
+        preprocessor: PdfPreprocessor | None = None
+    ):
         self.api_key = api_key or settings.gemini_api_key
         self.model_name = model or settings.gemini_model
-        
+        self.pack_size = pack_size or settings.gemini_pack_size
+        if preprocessor is None and settings.pdf_preprocess_enabled:
+            preprocessor = PdfPreprocessor(max_image_dpi=settings.pdf_max_image_dpi)
+        self.preprocessor = preprocessor
+        self.context_cache = settings.gemini_context_cache_enabled if context_cache is None else context_cache
+        # (mtime_ns, size) of the instruction and categories files -> the cached prompt prefix
+        self._instruction: tuple[tuple, str] | None = None
+        # Prompt version -> cached content name, or None if caching failed for it
+        self._cached_contents: dict[str, str | None] = {}
+        self._cache_lock = threading.Lock()
+
         if not self.api_key:
             logger.warning("No Gemini API key provided - running in mock mode")
             self.client = None
@@ -38,44 +79,380 @@ class GeminiAdapter(LLMProvider):
                 "invoice_number": "MOCK/001/2023",
                 "payment_date": "2023-11-10"
             }
-        
+
         try:
-            # Read PDF file
-            pdf_path = Path(file_path)
-            if not pdf_path.exists():
-                raise FileNotFoundError(f"PDF file not found: {file_path}")
-            
-            with open(pdf_path, "rb") as f:
-                pdf_data = base64.standard_b64encode(f.read()).decode("utf-8")
-            
-            # Load system instruction from file
-            system_instruction = settings.load_instruction()
-            
             # Generate content with structured output
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=[
-                    types.Part.from_bytes(
-                        data=base64.standard_b64decode(pdf_data),
-                        mime_type="application/pdf"
-                    ),
-                    "Extract the invoice information from this PDF."
-                ],
-                config=types.GenerateContentConfig(
-                    system_instruction=system_instruction,
-                    response_mime_type="application/json",
-                    response_schema=InvoiceExtraction
-                )
-            )
-            
+            pdf_part, reduced = self._prepared_pdf_part(file_path)
+            response = self._generate([pdf_part, EXTRACTION_PROMPT], InvoiceExtraction)
+
             # Parse response
             result = response.text
             logger.info(f"Successfully extracted invoice data from {file_path}")
             logger.debug(f"Raw response: {result}")
-            
+
             # The response should already be a JSON string matching our schema
-            return json.loads(result)
-            
+            extracted = json.loads(result)
+            if reduced and settings.pdf_preprocess_fallback and not self._is_plausible(extracted):
+                logger.warning(f"Extraction from the reduced {file_path} failed validation. Retrying with the full document.")
+                response = self._generate([self._pdf_part(file_path), EXTRACTION_PROMPT], InvoiceExtraction)
+                extracted = json.loads(response.text)
+            return extracted
+
         except Exception as e:
             logger.error(f"Failed to extract invoice data from {file_path}: {e}")
             raise
+
+    def extract_invoice_data_batch(self, file_paths: dict[str, str]) -> dict[str, dict | Exception]:
+        """
+        Extract invoice data for many PDFs with Gemini Batch API jobs.
+
+        Requests are inlined, so they are split into several jobs whenever their
+        encoded PDFs would exceed GEMINI_BATCH_MAX_REQUEST_BYTES (the API rejects
+        inline requests above ~20 MB). The jobs are polled until they finish and
+        cancelled if they do not finish in time. Items are mapped back to their keys
+        through the request metadata; items that fail are returned as exceptions.
+        Implausible results from reduced PDFs are re-extracted from the full
+        documents with synchronous requests, as in `extract_invoice_data`.
+        With a pack size above 1, the PDFs are instead sent as synchronous packed
+        requests (see `extract_invoice_data_packed`).
+
+        Raises:
+            RuntimeError: If a job as a whole fails, expires or times out.
+        """
+        if not self.client:
+            return super().extract_invoice_data_batch(file_paths)
+
+        if self.pack_size > 1:
+            items = list(file_paths.items())
+            results = {}
+            for start in range(0, len(items), self.pack_size):
+                results.update(self.extract_invoice_data_packed(dict(items[start:start + self.pack_size])))
+            return results
+
+        results: dict[str, dict | Exception] = {}
+        requests = []
+        sizes = []
+        reduced = set()
+        for key, file_path in file_paths.items():
+            try:
+                pdf, was_reduced = self._prepared_pdf_part(file_path)
+            except Exception as e:
+                results[key] = e
+                continue
+            if was_reduced:
+                reduced.add(key)
+            # Inline bytes are sent base64-encoded
+            size = len(pdf.inline_data.data) * 4 // 3
+            if size > settings.gemini_batch_max_request_bytes:
+                results[key] = ValueError(f"PDF is too large for an inline batch request ({size // 1024} KB encoded)")
+                continue
+            requests.append(types.InlinedRequest(
+                contents=[types.Content(role="user", parts=[pdf, types.Part.from_text(text=EXTRACTION_PROMPT)])],
+                metadata={"key": key},
+                config=self._generation_config()
+            ))
+            sizes.append(size)
+        if not requests:
+            return results
+
+        jobs = {}
+        for chunk in self._chunks_by_size(requests, sizes, settings.gemini_batch_max_request_bytes):
+            job = self.client.batches.create(
+                model=self.model_name,
+                src=chunk,
+                config=types.CreateBatchJobConfig(display_name=f"invoices-{datetime.now():%Y%m%d-%H%M%S}-{len(jobs) + 1}")
+            )
+            jobs[job.name] = (job, chunk)
+            logger.info(f"Submitted Gemini batch job {job.name} with {len(chunk)} invoices")
+
+        try:
+            finished = self._wait_for_batch_jobs([job for job, _ in jobs.values()])
+        except Exception:
+            self._cancel_batch_jobs(jobs)
+            raise
+
+        for job in finished:
+            chunk = jobs[job.name][1]
+            responses = job.dest.inlined_responses if job.dest and job.dest.inlined_responses else []
+            for request, inlined in zip(chunk, responses):
+                # Responses come back in request order; metadata is checked when echoed
+                key = (inlined.metadata or request.metadata)["key"]
+                if inlined.error:
+                    results[key] = RuntimeError(f"Batch item failed: {inlined.error.code} {inlined.error.message}")
+                    continue
+                try:
+                    results[key] = json.loads(inlined.response.text)
+                except Exception as e:
+                    results[key] = ValueError(f"Invalid batch response: {e}")
+
+        for request in requests:
+            results.setdefault(request.metadata["key"], RuntimeError("Missing response in batch output"))
+        self._retry_reduced_with_full_documents(results, file_paths, reduced)
+
+        failed = sum(isinstance(r, Exception) for r in results.values())
+        logger.info(f"Gemini batch jobs {', '.join(jobs)} finished: {len(results) - failed} extracted, {failed} failed")
+        return results
+
+    def _chunks_by_size(self, requests: list, sizes: list[int], max_bytes: int) -> list[list]:
+        """Splits requests into consecutive chunks whose inline payload stays within `max_bytes`."""
+        chunks, chunk, chunk_bytes = [], [], 0
+        for request, size in zip(requests, sizes):
+            if chunk and chunk_bytes + size > max_bytes:
+                chunks.append(chunk)
+                chunk, chunk_bytes = [], 0
+            chunk.append(request)
+            chunk_bytes += size
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def _wait_for_batch_jobs(self, jobs: list[types.BatchJob]) -> list[types.BatchJob]:
+        """
+        Polls the jobs until all of them have finished.
+
+        Raises:
+            RuntimeError: If a job fails as a whole, expires or the timeout passes.
+        """
+        deadline = time.monotonic() + settings.gemini_batch_timeout_seconds
+        jobs = list(jobs)
+        while any(job.state not in BATCH_DONE_STATES for job in jobs):
+            if time.monotonic() > deadline:
+                running = [job.name for job in jobs if job.state not in BATCH_DONE_STATES]
+                raise RuntimeError(f"Gemini batch jobs {', '.join(running)} did not finish in time")
+            time.sleep(settings.gemini_batch_poll_seconds)
+            jobs = [job if job.state in BATCH_DONE_STATES else self.client.batches.get(name=job.name) for job in jobs]
+
+        for job in jobs:
+            if job.state not in (types.JobState.JOB_STATE_SUCCEEDED, types.JobState.JOB_STATE_PARTIALLY_SUCCEEDED):
+                raise RuntimeError(f"Gemini batch job {job.name} ended in state {job.state}: {job.error}")
+        return jobs
+
+    def _cancel_batch_jobs(self, jobs: dict):
+        """Cancels submitted jobs that may still be running, so abandoned work is not billed."""
+        for name in jobs:
+            try:
+                self.client.batches.cancel(name=name)
+                logger.warning(f"Cancelled Gemini batch job {name}")
+            except Exception as e:
+                logger.warning(f"Could not cancel Gemini batch job {name}: {e}")
+
+    def extract_invoice_data_packed(self, file_paths: dict[str, str]) -> dict[str, dict | Exception]:
+        """
+        Extract several PDFs with one generate_content call and a list response schema.
+
+        Entries are mapped back to their files by `document_index`. If the model
+        returns a different number of entries, or indexes that do not match, every
+        file of the pack is re-extracted with its own request. Implausible results
+        from reduced PDFs are re-extracted from the full documents. A failed call
+        is returned as the exception of every file in the pack.
+        """
+        results: dict[str, dict | Exception] = {}
+        keys = []
+        contents = []
+        reduced = set()
+        for key, file_path in file_paths.items():
+            try:
+                pdf, was_reduced = self._prepared_pdf_part(file_path)
+            except Exception as e:
+                results[key] = e
+                continue
+            if was_reduced:
+                reduced.add(key)
+            keys.append(key)
+            contents += [types.Part.from_text(text=f"Document {len(keys)}:"), pdf]
+        if len(keys) < 2:
+            # Nothing to pack
+            return {**results, **super().extract_invoice_data_batch({key: file_paths[key] for key in keys})}
+
+        try:
+            response = self._generate(contents + [PACKED_EXTRACTION_PROMPT.format(count=len(keys))], list[PackedInvoiceExtraction])
+            entries = json.loads(response.text)
+        except Exception as e:
+            logger.error(f"Packed extraction of {len(keys)} invoices failed: {e}")
+            return {**results, **{key: e for key in keys}}
+
+        by_index = {entry.pop("document_index", None): entry for entry in entries}
+        if len(entries) != len(keys) or set(by_index) != set(range(1, len(keys) + 1)):
+            logger.warning(f"Packed response has {len(entries)} entries for {len(keys)} documents. Extracting them one by one.")
+            return {**results, **super().extract_invoice_data_batch({key: file_paths[key] for key in keys})}
+
+        logger.info(f"Extracted {len(keys)} invoices with one packed request")
+        for index, key in enumerate(keys, start=1):
+            results[key] = by_index[index]
+        return self._retry_reduced_with_full_documents(results, file_paths, reduced)
+
+    def _retry_reduced_with_full_documents(
+        self,
+        results: dict[str, dict | Exception],
+        file_paths: dict[str, str],
+        reduced: set[str]
+    ) -> dict[str, dict | Exception]:
+        """
+        Re-extracts, one request each, the reduced PDFs whose result failed validation.
+
+        Applies the `extract_invoice_data` fallback to packed and batch results;
+        a failed retry is returned as that file's exception.
+        """
+        if not settings.pdf_preprocess_fallback:
+            return results
+        for key in sorted(reduced):
+            if not isinstance(results.get(key), dict) or self._is_plausible(results[key]):
+                continue
+            logger.warning(f"Extraction from the reduced {file_paths[key]} failed validation. Retrying with the full document.")
+            try:
+                response = self._generate([self._pdf_part(file_paths[key]), EXTRACTION_PROMPT], InvoiceExtraction)
+                results[key] = json.loads(response.text)
+            except Exception as e:
+                logger.error(f"Failed to extract invoice data from {file_paths[key]}: {e}")
+                results[key] = e
+        return results
+
+    def _generate(self, contents: list, response_schema) -> types.GenerateContentResponse:
+        """
+        Calls generate_content with the shared extraction config.
+
+        If the cached prompt prefix has expired or was deleted, the handle is dropped
+        and the request is sent once more with the instruction inline.
+        """
+        config = self._generation_config(response_schema=response_schema)
+        try:
+            return self.client.models.generate_content(model=self.model_name, contents=contents, config=config)
+        except errors.ClientError as e:
+            if not (config.cached_content and e.code in CACHED_CONTENT_GONE_CODES):
+                raise
+            logger.warning(f"Cached content {config.cached_content} unusable ({e}). Retrying without it.")
+            self._forget_cached_content(config.cached_content)
+            return self.client.models.generate_content(
+                model=self.model_name,
+                contents=contents,
+                config=self._generation_config(use_cache=False, response_schema=response_schema)
+            )
+
+    def _pdf_part(self, file_path: str) -> types.Part:
+        """Reads a local PDF into a request part, unchanged."""
+        return types.Part.from_bytes(data=self._read_pdf(file_path), mime_type="application/pdf")
+
+    def _prepared_pdf_part(self, file_path: str) -> tuple[types.Part, bool]:
+        """
+        Reads a local PDF through the preprocessor, if one is configured.
+
+        Returns:
+            Tuple of (request part, whether the document was reduced).
+        """
+        data = self._read_pdf(file_path)
+        if not self.preprocessor:
+            return types.Part.from_bytes(data=data, mime_type="application/pdf"), False
+
+        prepared = self.preprocessor.prepare(data)
+        if prepared.changed:
+            logger.info(
+                f"Reduced {Path(file_path).name}: {prepared.kept_pages}/{prepared.original_pages} pages, "
+                f"{prepared.original_bytes // 1024} KB -> {len(prepared.data) // 1024} KB, "
+                f"~{prepared.tokens_saved} input tokens saved"
+            )
+        return types.Part.from_bytes(data=prepared.data, mime_type="application/pdf"), prepared.changed
+
+    def _read_pdf(self, file_path: str) -> bytes:
+        pdf_path = Path(file_path)
+        if not pdf_path.exists():
+            raise FileNotFoundError(f"PDF file not found: {file_path}")
+        return pdf_path.read_bytes()
+
+    def _is_plausible(self, extracted: dict) -> bool:
+        """Sanity check used to decide whether to retry with the full document."""
+        try:
+            validate_extraction(extracted)
+        except ValueError:
+            return False
+        return True
+
+    def _generation_config(self, use_cache: bool = True, response_schema=InvoiceExtraction) -> types.GenerateContentConfig:
+        """
+        Prompt prefix and structured output schema shared by all extraction requests.
+
+        With context caching enabled, a larger prefix (instruction, categories and
+        schema description) is referenced through a cached-content handle instead
+        of being sent with every request. Requests without a cache send the
+        instruction file unchanged. The response schema setting itself cannot be
+        cached and is always sent.
+        """
+        cached_content = self._cached_instruction(self._cache_prefix()) if use_cache and self.context_cache else None
+        if cached_content:
+            return types.GenerateContentConfig(
+                cached_content=cached_content,
+                response_mime_type="application/json",
+                response_schema=response_schema
+            )
+        return types.GenerateContentConfig(
+            system_instruction=settings.load_instruction(),
+            response_mime_type="application/json",
+            response_schema=response_schema
+        )
+
+    def _cache_prefix(self) -> str:
+        """
+        Builds the prompt prefix submitted for context caching: the instruction file,
+        the allowed categories and the output schema. Rebuilt only when a file changes.
+        """
+        version = tuple(
+            (stat.st_mtime_ns, stat.st_size)
+            for stat in (Path(settings.instruction_file).stat(), Path(settings.categories_file).stat())
+        )
+        if not self._instruction or self._instruction[0] != version:
+            categories = "\n".join(f"- {category}" for category in settings.load_categories())
+            schema = json.dumps(InvoiceExtraction.model_json_schema(), ensure_ascii=False, indent=2)
+            prefix = (
+                f"{settings.load_instruction().rstrip()}\n\n"
+                f"## Allowed categories\n{categories}\n\n"
+                f"## Output schema\n```json\n{schema}\n```\n"
+            )
+            self._instruction = (version, prefix)
+        return self._instruction[1]
+
+    def _cached_instruction(self, instruction: str) -> str | None:
+        """
+        Returns the cached-content name for this prompt prefix and model, creating it if needed.
+
+        An unexpired cache from an earlier run with the same prompt version is reused.
+        A prefix below the model's minimum cacheable size is not submitted at all;
+        then, or if caching fails, None is returned and requests send the instruction inline.
+        """
+        version = hashlib.sha256(f"{self.model_name}|{instruction}".encode("utf-8")).hexdigest()[:16]
+        display_name = f"invoice-extraction-{version}"
+        with self._cache_lock:
+            if version in self._cached_contents:
+                return self._cached_contents[version]
+            self._cached_contents[version] = None
+            try:
+                tokens = self.client.models.count_tokens(model=self.model_name, contents=instruction).total_tokens
+                if tokens < settings.gemini_context_cache_min_tokens:
+                    logger.info(
+                        f"Prompt prefix has {tokens} tokens, below the {settings.gemini_context_cache_min_tokens} "
+                        f"needed for context caching. Sending the instruction inline."
+                    )
+                    return None
+                now = datetime.now(timezone.utc)
+                cached = next((
+                    c for c in self.client.caches.list()
+                    if c.display_name == display_name and c.expire_time and c.expire_time > now
+                ), None)
+                if not cached:
+                    cached = self.client.caches.create(
+                        model=self.model_name,
+                        config=types.CreateCachedContentConfig(
+                            display_name=display_name,
+                            system_instruction=instruction,
+                            ttl=f"{settings.gemini_context_cache_ttl_seconds}s"
+                        )
+                    )
+                    logger.info(f"Created Gemini cached content {cached.name} ({tokens} tokens) for prompt version {version}")
+                self._cached_contents[version] = cached.name
+            except Exception as e:
+                logger.warning(f"Context caching unavailable, sending the instruction inline: {e}")
+            return self._cached_contents[version]
+
+    def _forget_cached_content(self, name: str):
+        with self._cache_lock:
+            for version, cached_name in list(self._cached_contents.items()):
+                if cached_name == name:
+                    del self._cached_contents[version]
@@ -2,9 +2,16 @@ import json
 import logging
 import os.path
 import base64
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
+import httplib2
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
@@ -20,11 +27,54 @@ logger = logging.getLogger(__name__)
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
 
+UNREAD_QUERY = 'is:unread has:attachment'
+
+# Partial response mask for messages.get: only the headers, labels, snippet and
+# part tree (two levels deep, without inline body data) that we actually read.
+_PART_FIELDS = "partId,mimeType,filename,body(attachmentId,size)"
+MESSAGE_FIELDS = f"id,labelIds,snippet,payload(headers(name,value),parts({_PART_FIELDS},parts({_PART_FIELDS})))"
+
+# Gmail rejects HTTP batches with more than 100 calls.
+MAX_BATCH_SIZE = 100
+
+# users.messages.batchModify accepts at most 1000 message IDs per call.
+MAX_BATCH_MODIFY_IDS = 1000
+
+class _ByteBudget:
+    """Caps the attachment bytes held in memory at once across download workers."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size: int):
+        # An attachment larger than the whole cap is let through alone
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight == 0 or self.in_flight + size <= self.limit)
+            self.in_flight += size
+
+    def release(self, size: int):
+        with self._condition:
+            self.in_flight -= size
+            self._condition.notify_all()
+
 class GmailAdapter(EmailProvider):
-    def __init__(self, credentials_path: str | None = None, token_path: str = "token.json", download_dir: str = "data/raw_pdfs", storage: FileStorage | None = None):
+    def __init__(self, credentials_path: str | None = None, token_path: str = "token.json", download_dir: str = "data/raw_pdfs", storage: FileStorage | None = None, batch_size: int | None = None, download_workers: int | None = None, max_inflight_bytes: int | None = None):
         self.credentials_path = credentials_path or settings.gmail_credentials_path
         self.token_path = token_path
         self.storage = storage or LocalFileStorage(base_dir=download_dir)
+        self.batch_size = min(settings.gmail_batch_size if batch_size is None else batch_size, MAX_BATCH_SIZE)
+        self.download_workers = settings.gmail_download_workers if download_workers is None else download_workers
+        self._byte_budget = _ByteBudget(settings.gmail_max_inflight_bytes if max_inflight_bytes is None else max_inflight_bytes)
+        self.round_trips = 0
+        self.response_bytes = 0
+        self.stage_timings: dict[str, float] = {}
+        self._failed_messages = 0
+        self._checkpoint = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._credentials = None
         self.service = self._authenticate()
         logger.info("Initialized GmailAdapter")
 
@@ -72,88 +122,372 @@ class GmailAdapter(EmailProvider):
                 with open(self.token_path, "w") as token:
                     token.write(creds.to_json())
         
+        self._credentials = creds
         return build("gmail", "v1", credentials=creds)
 
     def fetch_unread_emails_with_attachments(self) -> list[Email]:
+        return list(self.iter_unread_emails_with_attachments())
+
+    def iter_unread_emails_with_attachments(self, since_checkpoint: str | None = None) -> Iterator[Email]:
+        """
+        Pages through unread messages with attachments and yields an Email for
+        each one with a PDF, as soon as the attachment is saved.
+
+        Args:
+            since_checkpoint: Gmail historyId of a previous run. When given, only
+                messages added since then are fetched via `users.history.list`,
+                falling back to the full search if the checkpoint has expired.
+        """
+        self._checkpoint = None
         if not self.service:
             logger.warning("Gmail service not initialized. Returning empty list.")
-            return []
+            return
 
+        self.round_trips = 0
+        self.response_bytes = 0
+        self.stage_timings = {'metadata': 0.0, 'download': 0.0, 'upload': 0.0, 'throttle': 0.0}
+        self._failed_messages = 0
+        fetched = 0
+        started = time.perf_counter()
+        pool = ThreadPoolExecutor(max_workers=self.download_workers, thread_name_prefix="gmail-download") if self.download_workers > 1 else None
         try:
-            # Call the Gmail API
-            results = self.service.users().messages().list(userId='me', q='is:unread has:attachment').execute()
+            # Taken before listing so mail arriving mid-run is picked up next time
+            history_id = self._execute(self.service.users().getProfile(userId='me')).get('historyId')
+            
+            if since_checkpoint:
+                pages = self._iter_history_message_id_pages(since_checkpoint)
+            else:
+                pages = self._iter_message_id_pages(q=UNREAD_QUERY)
+            
+            for msg_ids in pages:
+                logger.info(f"Found {len(msg_ids)} unread messages with attachments.")
+                
+                if pool:
+                    emails = self._fetch_pooled(msg_ids, pool)
+                elif self.batch_size > 1:
+                    emails = self._fetch_batched(msg_ids)
+                else:
+                    emails = (self._process_message(msg_id) for msg_id in msg_ids)
+                
+                for email_data in emails:
+                    if email_data:
+                        fetched += 1
+                        yield email_data
+
+            if not self._failed_messages:
+                self._checkpoint = history_id
+
+        except HttpError as error:
+            logger.error(f"An error occurred: {error}")
+        finally:
+            if pool:
+                pool.shutdown(wait=True)
+        
+        logger.info(f"Fetched {fetched} emails in {self.round_trips} Gmail round trips, ~{self.response_bytes / 1024:.1f} KB downloaded.")
+        timings = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in self.stage_timings.items())
+        logger.info(f"Gmail stage timings (summed over {max(self.download_workers, 1)} workers): {timings}; wall {time.perf_counter() - started:.2f}s")
+
+    def get_sync_checkpoint(self) -> str | None:
+        return self._checkpoint
+
+    def _iter_message_id_pages(self, **query) -> Iterator[list[str]]:
+        """Yields message IDs of `messages.list` results page by page, following nextPageToken."""
+        page_token = None
+        while True:
+            if page_token:
+                query['pageToken'] = page_token
+            results = self._execute(self.service.users().messages().list(userId='me', **query))
             messages = results.get('messages', [])
             
-            emails = []
-            if not messages:
+            if not messages and not page_token:
                 logger.info("No unread messages found.")
-                return []
+            if messages:
+                yield [msg['id'] for msg in messages]
+            
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return
 
-            logger.info(f"Found {len(messages)} unread messages with attachments.")
+    def _iter_history_message_id_pages(self, start_history_id: str) -> Iterator[list[str]]:
+        """
+        Yields IDs of unread messages added since `start_history_id`, page by page.
+
+        Gmail keeps history for about a week; an expired checkpoint returns 404,
+        in which case this falls back to the full unread search.
+        """
+        seen = set()
+        page_token = None
+        while True:
+            query = {'startHistoryId': start_history_id, 'historyTypes': ['messageAdded'], 'labelId': 'UNREAD'}
+            if page_token:
+                query['pageToken'] = page_token
+            try:
+                results = self._execute(self.service.users().history().list(userId='me', **query))
+            except HttpError as error:
+                if error.resp.status != 404 or page_token:
+                    raise
+                logger.warning(f"History checkpoint {start_history_id} expired. Falling back to full search.")
+                yield from self._iter_message_id_pages(q=UNREAD_QUERY)
+                return
             
-            for msg in messages:
-                email_data = self._process_message(msg['id'])
-                if email_data:
-                    emails.append(email_data)
+            msg_ids = []
+            for record in results.get('history', []):
+                for added in record.get('messagesAdded', []):
+                    msg_id = added['message']['id']
+                    if msg_id not in seen:
+                        seen.add(msg_id)
+                        msg_ids.append(msg_id)
+            if msg_ids:
+                yield msg_ids
             
-            return emails
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                if not seen:
+                    logger.info(f"No new messages since history checkpoint {start_history_id}.")
+                return
 
-        except HttpError as error:
-            logger.error(f"An error occurred: {error}")
-            return []
+    def _execute(self, request, http=None):
+        """Executes a single API request or HTTP batch, counting it as one round trip."""
+        with self._lock:
+            self.round_trips += 1
+        response = request.execute(http=http) if http else request.execute()
+        self._count_bytes(response)
+        return response
+
+    def _count_bytes(self, response):
+        """Adds the approximate payload size (re-serialized JSON) of a response to `response_bytes`."""
+        if isinstance(response, dict):
+            size = len(json.dumps(response))
+            with self._lock:
+                self.response_bytes += size
+
+    def _get_message_request(self, msg_id: str):
+        """Builds a messages.get request restricted to the fields listed in MESSAGE_FIELDS."""
+        return self.service.users().messages().get(userId='me', id=msg_id, format='full', fields=MESSAGE_FIELDS)
+
+    def _count_failure(self):
+        with self._lock:
+            self._failed_messages += 1
+
+    @contextmanager
+    def _timed(self, stage: str):
+        """Adds the time spent in the block to `stage_timings[stage]`."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stage_timings[stage] = self.stage_timings.get(stage, 0.0) + time.perf_counter() - started
+
+    def _worker_http(self):
+        """httplib2 is not thread-safe, so each download worker gets its own authorized connection."""
+        if not self._credentials:
+            return None
+        if not hasattr(self._local, 'http'):
+            self._local.http = AuthorizedHttp(self._credentials, http=httplib2.Http())
+        return self._local.http
 
     def _process_message(self, msg_id: str) -> Email | None:
         try:
-            message = self.service.users().messages().get(userId='me', id=msg_id).execute()
-            payload = message['payload']
-            headers = payload.get('headers', [])
-            
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), "No Subject")
-            sender = next((h['value'] for h in headers if h['name'] == 'From'), "Unknown Sender")
-            date_str = next((h['value'] for h in headers if h['name'] == 'Date'), "")
+            with self._timed('metadata'):
+                message = self._execute(self._get_message_request(msg_id))
+            if not self._is_unread(message):
+                logger.info(f"Message {msg_id} was already read. Skipping.")
+                return None
             
-            # Parse date (simplified, might need robust parsing)
-            try:
-                email_date = datetime.strptime(date_str.split(',')[1].strip().split(' +')[0].split(' -')[0], "%d %b %Y %H:%M:%S")
-            except Exception:
-                email_date = datetime.now() # Fallback
+            pdf_part = self._find_pdf_part(message)
+            if not pdf_part:
+                logger.info(f"No PDF attachment found in message {msg_id}")
+                return None
 
-            parts = payload.get('parts', [])
-            
-            # Find PDF attachment
-            for part in parts:
-                if part.get('filename') and part['filename'].lower().endswith('.pdf'):
-                    filename = part['filename']
-                    attachment_id = part['body'].get('attachmentId')
-                    
-                    if attachment_id:
-                        attachment = self.service.users().messages().attachments().get(
-                            userId='me', messageId=msg_id, id=attachment_id
-                        ).execute()
-                        
-                        data = base64.urlsafe_b64decode(attachment['data'].encode('UTF-8'))
-                        
-                        # Save to storage
-                        safe_filename = f"{msg_id}_{filename}"
-                        file_path_str = self.storage.save_file(safe_filename, data)
-                        
-                        logger.info(f"Downloaded attachment: {safe_filename}")
-                        
-                        return Email(
-                            id=msg_id,
-                            sender=sender,
-                            subject=subject,
-                            date=email_date,
-                            attachment_path=file_path_str,
-                            content=message.get('snippet', "")
-                        )
-            
-            logger.info(f"No PDF attachment found in message {msg_id}")
+            with self._timed('download'):
+                attachment = self._execute(self.service.users().messages().attachments().get(
+                    userId='me', messageId=msg_id, id=pdf_part['body']['attachmentId']
+                ))
+            return self._build_email(msg_id, message, pdf_part['filename'], attachment)
+
+        except Exception as e:
+            logger.error(f"Failed to process message {msg_id}: {e}")
+            self._count_failure()
             return None
 
+    def _fetch_pooled(self, msg_ids: list[str], pool: ThreadPoolExecutor) -> Iterator[Email]:
+        """
+        Fetches message metadata, then downloads and stores PDF attachments on the worker pool.
+
+        Each worker downloads an attachment and hands it straight to storage, so
+        Gmail downloads overlap with storage uploads. New downloads are only
+        submitted while the attachment bytes in flight fit under the byte cap.
+        Emails are yielded as their workers finish.
+        """
+        if self.batch_size > 1:
+            with self._timed('metadata'):
+                messages = self._execute_batched(
+                    {msg_id: self._get_message_request(msg_id) for msg_id in msg_ids}
+                )
+        else:
+            messages = {}
+            for msg_id in msg_ids:
+                try:
+                    with self._timed('metadata'):
+                        messages[msg_id] = self._execute(self._get_message_request(msg_id))
+                except Exception as e:
+                    logger.error(f"Failed to process message {msg_id}: {e}")
+                    self._count_failure()
+
+        pending: list[Future] = []
+        for msg_id, part in self._select_pdf_parts(messages).items():
+            size = int(part['body'].get('size', 0))
+            with self._timed('throttle'):
+                self._byte_budget.acquire(size)
+            pending.append(pool.submit(self._download_and_save, msg_id, messages[msg_id], part, size))
+
+            # Hand over whatever has finished while further downloads are queued
+            for future in [f for f in pending if f.done()]:
+                pending.remove(future)
+                if email := future.result():
+                    yield email
+
+        for future in pending:
+            if email := future.result():
+                yield email
+
+    def _download_and_save(self, msg_id: str, message: dict, part: dict, size: int) -> Email | None:
+        """Runs on a download worker; releases the byte budget once the attachment is stored."""
+        try:
+            with self._timed('download'):
+                attachment = self._execute(self.service.users().messages().attachments().get(
+                    userId='me', messageId=msg_id, id=part['body']['attachmentId']
+                ), http=self._worker_http())
+            return self._build_email(msg_id, message, part['filename'], attachment)
         except Exception as e:
             logger.error(f"Failed to process message {msg_id}: {e}")
+            self._count_failure()
             return None
+        finally:
+            self._byte_budget.release(size)
+
+    def _fetch_batched(self, msg_ids: list[str]) -> list[Email]:
+        """
+        Fetches messages and their PDF attachments using Gmail HTTP batch requests.
+
+        Message metadata is fetched first, then the attachments, each in batches of
+        `batch_size` calls. Failures are logged per message, like in `_process_message`.
+        """
+        with self._timed('metadata'):
+            messages = self._execute_batched(
+                {msg_id: self._get_message_request(msg_id) for msg_id in msg_ids}
+            )
+
+        pdf_parts = self._select_pdf_parts(messages)
+
+        with self._timed('download'):
+            attachments = self._execute_batched({
+                msg_id: self.service.users().messages().attachments().get(
+                    userId='me', messageId=msg_id, id=part['body']['attachmentId']
+                )
+                for msg_id, part in pdf_parts.items()
+            })
+
+        emails = []
+        for msg_id in msg_ids:
+            if msg_id not in attachments:
+                continue
+            try:
+                emails.append(self._build_email(msg_id, messages[msg_id], pdf_parts[msg_id]['filename'], attachments[msg_id]))
+            except Exception as e:
+                logger.error(f"Failed to process message {msg_id}: {e}")
+                self._count_failure()
+        return emails
+
+    def _execute_batched(self, requests: dict) -> dict:
+        """
+        Executes requests keyed by message ID in HTTP batches of `batch_size`.
+
+        Returns:
+            Responses keyed by message ID. Failed requests are logged and left out.
+        """
+        responses = {}
+
+        def on_response(request_id, response, exception):
+            if exception:
+                logger.error(f"Failed to process message {request_id}: {exception}")
+                self._count_failure()
+            else:
+                self._count_bytes(response)
+                responses[request_id] = response
+
+        items = list(requests.items())
+        for start in range(0, len(items), self.batch_size):
+            batch = self.service.new_batch_http_request(callback=on_response)
+            for msg_id, request in items[start:start + self.batch_size]:
+                batch.add(request, request_id=msg_id)
+            try:
+                self._execute(batch)
+            except HttpError as error:
+                logger.error(f"Gmail batch request failed: {error}")
+        return responses
+
+    def _select_pdf_parts(self, messages: dict) -> dict:
+        """Returns the PDF attachment part of each unread message that has one, keyed by message ID."""
+        pdf_parts = {}
+        for msg_id, message in messages.items():
+            if not self._is_unread(message):
+                logger.info(f"Message {msg_id} was already read. Skipping.")
+                continue
+            pdf_part = self._find_pdf_part(message)
+            if pdf_part:
+                pdf_parts[msg_id] = pdf_part
+            else:
+                logger.info(f"No PDF attachment found in message {msg_id}")
+        return pdf_parts
+
+    def _is_unread(self, message: dict) -> bool:
+        """History results can include messages read since; the full search already excludes them."""
+        return 'UNREAD' in message.get('labelIds', ['UNREAD'])
+
+    def _find_pdf_part(self, message: dict) -> dict | None:
+        """Returns the first PDF attachment part of a message, if any, searching nested multiparts too."""
+        for part in message['payload'].get('parts', []):
+            if part.get('filename') and part['filename'].lower().endswith('.pdf') and part.get('body', {}).get('attachmentId'):
+                return part
+        for part in message['payload'].get('parts', []):
+            if nested := self._find_pdf_part({'payload': part}):
+                return nested
+        return None
+
+    def _build_email(self, msg_id: str, message: dict, filename: str, attachment: dict) -> Email:
+        """Saves the attachment to storage and builds the Email entity."""
+        headers = message['payload'].get('headers', [])
+        
+        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), "No Subject")
+        sender = next((h['value'] for h in headers if h['name'] == 'From'), "Unknown Sender")
+        date_str = next((h['value'] for h in headers if h['name'] == 'Date'), "")
+        
+        # Parse date (simplified, might need robust parsing)
+        try:
+            email_date = datetime.strptime(date_str.split(',')[1].strip().split(' +')[0].split(' -')[0], "%d %b %Y %H:%M:%S")
+        except Exception:
+            email_date = datetime.now() # Fallback
+
+        data = base64.urlsafe_b64decode(attachment['data'].encode('UTF-8'))
+        
+        # Save to storage under the content hash, so resent copies map to the same file
+        with self._timed('upload'):
+            file_path_str, content_hash = self.storage.save_content_addressed(filename, data)
+        
+        logger.info(f"Downloaded attachment {filename} from message {msg_id} (sha256 {content_hash[:12]})")
+        
+        return Email(
+            id=msg_id,
+            sender=sender,
+            subject=subject,
+            date=email_date,
+            attachment_path=file_path_str,
+            content=message.get('snippet', ""),
+            content_hash=content_hash,
+            attachment_filename=filename
+        )
 
     def mark_as_processed(self, email_id: str):
         if not self.service:
@@ -168,3 +502,18 @@ class GmailAdapter(EmailProvider):
             logger.info(f"Marked email {email_id} as processed (removed UNREAD label).")
         except HttpError as error:
             logger.error(f"An error occurred marking email as processed: {error}")
+
+    def mark_many_as_processed(self, email_ids: list[str]):
+        if not self.service:
+            return
+
+        for start in range(0, len(email_ids), MAX_BATCH_MODIFY_IDS):
+            chunk = email_ids[start:start + MAX_BATCH_MODIFY_IDS]
+            try:
+                self.service.users().messages().batchModify(
+                    userId='me',
+                    body={'ids': chunk, 'removeLabelIds': ['UNREAD']}
+                ).execute()
+                logger.info(f"Marked {len(chunk)} emails as processed (removed UNREAD label).")
+            except HttpError as error:
+                logger.error(f"An error occurred marking {len(chunk)} emails as processed: {error}")
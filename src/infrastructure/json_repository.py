@@ -1,23 +1,41 @@
 import json
 import logging
+import os
+import threading
+from functools import wraps
+from collections.abc import Iterator
 from pathlib import Path
 from typing import List
-from datetime import datetime, date
+from datetime import datetime, date, timedelta, timezone
 from dataclasses import asdict
 
 from src.ports.interfaces import InvoiceRepository
-from src.domain.entities import RawInvoice, ProcessedInvoice, ProcessingStatus, SyncStatus, Email, InvoiceData, InvoiceItem
+from src.domain.entities import RawInvoice, ProcessedInvoice, ProcessingStatus, SyncStatus, Email, InvoiceData, InvoiceItem, StatusUpdate, RawInvoiceRow, ProcessedInvoiceRow, LEASE_LOST
+from src.domain.duplicates import InvoiceKey
+from src.domain.sharding import Shard
 
 logger = logging.getLogger(__name__)
 
+def _locked(method):
+    """Serializes read-modify-write of the JSON files across worker threads."""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 class JsonInvoiceRepository(InvoiceRepository):
     """Local JSON-based implementation of InvoiceRepository for testing."""
     
     def __init__(self, data_dir: str = "data/db"):
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
         self.raw_invoices_file = self.data_dir / "raw_invoices.json"
         self.processed_invoices_file = self.data_dir / "processed_invoices.json"
+        self.sync_checkpoints_file = self.data_dir / "sync_checkpoints.json"
+        self.extraction_cache_file = self.data_dir / "extraction_cache.json"
+        self.vendor_layouts_file = self.data_dir / "vendor_layouts.json"
         
         self._init_db()
 
@@ -26,8 +44,14 @@ class JsonInvoiceRepository(InvoiceRepository):
             self._save_json(self.raw_invoices_file, [])
         if not self.processed_invoices_file.exists():
             self._save_json(self.processed_invoices_file, [])
+        if not self.sync_checkpoints_file.exists():
+            self._save_json(self.sync_checkpoints_file, {})
+        if not self.extraction_cache_file.exists():
+            self._save_json(self.extraction_cache_file, {})
+        if not self.vendor_layouts_file.exists():
+            self._save_json(self.vendor_layouts_file, {})
 
-    def _save_json(self, path: Path, data: list):
+    def _save_json(self, path: Path, data: list | dict):
         # Helper to serialize datetime and enums
         def default(o):
             if isinstance(o, (datetime, date)):
@@ -36,13 +60,17 @@ class JsonInvoiceRepository(InvoiceRepository):
                 return o.value
             return str(o)
 
-        with open(path, 'w', encoding='utf-8') as f:
+        # Write a sibling file and swap it in, so unlocked readers never see a half-written file
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, default=default, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
 
-    def _load_json(self, path: Path) -> list:
+    def _load_json(self, path: Path) -> list | dict:
         with open(path, 'r', encoding='utf-8') as f:
             return json.load(f)
 
+    @_locked
     def save_raw_invoice(self, invoice: RawInvoice):
         data = self._load_json(self.raw_invoices_file)
         # Check if exists
@@ -56,42 +84,67 @@ class JsonInvoiceRepository(InvoiceRepository):
         self._save_json(self.raw_invoices_file, data)
         logger.info(f"Saved raw invoice {invoice.id} to JSON DB.")
 
-    def get_pending_raw_invoices(self) -> List[RawInvoice]:
+    def get_pending_raw_invoices(self, statuses: list[ProcessingStatus] | None = None, shard: Shard | None = None) -> List[RawInvoice]:
+        status_values = {status.value for status in statuses or [ProcessingStatus.PENDING]}
         data = self._load_json(self.raw_invoices_file)
-        pending = []
-        for item in data:
-            if item['status'] == ProcessingStatus.PENDING.value:
-                # Reconstruct objects
-                email_data = item['email_data']
-                email = Email(**email_data)
-                # Fix datetime
-                if isinstance(email.date, str):
-                    email.date = datetime.fromisoformat(email.date)
-                
-                raw = RawInvoice(
-                    id=item['id'],
-                    email_id=item['email_id'],
-                    email_data=email,
-                    status=ProcessingStatus(item['status']),
-                    created_at=datetime.fromisoformat(item['created_at']),
-                    updated_at=datetime.fromisoformat(item['updated_at']),
-                    error_message=item.get('error_message')
-                )
-                pending.append(raw)
-        return pending
-
-    def update_raw_invoice_status(self, invoice_id: str, status: str, error: str | None = None):
+        return [
+            self._raw_invoice_from_dict(item) for item in data
+            if item['status'] in status_values and (shard is None or shard.contains(item['id']))
+        ]
+
+    def get_pending_raw_invoice_rows(self, statuses: list[ProcessingStatus] | None = None, shard: Shard | None = None) -> List[RawInvoiceRow]:
+        # The whole file is read anyway, so the rows are complete
+        status_values = {status.value for status in statuses or [ProcessingStatus.PENDING]}
+        data = self._load_json(self.raw_invoices_file)
+        return [
+            self._raw_invoice_from_dict(item, RawInvoiceRow) for item in data
+            if item['status'] in status_values and (shard is None or shard.contains(item['id']))
+        ]
+
+    def iter_pending_raw_invoice_rows(
+        self,
+        statuses: list[ProcessingStatus] | None = None,
+        shard: Shard | None = None,
+        page_size: int = 500
+    ) -> Iterator[RawInvoiceRow]:
+        # The file is read once when iteration starts; page_size does not apply
+        status_values = {status.value for status in statuses or [ProcessingStatus.PENDING]}
+        for item in self._load_json(self.raw_invoices_file):
+            if item['status'] in status_values and (shard is None or shard.contains(item['id'])):
+                yield self._raw_invoice_from_dict(item, RawInvoiceRow)
+
+    @_locked
+    def claim_raw_invoices(self, owner: str, limit: int, lease_seconds: int, updated_before: datetime | None = None) -> List[RawInvoice]:
+        claimed = self._claim(
+            self.raw_invoices_file, 'status',
+            [ProcessingStatus.PENDING.value, ProcessingStatus.RETRY.value], ProcessingStatus.IN_PROGRESS.value,
+            owner, limit, lease_seconds, updated_before
+        )
+        return [self._raw_invoice_from_dict(item) for item in claimed]
+
+    @_locked
+    def update_raw_invoice_status(self, invoice_id: str, status: str, error: str | None = None, lease_owner: str | None = None) -> bool:
         data = self._load_json(self.raw_invoices_file)
         for item in data:
             if item['id'] == invoice_id:
+                if lease_owner is not None and item.get('lease_owner') != lease_owner:
+                    logger.warning(f"{lease_owner} lost the lease on raw invoice {invoice_id}; status {status} not saved.")
+                    return False
                 item['status'] = status
                 item['updated_at'] = datetime.now().isoformat()
                 if error:
                     item['error_message'] = error
+                self._release(item)
                 break
         self._save_json(self.raw_invoices_file, data)
         logger.info(f"Updated raw invoice {invoice_id} status to {status}.")
+        return True
+
+    @_locked
+    def update_raw_invoice_statuses(self, updates: list[StatusUpdate]) -> dict[str, str]:
+        return self._bulk_update(self.raw_invoices_file, 'status', updates)
 
+    @_locked
     def save_processed_invoice(self, invoice: ProcessedInvoice):
         data = self._load_json(self.processed_invoices_file)
         if any(i['id'] == invoice.id for i in data):
@@ -102,35 +155,49 @@ class JsonInvoiceRepository(InvoiceRepository):
         self._save_json(self.processed_invoices_file, data)
         logger.info(f"Saved processed invoice {invoice.id} to JSON DB.")
 
-    def get_unsynced_processed_invoices(self) -> List[ProcessedInvoice]:
+    @_locked
+    def commit_processed_invoice(self, invoice: ProcessedInvoice, lease_owner: str | None = None) -> bool:
+        if lease_owner is not None:
+            raw = next((i for i in self._load_json(self.raw_invoices_file) if i['id'] == invoice.raw_invoice_id), {})
+            if raw.get('lease_owner') != lease_owner:
+                logger.warning(f"{lease_owner} lost the lease on raw invoice {invoice.raw_invoice_id}; processed invoice {invoice.id} not saved.")
+                return False
+        # Two files cannot be replaced atomically together; the processed invoice
+        # is written first so that an interruption can never lose extracted data
+        self.save_processed_invoice(invoice)
+        self.update_raw_invoice_status(invoice.raw_invoice_id, ProcessingStatus.PROCESSED.value)
+        return True
+
+    def get_unsynced_processed_invoices(self, shard: Shard | None = None) -> List[ProcessedInvoice]:
         data = self._load_json(self.processed_invoices_file)
-        unsynced = []
-        for item in data:
-            if item['sync_status'] == SyncStatus.NOT_SYNCED.value:
-                extracted_dict = item['extracted_data'].copy()
-                
-                if extracted_dict.get('items'):
-                    extracted_dict['items'] = [InvoiceItem(**i) for i in extracted_dict['items']]
-                
-                if isinstance(extracted_dict['invoice_date'], str):
-                    extracted_dict['invoice_date'] = datetime.fromisoformat(extracted_dict['invoice_date'])
-                if isinstance(extracted_dict['due_date'], str):
-                    extracted_dict['due_date'] = datetime.fromisoformat(extracted_dict['due_date'])
-                
-                invoice_data = InvoiceData(**extracted_dict)
-
-                processed = ProcessedInvoice(
-                    id=item['id'],
-                    raw_invoice_id=item['raw_invoice_id'],
-                    extracted_data=invoice_data,
-                    sync_status=SyncStatus(item['sync_status']),
-                    created_at=datetime.fromisoformat(item['created_at']),
-                    updated_at=datetime.fromisoformat(item['updated_at']),
-                    error_message=item.get('error_message')
-                )
-                unsynced.append(processed)
-        return unsynced
+        return [
+            self._processed_invoice_from_dict(item) for item in data
+            if item['sync_status'] == SyncStatus.NOT_SYNCED.value and (shard is None or shard.contains(item['id']))
+        ]
+
+    def iter_unsynced_processed_invoice_rows(self, shard: Shard | None = None, page_size: int = 500) -> Iterator[ProcessedInvoiceRow]:
+        # The file is read once when iteration starts; page_size does not apply
+        for item in self._load_json(self.processed_invoices_file):
+            if item['sync_status'] == SyncStatus.NOT_SYNCED.value and (shard is None or shard.contains(item['id'])):
+                yield self._processed_invoice_from_dict(item, ProcessedInvoiceRow)
 
+    def get_unsynced_processed_invoice_rows(self, shard: Shard | None = None) -> List[ProcessedInvoiceRow]:
+        data = self._load_json(self.processed_invoices_file)
+        return [
+            self._processed_invoice_from_dict(item, ProcessedInvoiceRow) for item in data
+            if item['sync_status'] == SyncStatus.NOT_SYNCED.value and (shard is None or shard.contains(item['id']))
+        ]
+
+    @_locked
+    def claim_unsynced_processed_invoices(self, owner: str, limit: int, lease_seconds: int) -> List[ProcessedInvoice]:
+        claimed = self._claim(
+            self.processed_invoices_file, 'sync_status',
+            [SyncStatus.NOT_SYNCED.value], SyncStatus.IN_PROGRESS.value,
+            owner, limit, lease_seconds
+        )
+        return [self._processed_invoice_from_dict(item) for item in claimed]
+
+    @_locked
     def update_processed_invoice_sync_status(self, invoice_id: str, status: str, error: str | None = None):
         data = self._load_json(self.processed_invoices_file)
         for item in data:
@@ -139,10 +206,52 @@ class JsonInvoiceRepository(InvoiceRepository):
                 item['updated_at'] = datetime.now().isoformat()
                 if error:
                     item['error_message'] = error
+                self._release(item)
                 break
         self._save_json(self.processed_invoices_file, data)
         logger.info(f"Updated processed invoice {invoice_id} sync status to {status}.")
     
+    @_locked
+    def update_processed_invoice_sync_statuses(self, updates: list[StatusUpdate]) -> dict[str, str]:
+        return self._bulk_update(self.processed_invoices_file, 'sync_status', updates)
+
+    def content_hash_processed(self, content_hash: str) -> bool:
+        """Check if a PDF with the given SHA-256 digest already produced a processed invoice."""
+        data = self._load_json(self.raw_invoices_file)
+        return any(
+            item['email_data'].get('content_hash') == content_hash
+            and item['status'] == ProcessingStatus.PROCESSED.value
+            for item in data
+        )
+
+    def get_cached_extraction(self, cache_key: str) -> dict | None:
+        return self._load_json(self.extraction_cache_file).get(cache_key)
+
+    @_locked
+    def save_cached_extraction(self, cache_key: str, data: dict):
+        cache = self._load_json(self.extraction_cache_file)
+        cache[cache_key] = data
+        self._save_json(self.extraction_cache_file, cache)
+
+    def get_vendor_layouts(self) -> dict[str, dict]:
+        return self._load_json(self.vendor_layouts_file)
+
+    @_locked
+    def save_vendor_layout(self, vendor_key: str, layout: dict):
+        layouts = self._load_json(self.vendor_layouts_file)
+        layouts[vendor_key] = layout
+        self._save_json(self.vendor_layouts_file, layouts)
+
+    def get_sync_checkpoint(self, name: str) -> str | None:
+        return self._load_json(self.sync_checkpoints_file).get(name)
+
+    @_locked
+    def save_sync_checkpoint(self, name: str, value: str):
+        data = self._load_json(self.sync_checkpoints_file)
+        data[name] = value
+        self._save_json(self.sync_checkpoints_file, data)
+        logger.info(f"Saved sync checkpoint {name}={value}.")
+    
     def invoice_number_exists(self, invoice_number: str) -> bool:
         """Check if an invoice with the given invoice number already exists."""
         data = self._load_json(self.processed_invoices_file)
@@ -150,3 +259,122 @@ class JsonInvoiceRepository(InvoiceRepository):
             item['extracted_data']['invoice_number'] == invoice_number 
             for item in data
         )
+
+    def get_invoice_keys(self, invoice_number: str | None = None) -> list[InvoiceKey]:
+        data = self._load_json(self.processed_invoices_file)
+        if invoice_number is not None:
+            data = [item for item in data if item['extracted_data'].get('invoice_number') == invoice_number]
+        return [
+            InvoiceKey.from_fields(
+                item['extracted_data'].get('vendor_name'),
+                item['extracted_data'].get('invoice_number'),
+                item['extracted_data'].get('gross_amount'),
+                item['extracted_data'].get('invoice_date')
+            )
+            for item in data
+        ]
+
+    def _bulk_update(self, path: Path, status_field: str, updates: list[StatusUpdate]) -> dict[str, str]:
+        """Applies all updates with one file load and one write. Callers hold the lock."""
+        data = self._load_json(path)
+        items = {item['id']: item for item in data}
+        now = datetime.now().isoformat()
+        failures = {}
+        for update in updates:
+            item = items.get(update.invoice_id)
+            if item is None:
+                failures[update.invoice_id] = "Document not found"
+                continue
+            if update.lease_owner and item.get('lease_owner') != update.lease_owner:
+                failures[update.invoice_id] = LEASE_LOST
+                continue
+            item[status_field] = update.status
+            item['updated_at'] = now
+            if update.error:
+                item['error_message'] = update.error
+            self._release(item)
+        self._save_json(path, data)
+        logger.info(f"Bulk updated {len(updates) - len(failures)}/{len(updates)} records in {path.name}.")
+        return failures
+
+    def _claim(
+        self,
+        path: Path,
+        status_field: str,
+        claimable: list[str],
+        in_progress: str,
+        owner: str,
+        limit: int,
+        lease_seconds: int,
+        updated_before: datetime | None = None
+    ) -> list[dict]:
+        """Moves up to `limit` records to `in_progress` under a lease. Callers hold the lock."""
+        now = datetime.now(timezone.utc)
+        data = self._load_json(path)
+        claimed = []
+        for item in data:
+            if len(claimed) >= limit:
+                break
+            if item[status_field] == in_progress:
+                expires_at = item.get('lease_expires_at')
+                if not expires_at or datetime.fromisoformat(expires_at) >= now:
+                    continue
+            elif item[status_field] not in claimable:
+                continue
+            elif updated_before and self._as_utc(item['updated_at']) >= updated_before:
+                continue
+            item[status_field] = in_progress
+            item['lease_owner'] = owner
+            item['lease_expires_at'] = (now + timedelta(seconds=lease_seconds)).isoformat()
+            item['updated_at'] = now.isoformat()
+            claimed.append(item)
+        if claimed:
+            self._save_json(path, data)
+            logger.info(f"{owner} claimed {len(claimed)} records from {path.name}.")
+        return claimed
+
+    def _release(self, item: dict):
+        item.pop('lease_owner', None)
+        item.pop('lease_expires_at', None)
+
+    def _as_utc(self, value: str) -> datetime:
+        # Older records hold naive local timestamps
+        return datetime.fromisoformat(value).astimezone(timezone.utc)
+
+    def _raw_invoice_from_dict(self, item: dict, cls: type[RawInvoice] = RawInvoice) -> RawInvoice:
+        # Reconstruct objects
+        email = Email(**item['email_data'])
+        # Fix datetime
+        if isinstance(email.date, str):
+            email.date = datetime.fromisoformat(email.date)
+
+        return cls(
+            id=item['id'],
+            email_id=item['email_id'],
+            email_data=email,
+            status=ProcessingStatus(item['status']),
+            created_at=datetime.fromisoformat(item['created_at']),
+            updated_at=datetime.fromisoformat(item['updated_at']),
+            error_message=item.get('error_message')
+        )
+
+    def _processed_invoice_from_dict(self, item: dict, cls: type[ProcessedInvoice] = ProcessedInvoice) -> ProcessedInvoice:
+        extracted_dict = item['extracted_data'].copy()
+
+        if extracted_dict.get('items'):
+            extracted_dict['items'] = [InvoiceItem(**i) for i in extracted_dict['items']]
+
+        if isinstance(extracted_dict['invoice_date'], str):
+            extracted_dict['invoice_date'] = datetime.fromisoformat(extracted_dict['invoice_date'])
+        if isinstance(extracted_dict['due_date'], str):
+            extracted_dict['due_date'] = datetime.fromisoformat(extracted_dict['due_date'])
+
+        return cls(
+            id=item['id'],
+            raw_invoice_id=item['raw_invoice_id'],
+            extracted_data=InvoiceData(**extracted_dict),
+            sync_status=SyncStatus(item['sync_status']),
+            created_at=datetime.fromisoformat(item['created_at']),
+            updated_at=datetime.fromisoformat(item['updated_at']),
+            error_message=item.get('error_message')
+        )
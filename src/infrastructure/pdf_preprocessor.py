@@ -0,0 +1,113 @@
+"""Shrinks invoice PDFs before they are sent to the LLM: drops appendix pages and downsamples large images."""
+import importlib.util
+import io
+import logging
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # Optional; without it PDFs are sent unchanged
+    PdfReader = PdfWriter = None
+    logger.warning("pypdf is not installed - PDFs are sent to the LLM unchanged")
+
+# pypdf needs Pillow to decode and re-encode embedded images
+if importlib.util.find_spec("PIL") is None:
+    logger.warning("Pillow is not installed - embedded PDF images are not downsampled")
+
+# Gemini bills every PDF page as one image of this many input tokens
+TOKENS_PER_PAGE = 258
+# Text that marks the page holding the invoice totals
+TOTALS_KEYWORDS = ('razem', 'ogółem', 'do zapłaty', 'suma', 'total')
+
+
+@dataclass(slots=True)
+class PreparedPdf:
+    """
+    Result of preprocessing one PDF.
+
+    Attributes:
+        data: The bytes to send (the original bytes if nothing could be saved).
+        original_pages: Page count of the original document.
+        kept_pages: Page count of `data`.
+        original_bytes: Size of the original document.
+    """
+    data: bytes
+    original_pages: int
+    kept_pages: int
+    original_bytes: int
+
+    @property
+    def changed(self) -> bool:
+        return len(self.data) != self.original_bytes or self.kept_pages != self.original_pages
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - len(self.data)
+
+    @property
+    def tokens_saved(self) -> int:
+        """Estimated input tokens saved by the dropped pages."""
+        return (self.original_pages - self.kept_pages) * TOKENS_PER_PAGE
+
+
+class PdfPreprocessor:
+    """
+    Keeps only the pages with header and totals data and downsamples embedded images.
+
+    The first page (header) is always kept, plus every page whose text layer
+    contains a totals keyword. Documents without a text layer, or without any
+    totals keyword, keep all pages. Images wider or taller than `max_image_dpi`
+    at the page size are resized (needs Pillow). Any error returns the original.
+    """
+
+    def __init__(self, max_image_dpi: int = 150, totals_keywords: tuple[str, ...] = TOTALS_KEYWORDS):
+        self.max_image_dpi = max_image_dpi
+        self.totals_keywords = totals_keywords
+
+    def prepare(self, data: bytes) -> PreparedPdf:
+        """Returns the reduced document, or the original bytes if it cannot be reduced."""
+        if PdfReader is None:
+            return PreparedPdf(data, 0, 0, len(data))
+        try:
+            reader = PdfReader(io.BytesIO(data))
+            pages = self._select_pages(reader)
+            writer = PdfWriter()
+            for index in pages:
+                writer.add_page(reader.pages[index])
+            for page in writer.pages:
+                self._downsample_images(page)
+            output = io.BytesIO()
+            writer.write(output)
+        except Exception as e:
+            logger.warning(f"PDF preprocessing failed, sending the original document: {e}")
+            return PreparedPdf(data, 0, 0, len(data))
+
+        original_pages = len(reader.pages)
+        if len(pages) == original_pages and len(output.getvalue()) >= len(data):
+            return PreparedPdf(data, original_pages, original_pages, len(data))
+        return PreparedPdf(output.getvalue(), original_pages, len(pages), len(data))
+
+    def _select_pages(self, reader) -> list[int]:
+        texts = [(page.extract_text() or "").lower() for page in reader.pages]
+        totals = [index for index, text in enumerate(texts) if any(keyword in text for keyword in self.totals_keywords)]
+        if not totals:
+            # A scan, or a layout we cannot judge
+            return list(range(len(texts)))
+        return sorted({0, *totals})
+
+    def _downsample_images(self, page):
+        # Page size is in points (1/72 inch); an image cannot usefully exceed the page at max DPI
+        max_width = float(page.mediabox.width) / 72 * self.max_image_dpi
+        max_height = float(page.mediabox.height) / 72 * self.max_image_dpi
+        for image in page.images:
+            try:
+                width, height = image.image.size
+                scale = min(max_width / width, max_height / height)
+                if scale >= 1:
+                    continue
+                resized = image.image.resize((max(1, int(width * scale)), max(1, int(height * scale))))
+                image.replace(resized, quality=85)
+            except Exception as e:
+                logger.debug(f"Could not downsample image {image.name}: {e}")
@@ -1,9 +1,21 @@
+import hashlib
 import logging
 from pathlib import Path
 from src.ports.interfaces import FileStorage
 
 logger = logging.getLogger(__name__)
 
+def content_address(content: bytes) -> tuple[str, str]:
+    """
+    Returns the storage key and SHA-256 digest for content-addressed storage.
+
+    The key depends on the bytes alone (`sha256/<digest>.pdf`), so the same PDF
+    received under different filenames is stored once. Callers keep the
+    original filename as metadata.
+    """
+    digest = hashlib.sha256(content).hexdigest()
+    return f"sha256/{digest}.pdf", digest
+
 class LocalFileStorage(FileStorage):
     def __init__(self, base_dir: str = "data/raw_pdfs"):
         self.base_dir = Path(base_dir)
@@ -16,6 +28,15 @@ class LocalFileStorage(FileStorage):
         logger.info(f"Saved file locally: {file_path}")
         return str(file_path.absolute())
 
+    def save_content_addressed(self, filename: str, content: bytes) -> tuple[str, str]:
+        key, digest = content_address(content)
+        file_path = self.base_dir / key
+        if file_path.exists():
+            logger.info(f"File already stored: {file_path}")
+            return str(file_path.absolute()), digest
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        return self.save_file(key, content), digest
+
 class GCSFileStorage(FileStorage):
     def __init__(self, bucket_name: str):
         from google.cloud import storage
@@ -33,3 +54,16 @@ class GCSFileStorage(FileStorage):
         gcs_uri = f"gs://{self.bucket_name}/{filename}"
         logger.info(f"Saved file to GCS: {gcs_uri}")
         return gcs_uri
+
+    def save_content_addressed(self, filename: str, content: bytes) -> tuple[str, str]:
+        key, digest = content_address(content)
+        gcs_uri = f"gs://{self.bucket_name}/{key}"
+        blob = self.bucket.blob(key)
+        if blob.exists():
+            logger.info(f"File already stored in GCS: {gcs_uri}")
+            return gcs_uri, digest
+        # The filename the PDF was first received under, for people browsing the bucket
+        blob.metadata = {"filename": filename}
+        blob.upload_from_string(content, content_type="application/pdf")
+        logger.info(f"Saved file to GCS: {gcs_uri}")
+        return gcs_uri, digest
@@ -0,0 +1,269 @@
+"""Text-layer fast path for LLMProvider: extracts repeat-vendor invoices with learned layout rules."""
+import logging
+import re
+import threading
+from collections.abc import Callable
+from datetime import datetime
+from src.ports.interfaces import LLMProvider, InvoiceRepository
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # Optional; without it every invoice goes to the wrapped provider
+    PdfReader = None
+    logger.warning("pypdf is not installed - text-layer fast path disabled")
+
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y', '%d-%m-%Y', '%d/%m/%Y', '%Y.%m.%d')
+DATE_PATTERN = re.compile(r'\d{1,4}[.\-/]\d{1,2}[.\-/]\d{1,4}')
+AMOUNT_PATTERN = re.compile(r'-?\d{1,3}(?:[ \u00a0.]\d{3})+,\d{2}|-?\d{1,3}(?:[ \u00a0,]\d{3})+\.\d{2}|-?\d+[.,]\d{2}')
+TOKEN_PATTERN = re.compile(r'\S+')
+
+# Extraction fields located in the text layer, with the kind of token holding their value
+FIELD_KINDS = {
+    'invoice_number': 'token',
+    'invoice_date': 'date',
+    'payment_date': 'date',
+    'net_amount': 'amount',
+    'gross_amount': 'amount',
+}
+KIND_PATTERNS = {'token': TOKEN_PATTERN, 'date': DATE_PATTERN, 'amount': AMOUNT_PATTERN}
+# How many lines above its value a label may be printed
+MAX_LABEL_DISTANCE = 3
+
+
+def extract_text_layer(file_path: str) -> str:
+    """Returns the embedded text of a PDF, or an empty string for scans or when pypdf is missing."""
+    if PdfReader is None:
+        return ""
+    try:
+        return "\n".join(page.extract_text() or "" for page in PdfReader(file_path).pages)
+    except Exception as e:
+        logger.debug(f"Could not read text layer of {file_path}: {e}")
+        return ""
+
+
+def parse_amount(token: str) -> float:
+    """Parses '1 234,56', '1.234,56', '1,234.56' or '1234.56' into a float."""
+    token = token.replace(' ', '').replace('\u00a0', '')
+    decimal_mark = token[-3]
+    thousands_mark = ',' if decimal_mark == '.' else '.'
+    return float(token.replace(thousands_mark, '').replace(decimal_mark, '.'))
+
+
+class TextLayerLLMProvider(LLMProvider):
+    """
+    Skips the wrapped LLMProvider for digital PDFs from vendors with a known layout.
+
+    Every LLM result is used to learn a layout for its vendor: for each field,
+    the label that starts the line holding the value (or a line just above it)
+    and the value's position on that line. A layout is trusted once it has reproduced the LLM result for
+    `min_confirmations` consecutive invoices; from then on a PDF whose text
+    layer names the vendor is extracted from the text alone, provided every
+    field is found and the amounts are consistent. Anything else falls back to
+    the wrapped provider.
+    """
+
+    def __init__(
+        self,
+        llm_provider: LLMProvider,
+        invoice_repo: InvoiceRepository | None = None,
+        min_confirmations: int = 2,
+        text_extractor: Callable[[str], str] = extract_text_layer
+    ):
+        self.llm_provider = llm_provider
+        self.invoice_repo = invoice_repo
+        self.min_confirmations = min_confirmations
+        self.text_extractor = text_extractor
+        self.stats = {'text_layer_hits': 0, 'llm_calls': 0}
+        self._layouts: dict[str, dict] | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def hit_rate(self) -> float:
+        """Share of extractions served from the text layer."""
+        total = self.stats['text_layer_hits'] + self.stats['llm_calls']
+        return self.stats['text_layer_hits'] / total if total else 0.0
+
+    def extract_invoice_data(self, file_path: str) -> dict:
+        """Extract from the text layer when the vendor layout is trusted, otherwise call the wrapped provider."""
+        text = self.text_extractor(file_path)
+        result = self._extract_from_text(text)
+        if result is not None:
+            logger.info(f"Extracted {file_path} from its text layer ({result['vendor']})")
+            return result
+
+        with self._lock:
+            self.stats['llm_calls'] += 1
+        result = self.llm_provider.extract_invoice_data(file_path)
+        self._learn(text, result)
+        return result
+
+    def extract_invoice_data_batch(self, file_paths: dict[str, str]) -> dict[str, dict | Exception]:
+        """Serve recognized layouts from the text layer and send the rest to the wrapped provider in one bulk call."""
+        results: dict[str, dict | Exception] = {}
+        texts = {}
+        for key, file_path in file_paths.items():
+            texts[key] = self.text_extractor(file_path)
+            result = self._extract_from_text(texts[key])
+            if result is not None:
+                results[key] = result
+
+        misses = {key: path for key, path in file_paths.items() if key not in results}
+        if misses:
+            with self._lock:
+                self.stats['llm_calls'] += len(misses)
+            for key, result in self.llm_provider.extract_invoice_data_batch(misses).items():
+                if not isinstance(result, Exception):
+                    self._learn(texts.get(key, ""), result)
+                results[key] = result
+        return results
+
+    def _extract_from_text(self, text: str) -> dict | None:
+        """Returns the extraction from a trusted vendor layout, or None if the text is not confident enough."""
+        if not text:
+            return None
+        lines = text.splitlines()
+        with self._lock:
+            layouts = list(self._get_layouts().values())
+        for layout in layouts:
+            if layout['confirmations'] < self.min_confirmations or layout['signature'].lower() not in text.lower():
+                continue
+            result = self._apply_layout(layout, lines)
+            if result is not None:
+                with self._lock:
+                    self.stats['text_layer_hits'] += 1
+                return result
+        return None
+
+    def _apply_layout(self, layout: dict, lines: list[str]) -> dict | None:
+        result = {'vendor': layout['vendor'], 'category': layout['category']}
+        for field, rule in layout['fields'].items():
+            value = self._read_field(rule, FIELD_KINDS[field], lines)
+            if value is None:
+                return None
+            result[field] = value
+        if not (0 < result['net_amount'] <= result['gross_amount']):
+            return None
+        return result
+
+    def _read_field(self, rule: dict, kind: str, lines: list[str]) -> str | float | None:
+        """
+        Reads one field from the first line starting with `rule['anchor']`.
+
+        The value is the token at `rule['index']` after the anchor, or, for labels
+        printed above their value, on the line `rule['offset']` lines further down.
+        """
+        for position, line in enumerate(lines):
+            stripped = line.strip()
+            if not stripped.startswith(rule['anchor']):
+                continue
+            offset = rule.get('offset', 0)
+            if position + offset >= len(lines):
+                return None
+            target = stripped[len(rule['anchor']):] if offset == 0 else lines[position + offset].strip()
+            tokens = KIND_PATTERNS[kind].findall(target)
+            if rule['index'] >= len(tokens):
+                return None
+            token = tokens[rule['index']]
+            try:
+                if kind == 'date':
+                    return datetime.strptime(token, rule['format']).strftime('%Y-%m-%d')
+                if kind == 'amount':
+                    return parse_amount(token)
+            except ValueError:
+                return None
+            return token
+        return None
+
+    def _learn(self, text: str, result: dict):
+        """Derives a layout from an LLM result and confirms or replaces the vendor's current one."""
+        vendor = str(result.get('vendor') or '').strip()
+        if not text or not vendor or vendor.lower() not in text.lower():
+            return
+        lines = text.splitlines()
+        fields = {}
+        for field, kind in FIELD_KINDS.items():
+            rule = self._find_rule(result.get(field), kind, lines)
+            if rule is None:
+                return
+            fields[field] = rule
+
+        vendor_key = re.sub(r'\W+', '_', vendor.lower()).strip('_')
+        with self._lock:
+            layouts = self._get_layouts()
+            current = layouts.get(vendor_key)
+            if current and current['fields'] == fields and current['category'] == result.get('category'):
+                layout = {**current, 'confirmations': current['confirmations'] + 1}
+            else:
+                layout = {'vendor': vendor, 'signature': vendor, 'category': result.get('category'), 'fields': fields, 'confirmations': 1}
+            layouts[vendor_key] = layout
+        if self.invoice_repo:
+            try:
+                self.invoice_repo.save_vendor_layout(vendor_key, layout)
+            except Exception as e:
+                logger.warning(f"Failed to save text-layer layout for {vendor}: {e}")
+
+    def _find_rule(self, value, kind: str, lines: list[str]) -> dict | None:
+        """Finds a rule that reads `value` back from the text, checked by applying it."""
+        if value is None:
+            return None
+        for position in range(len(lines)):
+            for anchor, offset, target in self._label_candidates(lines, position, value, kind):
+                for index, token in enumerate(KIND_PATTERNS[kind].findall(target)):
+                    rule = self._rule_for_token(token, value, kind, anchor, index)
+                    if not rule:
+                        continue
+                    if offset:
+                        rule['offset'] = offset
+                    if self._read_field(rule, kind, lines) == self._normalize(value, kind):
+                        return rule
+        return None
+
+    def _label_candidates(self, lines: list[str], position: int, value, kind: str):
+        """Yields (anchor, offset, text after the anchor) for labels that may belong to the value on this line."""
+        stripped = lines[position].strip()
+        # The line's leading label, or for free-form tokens whatever precedes the value
+        anchors = {re.match(r'\D*', stripped).group().strip()}
+        if kind == 'token' and str(value) in stripped:
+            anchors.add(stripped[:stripped.index(str(value))].strip())
+        for anchor in filter(None, anchors):
+            yield anchor, 0, stripped[len(anchor):]
+        # Labels printed on one of the preceding lines
+        for offset in range(1, MAX_LABEL_DISTANCE + 1):
+            if position - offset < 0:
+                break
+            anchor = re.match(r'\D*', lines[position - offset].strip()).group().strip()
+            if anchor:
+                yield anchor, offset, stripped
+
+    def _rule_for_token(self, token: str, value, kind: str, anchor: str, index: int) -> dict | None:
+        if kind == 'token':
+            return {'anchor': anchor, 'index': index} if token == str(value) else None
+        if kind == 'amount':
+            try:
+                matches = abs(parse_amount(token) - float(value)) < 0.005
+            except (ValueError, TypeError):
+                return None
+            return {'anchor': anchor, 'index': index} if matches else None
+        for fmt in DATE_FORMATS:
+            try:
+                if datetime.strptime(token, fmt).strftime('%Y-%m-%d') == str(value):
+                    return {'anchor': anchor, 'index': index, 'format': fmt}
+            except ValueError:
+                continue
+        return None
+
+    def _normalize(self, value, kind: str):
+        return float(value) if kind == 'amount' else str(value)
+
+    def _get_layouts(self) -> dict[str, dict]:
+        """Loads the stored layouts once per run. Callers hold `_lock`."""
+        if self._layouts is None:
+            self._layouts = {}
+            if self.invoice_repo:
+                try:
+                    self._layouts = dict(self.invoice_repo.get_vendor_layouts())
+                except Exception as e:
+                    logger.warning(f"Failed to load text-layer layouts: {e}")
+        return self._layouts
@@ -9,10 +9,17 @@ from src.services.retrieval_service import RetrievalService
 from src.services.processing_service import ProcessingService
 from src.services.sheets_service import SheetsService
 from src.services.notification_service import NotificationService
+from src.services.rate_limiter import RateLimiter, AdaptiveLimiter
+from src.services.pipeline import PipelineRunner
+from src.services.leases import RetrievalBarrier
+from src.domain.sharding import Shard
 
 from src.infrastructure.gmail_adapter import GmailAdapter
 from src.infrastructure.firestore_adapter import FirestoreAdapter
 from src.infrastructure.gemini_adapter import GeminiAdapter
+from src.infrastructure.cached_llm_provider import CachedLLMProvider
+from src.infrastructure.cascade_llm_provider import CascadeLLMProvider
+from src.infrastructure.text_layer_llm_provider import TextLayerLLMProvider
 from src.infrastructure.sheets_adapter import GoogleSheetsAdapter
 from src.infrastructure.email_notification_adapter import EmailNotificationAdapter
 from src.infrastructure.storage import LocalFileStorage, GCSFileStorage
@@ -36,27 +43,121 @@ def main():
 
     email_provider = GmailAdapter(storage=storage)
     invoice_repo = FirestoreAdapter()
-    llm_provider = GeminiAdapter()
+    cascade = None
+    cascade_models = settings.get_cascade_models()
+    if cascade_models:
+        cascade = CascadeLLMProvider([GeminiAdapter(model=model) for model in cascade_models])
+        llm_provider = cascade
+    else:
+        llm_provider = GeminiAdapter()
+    # Mock-mode results (no API key) must never end up in the persistent cache
+    if settings.extraction_cache_enabled and settings.gemini_api_key:
+        llm_provider = CachedLLMProvider(llm_provider, invoice_repo=invoice_repo)
+    if settings.text_layer_enabled:
+        llm_provider = TextLayerLLMProvider(
+            llm_provider,
+            invoice_repo=invoice_repo,
+            min_confirmations=settings.text_layer_min_confirmations
+        )
     sheets_provider = GoogleSheetsAdapter()
     notification_provider = EmailNotificationAdapter()
 
     # Initialize Services
-    retrieval_service = RetrievalService(email_provider, invoice_repo)
-    processing_service = ProcessingService(invoice_repo, llm_provider)
-    sheets_service = SheetsService(invoice_repo, sheets_provider)
+    if settings.gemini_batch_size > 1 and settings.claim_batch_size > 0 and settings.gemini_batch_timeout_seconds > settings.claim_lease_seconds:
+        # Claimed invoices would be taken over by another task while their Batch API job is still running
+        raise ValueError(
+            "GEMINI_BATCH_SIZE with CLAIM_BATCH_SIZE needs CLAIM_LEASE_SECONDS of at least GEMINI_BATCH_TIMEOUT_SECONDS"
+        )
+    shard = Shard.from_env()
+    retrieval_service = RetrievalService(email_provider, invoice_repo, incremental=settings.gmail_incremental_sync)
+    rate_limiter = RateLimiter(
+        requests_per_minute=settings.gemini_requests_per_minute,
+        tokens_per_minute=settings.gemini_tokens_per_minute,
+        tokens_per_request=settings.gemini_tokens_per_request
+    )
+    processing_service = ProcessingService(
+        invoice_repo,
+        llm_provider,
+        # Packed requests are sent through the same bulk path as Batch API jobs
+        batch_size=settings.gemini_batch_size or settings.gemini_pack_size,
+        max_workers=settings.gemini_max_workers,
+        rate_limiter=rate_limiter,
+        concurrency_limiter=AdaptiveLimiter(
+            max_limit=settings.gemini_max_workers,
+            pause_seconds=settings.gemini_throttle_pause_seconds,
+            max_pause_seconds=settings.gemini_max_throttle_pause_seconds
+        ),
+        max_attempts=settings.gemini_max_attempts,
+        claim_size=settings.claim_batch_size,
+        lease_seconds=settings.claim_lease_seconds,
+        shard=shard,
+        write_batch_size=settings.firestore_write_batch_size,
+        write_flush_seconds=settings.firestore_write_flush_seconds,
+        page_size=settings.firestore_page_size
+    )
+    sheets_service = SheetsService(
+        invoice_repo,
+        sheets_provider,
+        claim_size=settings.claim_batch_size,
+        lease_seconds=settings.claim_lease_seconds,
+        shard=shard,
+        write_batch_size=settings.firestore_write_batch_size,
+        write_flush_seconds=settings.firestore_write_flush_seconds,
+        page_size=settings.firestore_page_size
+    )
     notification_service = NotificationService(notification_provider)
 
-    # 1. Retrieval Phase
-    logger.info("--- Phase 1: Retrieval ---")
-    retrieval_stats = retrieval_service.run()
+    # Parallel job tasks split the backlog (by lease or by shard), but only the first one reads the mailbox;
+    # the others wait for it so this run's mail is processed in this run
+    parallel = settings.claim_batch_size > 0 or shard.is_partial
+    retrieve_mail = shard.index == 0
+    retrieval_barrier = RetrievalBarrier(invoice_repo, timeout_seconds=settings.retrieval_wait_seconds)
+    if settings.pipeline_enabled and parallel:
+        logger.warning("PIPELINE_ENABLED is ignored for parallel job tasks; running the phases one after another.")
 
-    # 2. Processing Phase
-    logger.info("--- Phase 2: Processing ---")
-    processing_stats = processing_service.run()
+    if settings.pipeline_enabled and not parallel:
+        # Phases 1-3 overlap: invoices are extracted and exported while mail is still being retrieved
+        logger.info("--- Phases 1-3: Retrieval, Processing and Export (pipelined) ---")
+        pipeline_stats = PipelineRunner(
+            invoice_repo,
+            retrieval_service,
+            processing_service,
+            sheets_service,
+            queue_size=settings.pipeline_queue_size
+        ).run()
+        retrieval_stats = pipeline_stats['retrieval']
+        processing_stats = pipeline_stats['processing']
+        sheets_stats = pipeline_stats['sheets']
+    else:
+        # 1. Retrieval Phase
+        logger.info("--- Phase 1: Retrieval ---")
+        if retrieve_mail:
+            retrieval_stats = retrieval_service.run()
+            retrieval_barrier.mark_done()
+        else:
+            logger.info(f"Skipping retrieval on task {shard.index}; waiting for task 0 to read the mailbox.")
+            retrieval_barrier.wait()
+            retrieval_stats = {'total': 0, 'success': 0}
 
-    # 3. Export Phase
-    logger.info("--- Phase 3: Export to Sheets ---")
-    sheets_stats = sheets_service.run()
+        # 2. Processing Phase
+        logger.info("--- Phase 2: Processing ---")
+        processing_stats = processing_service.run()
+
+        # 3. Export Phase
+        logger.info("--- Phase 3: Export to Sheets ---")
+        sheets_stats = sheets_service.run()
+
+    if isinstance(llm_provider, TextLayerLLMProvider):
+        logger.info(
+            f"Text-layer fast path: {llm_provider.stats['text_layer_hits']} invoices extracted without the LLM, "
+            f"{llm_provider.stats['llm_calls']} sent to it (hit rate {llm_provider.hit_rate:.0%})"
+        )
+    if cascade:
+        for model, tier_stats in cascade.stats.items():
+            logger.info(
+                f"Model tier {model}: {tier_stats['calls']} calls, {tier_stats['escalations']} escalated, "
+                f"{tier_stats['seconds']:.1f}s total"
+            )
 
     # 4. Notification Phase
     logger.info("--- Phase 4: Notification ---")
@@ -70,14 +171,21 @@ def main():
     retried_count = processing_stats.get('retried', 0)
     errors = processing_stats.get('errors', [])
     
-    notification_service.send_workflow_summary(
-        retrieved_count=retrieved_count,
-        processed_count=processed_count,
-        failed_count=total_failed, 
-        synced_count=synced_count,
-        retried_count=retried_count,
-        errors=errors
-    )
+    # One email per run: only the first task sends it
+    if shard.index == 0:
+        notification_service.send_workflow_summary(
+            retrieved_count=retrieved_count,
+            processed_count=processed_count,
+            failed_count=total_failed,
+            synced_count=synced_count,
+            retried_count=retried_count,
+            errors=errors
+        )
+    else:
+        logger.info(
+            f"Task {shard.index}: {processed_count} processed, {total_failed} failed, {retried_count} retried, "
+            f"{synced_count} synced; task 0 sends the summary email."
+        )
 
     logger.info("Workflow completed successfully.")
 
@@ -1,38 +1,186 @@
 from abc import ABC, abstractmethod
-from src.domain.entities import RawInvoice, ProcessedInvoice, Email
+from collections.abc import Iterator
+from datetime import datetime
+from src.domain.entities import RawInvoice, ProcessedInvoice, Email, ProcessingStatus, StatusUpdate, RawInvoiceRow, ProcessedInvoiceRow
+from src.domain.duplicates import InvoiceKey
+from src.domain.sharding import Shard
 
 class EmailProvider(ABC):
     @abstractmethod
     def fetch_unread_emails_with_attachments(self) -> list[Email]:
         pass
 
+    @abstractmethod
+    def iter_unread_emails_with_attachments(self, since_checkpoint: str | None = None) -> Iterator[Email]:
+        """
+        Yield unread emails one by one, as soon as their attachments are saved.
+
+        Args:
+            since_checkpoint: Only yield mail added after this checkpoint (full search if None).
+        """
+        pass
+
+    @abstractmethod
+    def get_sync_checkpoint(self) -> str | None:
+        """
+        Return the checkpoint taken at the start of the last iteration, or None
+        if that iteration did not fetch every message and must not be resumed from.
+        """
+        pass
+
     @abstractmethod
     def mark_as_processed(self, email_id: str):
         pass
 
+    @abstractmethod
+    def mark_many_as_processed(self, email_ids: list[str]):
+        """Mark several emails as processed with as few provider calls as possible."""
+        pass
+
 class InvoiceRepository(ABC):
     @abstractmethod
     def save_raw_invoice(self, invoice: RawInvoice):
         pass
 
     @abstractmethod
-    def get_pending_raw_invoices(self) -> list[RawInvoice]:
+    def get_pending_raw_invoices(self, statuses: list[ProcessingStatus] | None = None, shard: Shard | None = None) -> list[RawInvoice]:
+        """Return raw invoices with the given statuses (default PENDING), limited to `shard` if given."""
         pass
 
     @abstractmethod
-    def update_raw_invoice_status(self, invoice_id: str, status: str, error: str | None = None):
+    def get_pending_raw_invoice_rows(self, statuses: list[ProcessingStatus] | None = None, shard: Shard | None = None) -> list[RawInvoiceRow]:
+        """Like `get_pending_raw_invoices`, but reads only the fields processing needs (see `RawInvoiceRow`)."""
+        pass
+
+    @abstractmethod
+    def iter_pending_raw_invoice_rows(
+        self,
+        statuses: list[ProcessingStatus] | None = None,
+        shard: Shard | None = None,
+        page_size: int = 500
+    ) -> Iterator[RawInvoiceRow]:
+        """
+        Like `get_pending_raw_invoice_rows`, but reads page by page while the rows are consumed.
+
+        Pages follow a cursor on the document id, so invoices whose status changes while
+        iterating are neither skipped nor returned twice.
+        """
+        pass
+
+    @abstractmethod
+    def claim_raw_invoices(self, owner: str, limit: int, lease_seconds: int, updated_before: datetime | None = None) -> list[RawInvoice]:
+        """
+        Atomically lease up to `limit` PENDING/RETRY raw invoices to `owner`.
+
+        Claimed invoices are IN_PROGRESS until their status is updated or the
+        lease expires, after which any worker may claim them again. Invoices
+        updated at or after `updated_before` are skipped unless their lease
+        expired, so a run does not pick up the RETRYs it produced itself.
+        """
+        pass
+
+    @abstractmethod
+    def update_raw_invoice_status(self, invoice_id: str, status: str, error: str | None = None, lease_owner: str | None = None) -> bool:
+        """
+        Set the status of a raw invoice, releasing its lease if it has one.
+
+        If `lease_owner` is given, nothing is written unless the invoice is still
+        leased to that owner (checked atomically with the write), so a worker whose
+        lease expired cannot overwrite the outcome of the worker that claimed it next.
+        Returns False if the update was skipped for that reason.
+        """
+        pass
+
+    @abstractmethod
+    def update_raw_invoice_statuses(self, updates: list[StatusUpdate]) -> dict[str, str]:
+        """
+        Apply several raw invoice status updates in as few round trips as possible.
+
+        Updates are independent: one failing does not stop the others. An update
+        with a `lease_owner` whose lease was lost is skipped and reported as failed.
+
+        Returns:
+            Error messages of the failed updates, keyed by invoice id.
+        """
         pass
 
     @abstractmethod
     def save_processed_invoice(self, invoice: ProcessedInvoice):
         pass
+
+    @abstractmethod
+    def commit_processed_invoice(self, invoice: ProcessedInvoice, lease_owner: str | None = None) -> bool:
+        """
+        Save `invoice` and mark its raw invoice PROCESSED (ending the lease) in one write,
+        so a crash can never leave a processed invoice whose raw invoice is still pending.
+
+        If `lease_owner` is given, nothing is written unless the raw invoice is still
+        leased to that owner (checked atomically with the write), so a worker whose
+        lease expired and was claimed by another cannot save a second copy.
+        Returns False if the commit was skipped for that reason.
+        """
+        pass
     
     @abstractmethod
-    def get_unsynced_processed_invoices(self) -> list[ProcessedInvoice]:
+    def get_unsynced_processed_invoices(self, shard: Shard | None = None) -> list[ProcessedInvoice]:
+        """Return processed invoices not yet exported, limited to `shard` if given."""
+        pass
+
+    @abstractmethod
+    def get_unsynced_processed_invoice_rows(self, shard: Shard | None = None) -> list[ProcessedInvoiceRow]:
+        """Like `get_unsynced_processed_invoices`, but reads only the fields the export needs (see `ProcessedInvoiceRow`)."""
+        pass
+
+    @abstractmethod
+    def iter_unsynced_processed_invoice_rows(self, shard: Shard | None = None, page_size: int = 500) -> Iterator[ProcessedInvoiceRow]:
+        """Like `get_unsynced_processed_invoice_rows`, but paged (see `iter_pending_raw_invoice_rows`)."""
+        pass
+
+    @abstractmethod
+    def claim_unsynced_processed_invoices(self, owner: str, limit: int, lease_seconds: int) -> list[ProcessedInvoice]:
+        """Atomically lease up to `limit` NOT_SYNCED processed invoices to `owner` (see `claim_raw_invoices`)."""
         pass
 
     @abstractmethod
     def update_processed_invoice_sync_status(self, invoice_id: str, status: str, error: str | None = None):
+        """Set the sync status of a processed invoice, releasing its lease if it has one."""
+        pass
+    
+    @abstractmethod
+    def update_processed_invoice_sync_statuses(self, updates: list[StatusUpdate]) -> dict[str, str]:
+        """Bulk variant of `update_processed_invoice_sync_status`; see `update_raw_invoice_statuses`."""
+        pass
+
+    @abstractmethod
+    def content_hash_processed(self, content_hash: str) -> bool:
+        """Check if a PDF with the given SHA-256 digest already produced a processed invoice."""
+        pass
+
+    @abstractmethod
+    def get_cached_extraction(self, cache_key: str) -> dict | None:
+        """Return a previously stored LLM extraction result, or None on a cache miss."""
+        pass
+
+    @abstractmethod
+    def save_cached_extraction(self, cache_key: str, data: dict):
+        pass
+
+    @abstractmethod
+    def get_vendor_layouts(self) -> dict[str, dict]:
+        """Return the learned text-layer layouts, keyed by vendor."""
+        pass
+
+    @abstractmethod
+    def save_vendor_layout(self, vendor_key: str, layout: dict):
+        pass
+
+    @abstractmethod
+    def get_sync_checkpoint(self, name: str) -> str | None:
+        """Return the stored value of a sync checkpoint, or None if never saved."""
+        pass
+
+    @abstractmethod
+    def save_sync_checkpoint(self, name: str, value: str):
         pass
     
     @abstractmethod
@@ -40,12 +188,37 @@ class InvoiceRepository(ABC):
         """Check if an invoice with the given invoice number already exists."""
         pass
 
+    @abstractmethod
+    def get_invoice_keys(self, invoice_number: str | None = None) -> list[InvoiceKey]:
+        """
+        Return the identifying fields of all processed invoices, for in-memory duplicate checks.
+
+        With `invoice_number`, only invoices with exactly that number are returned.
+        """
+        pass
+
 class LLMProvider(ABC):
     @abstractmethod
     def extract_invoice_data(self, file_path: str) -> dict:
         """Extract structured invoice data from PDF file."""
         pass
 
+    def extract_invoice_data_batch(self, file_paths: dict[str, str]) -> dict[str, dict | Exception]:
+        """
+        Extract several PDFs at once, keyed by caller-chosen IDs.
+
+        Per-item failures are returned as exceptions instead of being raised.
+        Providers with a bulk API override this; the default calls
+        `extract_invoice_data` for each file.
+        """
+        results = {}
+        for key, file_path in file_paths.items():
+            try:
+                results[key] = self.extract_invoice_data(file_path)
+            except Exception as e:
+                results[key] = e
+        return results
+
 class SheetsProvider(ABC):
     @abstractmethod
     def append_invoice(self, invoice: ProcessedInvoice):
@@ -61,3 +234,12 @@ class FileStorage(ABC):
     def save_file(self, filename: str, content: bytes) -> str:
         """Save file and return the path/URI."""
         pass
+
+    @abstractmethod
+    def save_content_addressed(self, filename: str, content: bytes) -> tuple[str, str]:
+        """
+        Save file under its SHA-256 digest alone (skipped if already stored) and return (path/URI, digest).
+
+        The path does not contain `filename`; keep it separately (e.g. `Email.attachment_filename`).
+        """
+        pass
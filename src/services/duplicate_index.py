@@ -0,0 +1,142 @@
+"""In-memory duplicate detection over normalized invoice keys, loaded once per run."""
+import logging
+import threading
+import time
+from collections import defaultdict
+from src.domain.duplicates import InvoiceKey
+from src.domain.entities import InvoiceData
+from src.ports.interfaces import InvoiceRepository
+
+logger = logging.getLogger(__name__)
+
+
+class DuplicateIndex:
+    """
+    Known invoices, read from the repository once and then kept up to date in memory.
+
+    Keys are blocked twice: by normalized invoice number, and by (gross amount,
+    issue date). A lookup only compares against the keys in its two blocks, so
+    it stays fast no matter how many invoices are known (see `InvoiceKey.matches`
+    for the rule).
+
+    `reserve` checks and records a key in one step under a lock, so two workers
+    extracting the same invoice concurrently cannot both save it. When other
+    processes write to the repository at the same time (parallel job tasks),
+    `confirm_misses` also reads the stored keys with the exact invoice number
+    and applies the same rule to them, since the snapshot cannot contain their
+    writes. If the keys cannot be loaded, every check falls back to that query.
+    """
+
+    def __init__(self, invoice_repo: InvoiceRepository, confirm_misses: bool = False):
+        self.invoice_repo = invoice_repo
+        self.confirm_misses = confirm_misses
+        self._by_number: dict[str, list[InvoiceKey]] | None = None
+        self._by_amount_date: dict[tuple, list[InvoiceKey]] = {}
+        self._size = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def reset(self):
+        """Drops the snapshot; the next check reloads it."""
+        with self._lock:
+            self._by_number = None
+            self._by_amount_date = {}
+            self._size = 0
+            self._loaded = False
+
+    def add(self, key: InvoiceKey):
+        """Adds a known invoice to the index."""
+        with self._lock:
+            self._load()
+            self._add(key)
+
+    def find(self, key: InvoiceKey) -> InvoiceKey | None:
+        """Returns a known invoice matching `key`, or None."""
+        with self._lock:
+            self._load()
+            return self._find(key)
+
+    def reserve(self, invoice: InvoiceData) -> InvoiceKey | None:
+        """
+        Records `invoice` as known unless it duplicates a known invoice.
+
+        Returns:
+            The known invoice it duplicates, or None if it was recorded.
+        """
+        key = InvoiceKey.from_invoice(invoice)
+        with self._lock:
+            self._load()
+            indexed = self._by_number is not None
+            if indexed and (match := self._find(key)):
+                return match
+
+        # Repository round trips happen outside the lock so workers are not serialized on them
+        if not indexed or self.confirm_misses:
+            stored = self.invoice_repo.get_invoice_keys(invoice_number=invoice.invoice_number)
+            if match := next((known for known in stored if key.matches(known)), None):
+                if indexed:
+                    self.add(match)
+                return match
+            if not indexed:
+                return None
+
+        with self._lock:
+            if match := self._find(key):
+                return match
+            self._add(key)
+            return None
+
+    def release(self, invoice: InvoiceData):
+        """Forgets a reserved invoice that could not be saved."""
+        key = InvoiceKey.from_invoice(invoice)
+        with self._lock:
+            if self._by_number is None:
+                return
+            found = False
+            for block in (self._by_number.get(key.number), self._by_amount_date.get(self._amount_date(key))):
+                if block and key in block:
+                    block.remove(key)
+                    found = True
+            if found:
+                self._size -= 1
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        start = time.perf_counter()
+        try:
+            keys = self.invoice_repo.get_invoice_keys()
+            self._by_number = defaultdict(list)
+            self._by_amount_date = defaultdict(list)
+            for key in keys:
+                self._add(key)
+        except Exception as e:
+            self._by_number = None
+            self._size = 0
+            logger.warning(f"Could not load known invoices, checking each invoice number in the repository: {e}")
+            return
+        logger.info(f"Indexed {len(self)} known invoices for duplicate detection in {time.perf_counter() - start:.2f}s")
+
+    def _add(self, key: InvoiceKey):
+        if self._by_number is None:
+            return
+        self._size += 1
+        if key.number:
+            self._by_number[key.number].append(key)
+        if (block := self._amount_date(key)) is not None:
+            self._by_amount_date[block].append(key)
+
+    def _find(self, key: InvoiceKey) -> InvoiceKey | None:
+        candidates = list(self._by_number.get(key.number, ()))
+        if (block := self._amount_date(key)) is not None:
+            candidates += self._by_amount_date.get(block, ())
+        return next((candidate for candidate in candidates if key.matches(candidate)), None)
+
+    def _amount_date(self, key: InvoiceKey) -> tuple | None:
+        if key.gross_cents is None or key.invoice_date is None:
+            return None
+        return key.gross_cents, key.invoice_date
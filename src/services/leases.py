@@ -0,0 +1,82 @@
+"""Helpers for parallel job tasks that share pending work through the repository."""
+import logging
+import os
+import socket
+import time
+from collections.abc import Callable, Iterator
+from typing import TypeVar
+from src.ports.interfaces import InvoiceRepository
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+def default_worker_id() -> str:
+    """Identifies this process as a lease owner, e.g. 'ciekawa-job-abc12-task3-1'."""
+    task_index = os.environ.get('CLOUD_RUN_TASK_INDEX')
+    task = f"-task{task_index}" if task_index is not None else ""
+    return f"{socket.gethostname()}{task}-{os.getpid()}"
+
+
+def iter_claimed(claim: Callable[[], list[T]]) -> Iterator[T]:
+    """
+    Yields items from repeated `claim()` calls until one returns nothing.
+
+    The next batch is only claimed once the caller has taken every item of
+    the current one, so at most one batch is held under lease ahead of time.
+    """
+    while batch := claim():
+        yield from batch
+
+
+class RetrievalBarrier:
+    """
+    Lets parallel job tasks wait until task 0 has ingested this execution's mail.
+
+    Task 0 calls `mark_done` after retrieval, which stores the execution id
+    (Cloud Run's CLOUD_RUN_EXECUTION, shared by all tasks of one run) as a sync
+    checkpoint. The other tasks call `wait` before processing, so invoices
+    ingested in this run are not left for the next one. Without an execution
+    id (a single local run) there is nothing to wait for.
+    """
+
+    CHECKPOINT = "retrieval_completed"
+
+    def __init__(
+        self,
+        invoice_repo: InvoiceRepository,
+        execution_id: str | None = None,
+        timeout_seconds: float = 600.0,
+        poll_seconds: float = 5.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep
+    ):
+        self.invoice_repo = invoice_repo
+        self.execution_id = execution_id if execution_id is not None else os.environ.get('CLOUD_RUN_EXECUTION')
+        self.timeout_seconds = timeout_seconds
+        self.poll_seconds = poll_seconds
+        self.clock = clock
+        self.sleep = sleep
+
+    def mark_done(self):
+        """Records that retrieval of this execution has finished."""
+        if self.execution_id:
+            self.invoice_repo.save_sync_checkpoint(self.CHECKPOINT, self.execution_id)
+
+    def wait(self) -> bool:
+        """
+        Blocks until retrieval of this execution has finished or the timeout passed.
+
+        Returns:
+            False if the timeout passed first; processing then goes ahead with what is stored.
+        """
+        if not self.execution_id:
+            return True
+        deadline = self.clock() + self.timeout_seconds
+        while self.invoice_repo.get_sync_checkpoint(self.CHECKPOINT) != self.execution_id:
+            if self.clock() >= deadline:
+                logger.warning(f"Retrieval of {self.execution_id} did not finish within {self.timeout_seconds:.0f}s; processing what is stored.")
+                return False
+            self.sleep(self.poll_seconds)
+        return True
@@ -0,0 +1,126 @@
+import logging
+import queue
+import threading
+from collections.abc import Iterator
+from itertools import chain
+from src.domain.entities import ProcessingStatus
+from src.ports.interfaces import InvoiceRepository
+from src.services.retrieval_service import RetrievalService
+from src.services.processing_service import ProcessingService
+from src.services.sheets_service import SheetsService
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's output
+_DONE = object()
+
+class _QueueStream:
+    """Iterates queued items until the producing stage signals it is done."""
+
+    def __init__(self, items: queue.Queue):
+        self.items = items
+        self.done = False
+
+    def __iter__(self) -> Iterator:
+        while not self.done:
+            item = self.items.get()
+            if item is _DONE:
+                self.done = True
+                return
+            yield item
+
+class PipelineRunner:
+    """
+    Runs retrieval, processing and Sheets export concurrently instead of one after another.
+
+    Each stage runs in its own thread and hands its items to the next stage
+    through a bounded queue, so an invoice is extracted as soon as its email is
+    saved and exported as soon as it is extracted. A full queue blocks the
+    stage feeding it (backpressure). Work left over from earlier runs (pending
+    raw invoices, unsynced processed invoices) is read before retrieval starts
+    and fed in first, so nothing is picked up twice.
+    """
+
+    def __init__(
+        self,
+        invoice_repo: InvoiceRepository,
+        retrieval_service: RetrievalService,
+        processing_service: ProcessingService,
+        sheets_service: SheetsService,
+        queue_size: int = 100
+    ):
+        self.invoice_repo = invoice_repo
+        self.retrieval_service = retrieval_service
+        self.processing_service = processing_service
+        self.sheets_service = sheets_service
+        self.queue_size = queue_size
+
+    def run(self) -> dict:
+        """
+        Runs all stages to completion.
+
+        Returns:
+            Statistics of each stage under 'retrieval', 'processing' and 'sheets'.
+
+        Raises:
+            Exception: The first error that stopped a stage, after the other stages finished.
+        """
+        logger.info(f"Starting pipelined workflow (queue size {self.queue_size})...")
+        # Read in full before retrieval starts: a paged read could also return invoices
+        # the retrieval stage saves meanwhile, which reach processing through the queue
+        pending = self.invoice_repo.get_pending_raw_invoice_rows([ProcessingStatus.PENDING, ProcessingStatus.RETRY])
+        unsynced = self.invoice_repo.get_unsynced_processed_invoice_rows()
+        logger.info(f"Backlog: {len(pending)} pending/retry invoices, {len(unsynced)} unsynced invoices.")
+
+        raw_queue = queue.Queue(maxsize=self.queue_size)
+        processed_queue = queue.Queue(maxsize=self.queue_size)
+        raw_stream = _QueueStream(raw_queue)
+        processed_stream = _QueueStream(processed_queue)
+        stats = {}
+        errors = []
+
+        def retrieve():
+            try:
+                stats['retrieval'] = self.retrieval_service.run(on_ingested=raw_queue.put)
+            except Exception as e:
+                logger.error(f"Retrieval stage failed: {e}")
+                errors.append(e)
+            finally:
+                raw_queue.put(_DONE)
+
+        def process():
+            try:
+                stats['processing'] = self.processing_service.run(
+                    chain(pending, raw_stream),
+                    on_processed=processed_queue.put
+                )
+            except Exception as e:
+                logger.error(f"Processing stage failed: {e}")
+                errors.append(e)
+                # Keep consuming so retrieval is not blocked on a full queue
+                for _ in raw_stream:
+                    pass
+            finally:
+                processed_queue.put(_DONE)
+
+        def export():
+            try:
+                stats['sheets'] = self.sheets_service.run(chain(unsynced, processed_stream))
+            except Exception as e:
+                logger.error(f"Export stage failed: {e}")
+                errors.append(e)
+                for _ in processed_stream:
+                    pass
+
+        threads = [
+            threading.Thread(target=target, name=f"pipeline-{target.__name__}")
+            for target in (retrieve, process, export)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+        return stats
@@ -1,77 +1,317 @@
+import itertools
 import logging
-import uuid
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from src.domain.entities import ProcessedInvoice, InvoiceData, SyncStatus, ProcessingStatus, InvoiceItem
+from src.domain.entities import ProcessedInvoice, SyncStatus, ProcessingStatus, RawInvoice
+from src.domain.sharding import Shard
+from src.domain.validation import map_extraction
 from src.ports.interfaces import InvoiceRepository, LLMProvider
+from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable, TooManyRequests
+from src.services.rate_limiter import RateLimiter, AdaptiveLimiter
+from src.services.leases import default_worker_id, iter_claimed
+from src.services.duplicate_index import DuplicateIndex
+from src.services.write_buffer import StatusWriteBuffer
 
 logger = logging.getLogger(__name__)
 
+# Errors that mean "slow down" rather than "this invoice is broken"
+THROTTLE_ERRORS = (ResourceExhausted, ServiceUnavailable, TooManyRequests)
+
 class ProcessingService:
-    def __init__(self, invoice_repo: InvoiceRepository, llm_provider: LLMProvider):
+    def __init__(
+        self,
+        invoice_repo: InvoiceRepository,
+        llm_provider: LLMProvider,
+        batch_size: int = 0,
+        max_workers: int = 1,
+        rate_limiter: RateLimiter | None = None,
+        concurrency_limiter: AdaptiveLimiter | None = None,
+        max_attempts: int = 5,
+        claim_size: int = 0,
+        lease_seconds: int = 900,
+        worker_id: str | None = None,
+        shard: Shard | None = None,
+        write_batch_size: int = 0,
+        write_flush_seconds: float = 5.0,
+        page_size: int = 500
+    ):
+        """
+        Args:
+            invoice_repo: Repository with raw and processed invoices.
+            llm_provider: Provider used to extract invoice data.
+            batch_size: If above 1, pending invoices are extracted in bulk requests
+                of this size (e.g. Gemini Batch API jobs or packed requests) instead of
+                one call each.
+            max_workers: If above 1, invoices are processed concurrently by this many
+                worker threads. The repository and LLM provider must be thread-safe.
+            rate_limiter: Shared request/token quota applied before every LLM call.
+            concurrency_limiter: Run-wide adaptive limit on concurrent LLM calls that
+                shrinks and pauses all workers when the LLM throttles.
+            max_attempts: LLM calls per invoice before a throttled invoice is left for RETRY.
+            claim_size: If above 0, pending invoices are leased from the repository in
+                batches of this size instead of read all at once, so several workers
+                can drain the same backlog without extracting an invoice twice.
+            lease_seconds: How long claimed invoices stay reserved for this worker. An
+                invoice whose lease expires (e.g. the worker crashed) is claimed again.
+            worker_id: Lease owner name; defaults to host, Cloud Run task and process.
+            shard: Without leases, only pending invoices in this shard are read.
+                Defaults to the shard of the current Cloud Run job task.
+            write_batch_size: If above 1, raw invoice status changes are buffered and
+                written in bulk once this many are pending, instead of one write each.
+            write_flush_seconds: Longest time a buffered status change waits for its batch.
+            page_size: Without leases, pending invoices are read lazily in pages of this
+                size, so processing starts after the first page and memory stays bounded.
+        """
         self.invoice_repo = invoice_repo
         self.llm_provider = llm_provider
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.rate_limiter = rate_limiter
+        self.concurrency_limiter = concurrency_limiter or AdaptiveLimiter(max_limit=max_workers)
+        self.max_attempts = max_attempts
+        self.claim_size = claim_size
+        self.lease_seconds = lease_seconds
+        self.worker_id = worker_id or default_worker_id()
+        self.shard = shard or Shard.from_env()
+        self.page_size = page_size
+        # Other tasks save invoices concurrently, so numbers missing from the snapshot are confirmed
+        self.duplicate_index = DuplicateIndex(invoice_repo, confirm_misses=claim_size > 0 or self.shard.is_partial)
+        self.status_writes = StatusWriteBuffer(
+            invoice_repo.update_raw_invoice_statuses, write_batch_size, write_flush_seconds
+        ) if write_batch_size > 1 else None
+        self._on_processed: Callable[[ProcessedInvoice], None] | None = None
     
-    def run(self) -> dict:
+    def run(self, raw_invoices: Iterable[RawInvoice] | None = None, on_processed: Callable[[ProcessedInvoice], None] | None = None) -> dict:
         """
         Processes pending and retry invoices.
+
+        Args:
+            raw_invoices: Invoices to process as they arrive (e.g. from a pipeline
+                queue). Defaults to all PENDING/RETRY invoices in the repository.
+            on_processed: Called with every ProcessedInvoice right after it is saved.
+
         Returns statistics: total, success, failed, retried counts, and errors list.
         """
         logger.info("Starting Processing Service...")
         
-        pending_invoices = self.invoice_repo.get_pending_raw_invoices([ProcessingStatus.PENDING, ProcessingStatus.RETRY])
-        logger.info(f"Found {len(pending_invoices)} pending/retry invoices.")
+        if raw_invoices is None and self.claim_size > 0:
+            raw_invoices = self._claimed_invoices()
+        elif raw_invoices is None:
+            raw_invoices = self.invoice_repo.iter_pending_raw_invoice_rows(
+                [ProcessingStatus.PENDING, ProcessingStatus.RETRY],
+                shard=self.shard,
+                page_size=self.page_size
+            )
+            logger.info(f"Reading pending/retry invoices{self._shard_label()} in pages of {self.page_size}.")
         
-        stats = {'total': len(pending_invoices), 'success': 0, 'failed': 0, 'retried': 0, 'errors': []}
+        self.duplicate_index.reset()
+        stats = {'total': 0, 'success': 0, 'failed': 0, 'retried': 0, 'errors': []}
+        if self.status_writes is not None:
+            self.status_writes.failures = {}
+        pending_invoices = self._counted(raw_invoices, stats)
+        self._on_processed = on_processed
 
-        for raw_invoice in pending_invoices:
-            try:
-                result_status, error_info = self._process_single_invoice(raw_invoice)
-                if result_status == ProcessingStatus.PROCESSED:
-                    stats['success'] += 1
-                elif result_status == ProcessingStatus.RETRY:
-                    stats['retried'] += 1
-                else:
-                    stats['failed'] += 1
-                    if error_info:
-                        stats['errors'].append(error_info)
-            except Exception:
-                stats['failed'] += 1
-                
+        if self.batch_size > 1:
+            for chunk in itertools.batched(pending_invoices, self.batch_size):
+                self._process_batch(list(chunk), stats)
+        elif self.max_workers > 1:
+            self._run_concurrently(pending_invoices, stats)
+        else:
+            for raw_invoice in pending_invoices:
+                self._process_and_record(stats, raw_invoice)
+
+        if self.status_writes is not None:
+            self.status_writes.flush()
+            stats['write_failures'] = len(self.status_writes.failures)
+            if self.status_writes.lease_lost:
+                stats['lease_lost'] = stats.get('lease_lost', 0) + len(self.status_writes.lease_lost)
+
+        logger.info(f"LLM concurrency limiter: {self.concurrency_limiter.metrics()}")
         return stats
 
-    def _process_single_invoice(self, raw_invoice) -> tuple[ProcessingStatus, dict | None]:
+    def _shard_label(self) -> str:
+        return f" in shard {self.shard.index + 1}/{self.shard.count}" if self.shard.is_partial else ""
+
+    def _claimed_invoices(self) -> Iterator[RawInvoice]:
+        logger.info(f"Claiming pending/retry invoices in batches of {self.claim_size} as {self.worker_id}.")
+        # Invoices this run puts back as RETRY are left for the next run, as without leases
+        started_at = datetime.now(timezone.utc)
+        return iter_claimed(lambda: self.invoice_repo.claim_raw_invoices(
+            self.worker_id, self.claim_size, self.lease_seconds, updated_before=started_at
+        ))
+
+    @property
+    def lease_owner(self) -> str | None:
+        """Owner whose lease every write of a claimed invoice is checked against; None without claiming."""
+        return self.worker_id if self.claim_size > 0 else None
+
+    def _set_status(self, invoice_id: str, status: ProcessingStatus, error: str | None = None):
+        """Writes a raw invoice status change, through the write buffer if enabled."""
+        if self.status_writes is not None:
+            self.status_writes.add(invoice_id, status.value, error, lease_owner=self.lease_owner)
+        elif self.lease_owner is not None:
+            self.invoice_repo.update_raw_invoice_status(invoice_id, status.value, error, lease_owner=self.lease_owner)
+        elif error is None:
+            self.invoice_repo.update_raw_invoice_status(invoice_id, status.value)
+        else:
+            self.invoice_repo.update_raw_invoice_status(invoice_id, status.value, error)
+
+    def _counted(self, raw_invoices: Iterable[RawInvoice], stats: dict) -> Iterator[RawInvoice]:
+        for raw_invoice in raw_invoices:
+            stats['total'] += 1
+            yield raw_invoice
+
+    def _run_concurrently(self, raw_invoices: Iterable[RawInvoice], stats: dict):
+        """
+        Processes invoices on a worker pool. Outcomes are recorded in the original
+        order on the calling thread, so stats and errors match the sequential path.
+        At most two invoices per worker are taken from the input ahead of time.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="extraction") as pool:
+            futures = deque()
+            for raw_invoice in raw_invoices:
+                futures.append(pool.submit(self._process_single_invoice, raw_invoice))
+                if len(futures) >= 2 * self.max_workers:
+                    self._record_future(stats, futures.popleft())
+            while futures:
+                self._record_future(stats, futures.popleft())
+
+    def _record_future(self, stats: dict, future):
+        try:
+            result_status, error_info = future.result()
+        except Exception:
+            stats['failed'] += 1
+            return
+        self._record_outcome(stats, result_status, error_info)
+
+    def _process_and_record(self, stats: dict, raw_invoice, extracted: dict | Exception | None = None):
+        """Processes one invoice and adds its outcome to the run statistics."""
+        try:
+            result_status, error_info = self._process_single_invoice(raw_invoice, extracted)
+        except Exception:
+            stats['failed'] += 1
+            return
+        self._record_outcome(stats, result_status, error_info)
+
+    def _record_outcome(self, stats: dict, result_status: ProcessingStatus, error_info: dict | None):
+        if result_status == ProcessingStatus.PROCESSED:
+            stats['success'] += 1
+        elif result_status == ProcessingStatus.RETRY:
+            stats['retried'] += 1
+        elif result_status == ProcessingStatus.IN_PROGRESS:
+            # The lease expired and another worker owns the invoice now
+            stats['lease_lost'] = stats.get('lease_lost', 0) + 1
+        else:
+            stats['failed'] += 1
+            if error_info:
+                stats['errors'].append(error_info)
+
+    def _process_batch(self, raw_invoices: list, stats: dict):
+        """
+        Extracts a chunk of invoices with one bulk LLM request, then finishes each one
+        exactly like the sequential path. If the bulk request fails as a whole (or
+        stays throttled), the chunk is marked RETRY for the next run.
+        """
+        to_extract = []
+        for raw_invoice in raw_invoices:
+            try:
+                duplicate = self._check_duplicate_attachment(raw_invoice)
+            except Exception as e:
+                # Only an optimization; duplicate invoice numbers are still caught after extraction
+                logger.warning(f"Duplicate attachment check failed for invoice {raw_invoice.id}: {e}")
+                duplicate = None
+            if duplicate:
+                self._record_outcome(stats, *duplicate)
+            else:
+                to_extract.append(raw_invoice)
+        if not to_extract:
+            return
+
+        try:
+            results = self._extract_bulk_with_retry({raw.id: raw.email_data.attachment_path for raw in to_extract})
+        except Exception as e:
+            logger.error(f"Bulk extraction of {len(to_extract)} invoices failed: {e}. Marking as RETRY.")
+            for raw_invoice in to_extract:
+                self._set_status(raw_invoice.id, ProcessingStatus.RETRY, str(e))
+                stats['retried'] += 1
+            return
+
+        for raw_invoice in to_extract:
+            extracted = results.get(raw_invoice.id, RuntimeError("No result returned for invoice"))
+            self._process_and_record(stats, raw_invoice, extracted)
+
+    def _check_duplicate_attachment(self, raw_invoice) -> tuple[ProcessingStatus, dict] | None:
+        """
+        Byte-identical resends are caught before paying for the LLM call.
+
+        Returns:
+            The FAILED outcome if the PDF was already processed, otherwise None.
+        """
+        content_hash = raw_invoice.email_data.content_hash
+        if not (content_hash and self.invoice_repo.content_hash_processed(content_hash)):
+            return None
+
+        error_reason = f"Duplicate attachment: identical PDF already processed (sha256 {content_hash[:12]})"
+        logger.warning(f"Duplicate attachment detected for invoice {raw_invoice.id}")
+        self._set_status(raw_invoice.id, ProcessingStatus.FAILED, error_reason)
+        return ProcessingStatus.FAILED, {'filename': self._filename(raw_invoice), 'reason': error_reason}
+
+    def _filename(self, raw_invoice) -> str:
+        """Original attachment filename for error reporting, falling back to the stored path."""
+        if raw_invoice.email_data.attachment_filename:
+            return raw_invoice.email_data.attachment_filename
+        return raw_invoice.email_data.attachment_path.replace('\\', '/').split('/')[-1]
+
+    def _process_single_invoice(self, raw_invoice, extracted: dict | Exception | None = None) -> tuple[ProcessingStatus, dict | None]:
         """
         Process a single invoice.
+
+        Args:
+            raw_invoice: The invoice to process.
+            extracted: Result of a bulk extraction done by the caller. If given, the
+                LLM is not called again; an exception is handled like a failed call.
         
         Returns:
-            Tuple of (ProcessingStatus, error_info dict or None).
+            Tuple of (ProcessingStatus, error_info dict or None); IN_PROGRESS if the
+            lease was lost to another worker and nothing was saved.
             Error info contains 'filename' and 'reason' keys.
         """
         logger.info(f"Processing invoice {raw_invoice.id}...")
         
-        # Extract filename from path for error reporting
-        filename = raw_invoice.email_data.attachment_path.replace('\\', '/').split('/')[-1]
+        filename = self._filename(raw_invoice)
         
         try:
-            # Extract data using LLM with retry logic
-            extracted_dict = self._extract_with_retry(raw_invoice.email_data.attachment_path)
+            if extracted is None:
+                duplicate = self._check_duplicate_attachment(raw_invoice)
+                if duplicate:
+                    return duplicate
+
+                # Extract data using LLM with retry logic
+                extracted_dict = self._extract_with_retry(raw_invoice.email_data.attachment_path)
+            elif isinstance(extracted, Exception):
+                raise extracted
+            else:
+                extracted_dict = extracted
             
             # Validate and map data
-            invoice_data = self._map_and_validate(extracted_dict)
+            invoice_data = map_extraction(extracted_dict)
             
-            # Check for duplicate invoice number
-            if self.invoice_repo.invoice_number_exists(invoice_data.invoice_number):
+            # Check for a known invoice with the same vendor and number (and reserve the key for this one)
+            duplicate_of = self.duplicate_index.reserve(invoice_data)
+            if duplicate_of is not None:
                 error_reason = f"Duplicate invoice number: {invoice_data.invoice_number}"
+                if duplicate_of.invoice_number and duplicate_of.invoice_number != invoice_data.invoice_number:
+                    error_reason += f" (matches {duplicate_of.invoice_number})"
                 logger.warning(f"Duplicate invoice detected: {invoice_data.invoice_number}")
-                self.invoice_repo.update_raw_invoice_status(
-                    raw_invoice.id, 
-                    ProcessingStatus.FAILED.value, 
-                    error_reason
-                )
+                self._set_status(raw_invoice.id, ProcessingStatus.FAILED, error_reason)
                 return ProcessingStatus.FAILED, {'filename': filename, 'reason': error_reason}
 
+            # Shares the raw invoice's id, so it lands in the same shard and the task
+            # that extracted it also exports it
             processed_invoice = ProcessedInvoice(
-                id=str(uuid.uuid4()),
+                id=raw_invoice.id,
                 raw_invoice_id=raw_invoice.id,
                 extracted_data=invoice_data,
                 sync_status=SyncStatus.NOT_SYNCED,
@@ -79,11 +319,20 @@ class ProcessingService:
                 updated_at=datetime.now(timezone.utc)
             )
 
-            # Save processed invoice
-            self.invoice_repo.save_processed_invoice(processed_invoice)
-            
-            # Update raw invoice status
-            self.invoice_repo.update_raw_invoice_status(raw_invoice.id, ProcessingStatus.PROCESSED.value)
+            # Save the processed invoice and mark the raw one PROCESSED in one write,
+            # so a crash in between cannot get the invoice extracted again. A claimed
+            # invoice is only committed while this worker still holds its lease.
+            try:
+                committed = self.invoice_repo.commit_processed_invoice(processed_invoice, lease_owner=self.lease_owner)
+            except Exception:
+                self.duplicate_index.release(invoice_data)
+                raise
+            if not committed:
+                self.duplicate_index.release(invoice_data)
+                return ProcessingStatus.IN_PROGRESS, None
+
+            if self._on_processed:
+                self._on_processed(processed_invoice)
             
             logger.info(f"Successfully processed invoice {raw_invoice.id}")
             return ProcessingStatus.PROCESSED, None
@@ -94,49 +343,73 @@ class ProcessingService:
             error_str = str(e)
             if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str:
                 logger.warning(f"Quota exceeded for invoice {raw_invoice.id}. Marking as RETRY.")
-                self.invoice_repo.update_raw_invoice_status(raw_invoice.id, ProcessingStatus.RETRY.value, str(e))
+                self._set_status(raw_invoice.id, ProcessingStatus.RETRY, str(e))
                 return ProcessingStatus.RETRY, None
             
-            self.invoice_repo.update_raw_invoice_status(raw_invoice.id, ProcessingStatus.FAILED.value, str(e))
+            self._set_status(raw_invoice.id, ProcessingStatus.FAILED, str(e))
             raise
 
-    from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-    from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable, TooManyRequests
-
-    @retry(
-        stop=stop_after_attempt(5),
-        wait=wait_exponential(multiplier=2, min=10, max=120),
-        retry=retry_if_exception_type((ResourceExhausted, ServiceUnavailable, TooManyRequests)),
-        reraise=True
-    )
     def _extract_with_retry(self, file_path: str) -> dict:
-        return self.llm_provider.extract_invoice_data(file_path)
+        """
+        Calls the LLM through the shared limiters.
 
-    def _map_and_validate(self, data: dict) -> InvoiceData:
-        try:
-            # Robust date parsing with fallbacks
-            def parse_date(date_str: str) -> datetime:
-                for fmt in ('%Y-%m-%d', '%d.%m.%Y', '%Y/%m/%d', '%d-%m-%Y'):
-                    try:
-                        return datetime.strptime(date_str, fmt)
-                    except ValueError:
-                        continue
-                raise ValueError(f"Unknown date format: {date_str}")
-
-            return InvoiceData(
-                invoice_date=parse_date(data.get('invoice_date', '')),
-                category=data.get('category', 'UNCATEGORIZED'),
-                vendor_name=data.get('vendor', 'Unknown'),
-                net_amount=float(data.get('net_amount', 0.0)),
-                gross_amount=float(data.get('gross_amount', 0.0)),
-                invoice_number=data.get('invoice_number', 'UNKNOWN'),
-                due_date=parse_date(data.get('payment_date', '')),
-                items=[],
-                currency=data.get('currency', 'PLN'),
-                tax_amount=float(data.get('tax_amount', 0.0))
-            )
-        except (ValueError, TypeError, KeyError) as e:
-            logger.error(f"Data validation failed: {e}. Raw data: {data}")
-            raise ValueError(f"Invalid invoice data structure: {e}")
+        A throttled call is retried once the run-wide pause is over; the limiter,
+        not this invoice, decides how long all workers wait.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            ticket = self.concurrency_limiter.acquire()
+            try:
+                result = self.llm_provider.extract_invoice_data(file_path)
+            except THROTTLE_ERRORS as e:
+                self.concurrency_limiter.release(ticket, throttled=True)
+                if attempt == self.max_attempts:
+                    raise
+                logger.warning(f"LLM throttled on attempt {attempt}/{self.max_attempts} for {file_path}: {e}")
+                continue
+            except Exception:
+                self.concurrency_limiter.release(ticket)
+                raise
+            self.concurrency_limiter.release(ticket)
+            return result
+
+    def _extract_bulk_with_retry(self, file_paths: dict[str, str]) -> dict[str, dict | Exception]:
+        """
+        Calls the bulk LLM path through the same limiters as single calls.
+
+        The request is weighted by its number of invoices in the token quota. A
+        throttled call, or throttled items of a call that returned per-item errors
+        (packed requests), counts as a throttle for the shared limiter; only those
+        items are sent again once the run-wide pause is over.
+        """
+        results: dict[str, dict | Exception] = {}
+        pending = dict(file_paths)
+        for attempt in range(1, self.max_attempts + 1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire(len(pending))
+            ticket = self.concurrency_limiter.acquire()
+            try:
+                batch_results = self.llm_provider.extract_invoice_data_batch(pending)
+            except Exception as e:
+                self.concurrency_limiter.release(ticket, throttled=_is_throttle(e))
+                if not _is_throttle(e) or attempt == self.max_attempts:
+                    raise
+                logger.warning(f"LLM throttled on bulk attempt {attempt}/{self.max_attempts} for {len(pending)} invoices: {e}")
+                continue
+
+            throttled = {key for key, result in batch_results.items() if _is_throttle(result)}
+            self.concurrency_limiter.release(ticket, throttled=bool(throttled))
+            results.update(batch_results)
+            if not throttled or attempt == self.max_attempts:
+                break
+            logger.warning(f"LLM throttled {len(throttled)}/{len(pending)} invoices on bulk attempt {attempt}/{self.max_attempts}")
+            pending = {key: pending[key] for key in throttled}
+        return results
 
 
+def _is_throttle(error) -> bool:
+    """True for LLM errors that mean "slow down", raised or returned per item."""
+    if isinstance(error, THROTTLE_ERRORS):
+        return True
+    return isinstance(error, Exception) and ("429" in str(error) or "RESOURCE_EXHAUSTED" in str(error))
@@ -0,0 +1,144 @@
+"""Rate and concurrency limiting for LLM requests shared by concurrent workers."""
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `rate_per_minute`.
+
+    The bucket starts full, so a burst of up to one minute's quota is allowed.
+    """
+
+    def __init__(self, rate_per_minute: float, clock=time.monotonic, sleep=time.sleep):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0):
+        """Blocks until `amount` tokens are available and takes them."""
+        # A single request larger than the whole bucket would never fit
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate_per_second
+            self._sleep(wait)
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+
+class RateLimiter:
+    """
+    Limits LLM calls by requests per minute and estimated input tokens per minute.
+
+    A limit of 0 disables that dimension.
+    """
+
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0, tokens_per_request: int = 0, clock=time.monotonic, sleep=time.sleep):
+        self.tokens_per_request = tokens_per_request
+        self.requests = TokenBucket(requests_per_minute, clock, sleep) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, clock, sleep) if tokens_per_minute and tokens_per_request else None
+
+    def acquire(self, documents: int = 1):
+        """Blocks until one more request carrying `documents` invoices fits into both quotas."""
+        if self.requests:
+            self.requests.acquire(1)
+        if self.tokens:
+            self.tokens.acquire(self.tokens_per_request * documents)
+
+
+class AdaptiveLimiter:
+    """
+    Run-wide AIMD limit on concurrent LLM calls.
+
+    Every successful call raises the limit by 1/limit (about +1 per round of
+    calls) up to `max_limit`. A throttled call multiplies it by `decrease_factor`
+    (down to `min_limit`) and pauses all workers together for a backoff that
+    doubles with consecutive throttles. Throttles of calls started before the
+    last decrease are not counted again, so one burst of 429s shrinks the
+    limit once.
+    """
+
+    def __init__(
+        self,
+        max_limit: int = 1,
+        min_limit: int = 1,
+        decrease_factor: float = 0.5,
+        pause_seconds: float = 10.0,
+        max_pause_seconds: float = 120.0,
+        clock=time.monotonic
+    ):
+        self.max_limit = max(max_limit, min_limit)
+        self.min_limit = min_limit
+        self.decrease_factor = decrease_factor
+        self.pause_seconds = pause_seconds
+        self.max_pause_seconds = max_pause_seconds
+        self.limit = float(self.max_limit)
+        self.successes = 0
+        self.throttles = 0
+        self.paused_seconds = 0.0
+        self._clock = clock
+        self._in_flight = 0
+        self._next_pause = pause_seconds
+        self._paused_until = 0.0
+        self._last_decrease = float('-inf')
+        self._condition = threading.Condition()
+
+    def acquire(self) -> float:
+        """
+        Blocks until a call may start: no shared pause and fewer calls in flight than the limit.
+
+        Returns:
+            A ticket to hand back to `release`.
+        """
+        with self._condition:
+            while True:
+                now = self._clock()
+                if now < self._paused_until:
+                    self._condition.wait(self._paused_until - now)
+                elif self._in_flight < int(self.limit):
+                    self._in_flight += 1
+                    return now
+                else:
+                    self._condition.wait()
+
+    def release(self, ticket: float, throttled: bool = False):
+        """Ends a call started with `acquire` and adapts the limit to its outcome."""
+        with self._condition:
+            self._in_flight -= 1
+            if not throttled:
+                self.successes += 1
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self._next_pause = self.pause_seconds
+            else:
+                self.throttles += 1
+                if ticket > self._last_decrease:
+                    now = self._clock()
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+                    self._paused_until = now + self._next_pause
+                    self.paused_seconds += self._next_pause
+                    self._next_pause = min(self._next_pause * 2, self.max_pause_seconds)
+            self._condition.notify_all()
+
+    def metrics(self) -> dict:
+        """Current state, for logging and run statistics."""
+        with self._condition:
+            return {
+                'limit': round(self.limit, 2),
+                'in_flight': self._in_flight,
+                'successes': self.successes,
+                'throttles': self.throttles,
+                'paused_seconds': round(self.paused_seconds, 2),
+            }
@@ -1,46 +1,107 @@
 import logging
 import uuid
+from collections.abc import Callable
 from datetime import datetime, timezone
-from src.domain.entities import RawInvoice, ProcessingStatus
+from src.domain.entities import RawInvoice, ProcessingStatus, Email
 from src.ports.interfaces import EmailProvider, InvoiceRepository
 
 logger = logging.getLogger(__name__)
 
+EMAIL_CHECKPOINT = "email_history"
+
 class RetrievalService:
-    def __init__(self, email_provider: EmailProvider, invoice_repo: InvoiceRepository):
+    def __init__(self, email_provider: EmailProvider, invoice_repo: InvoiceRepository, incremental: bool = False, mark_batch_size: int = 1000):
         self.email_provider = email_provider
         self.invoice_repo = invoice_repo
+        self.incremental = incremental
+        self.mark_batch_size = mark_batch_size
+
+    def run(self, on_ingested: Callable[[RawInvoice], None] | None = None) -> dict:
+        """
+        Ingests unread emails with attachments as RawInvoices.
 
-    def run(self) -> dict:
+        Args:
+            on_ingested: Called with every RawInvoice right after it is saved, e.g. to
+                hand it to the next pipeline stage. It may block to apply backpressure.
+        """
         logger.info("Starting Retrieval Service...")
-        emails = self.email_provider.fetch_unread_emails_with_attachments()
-        logger.info(f"Found {len(emails)} emails with attachments.")
+        checkpoint = None
+        if self.incremental:
+            checkpoint = self.invoice_repo.get_sync_checkpoint(EMAIL_CHECKPOINT)
+            logger.info(f"Incremental sync from checkpoint: {checkpoint or 'none (full search)'}")
 
+        total_count = 0
         success_count = 0
-        for email in emails:
-            try:
-                # Create RawInvoice entity
-                raw_invoice = RawInvoice(
-                    id=str(uuid.uuid4()),
-                    email_id=email.id,
-                    email_data=email,
-                    status=ProcessingStatus.PENDING,
-                    created_at=datetime.now(timezone.utc),
-                    updated_at=datetime.now(timezone.utc)
-                )
-                
-                # Save to DB
-                self.invoice_repo.save_raw_invoice(raw_invoice)
-                
-                # Mark email as processed in the provider (e.g. remove label)
-                self.email_provider.mark_as_processed(email.id)
-                
-                logger.info(f"Successfully ingested email {email.id}")
-                success_count += 1
-            except Exception as e:
-                logger.error(f"Failed to process email {email.id}: {e}")
-                # Note: We might want to mark it as failed in DB if we saved it, 
-                # but if saving failed, we just log it. 
-                # If marking as processed failed, we might re-process it next time, which is safer.
-        
-        return {'total': len(emails), 'success': success_count}
+        # Emails whose RawInvoice is already persisted, waiting to be marked in bulk
+        saved_email_ids = []
+        unmarked_count = 0
+        try:
+            # Each email is saved as soon as the provider yields it
+            for email in self.email_provider.iter_unread_emails_with_attachments(since_checkpoint=checkpoint):
+                total_count += 1
+                raw_invoice = self._ingest(email)
+                if raw_invoice:
+                    success_count += 1
+                    saved_email_ids.append(email.id)
+                    if len(saved_email_ids) >= self.mark_batch_size:
+                        unmarked_count += self._mark_processed(saved_email_ids)
+                    if on_ingested:
+                        on_ingested(raw_invoice)
+        finally:
+            unmarked_count += self._mark_processed(saved_email_ids)
+
+        logger.info(f"Ingested {success_count} of {total_count} emails with attachments.")
+
+        if self.incremental:
+            # Only advance when nothing was left behind (unsaved, or saved but still
+            # unread), otherwise the next run would skip it
+            new_checkpoint = self.email_provider.get_sync_checkpoint()
+            if new_checkpoint and success_count == total_count and unmarked_count == 0:
+                self.invoice_repo.save_sync_checkpoint(EMAIL_CHECKPOINT, new_checkpoint)
+            else:
+                logger.warning("Not advancing email checkpoint; unfinished messages will be fetched again.")
+
+        return {'total': total_count, 'success': success_count}
+
+    def _ingest(self, email: Email) -> RawInvoice | None:
+        """Saves a RawInvoice for the email. Returns it if it was persisted, otherwise None."""
+        try:
+            # Create RawInvoice entity
+            raw_invoice = RawInvoice(
+                id=str(uuid.uuid4()),
+                email_id=email.id,
+                email_data=email,
+                status=ProcessingStatus.PENDING,
+                created_at=datetime.now(timezone.utc),
+                updated_at=datetime.now(timezone.utc)
+            )
+
+            # Save to DB
+            self.invoice_repo.save_raw_invoice(raw_invoice)
+
+            logger.info(f"Successfully ingested email {email.id}")
+            return raw_invoice
+        except Exception as e:
+            logger.error(f"Failed to process email {email.id}: {e}")
+            # Not marked as processed, so the email is fetched again next time.
+            return None
+
+    def _mark_processed(self, email_ids: list[str]) -> int:
+        """
+        Marks persisted emails as processed in the provider (e.g. remove label) and clears the list.
+
+        If marking fails, the emails might be re-processed next time, which is safer.
+
+        Returns:
+            The number of emails that could not be marked.
+        """
+        if not email_ids:
+            return 0
+        unmarked = 0
+        try:
+            self.email_provider.mark_many_as_processed(list(email_ids))
+        except Exception as e:
+            logger.error(f"Failed to mark {len(email_ids)} emails as processed: {e}")
+            unmarked = len(email_ids)
+        email_ids.clear()
+        return unmarked
@@ -1,31 +1,100 @@
 import logging
-from src.domain.entities import SyncStatus
+from collections.abc import Iterable
+from src.domain.entities import SyncStatus, ProcessedInvoice
+from src.domain.sharding import Shard
 from src.ports.interfaces import InvoiceRepository, SheetsProvider
+from src.services.leases import default_worker_id, iter_claimed
+from src.services.write_buffer import StatusWriteBuffer
 
 logger = logging.getLogger(__name__)
 
 class SheetsService:
-    def __init__(self, invoice_repo: InvoiceRepository, sheets_provider: SheetsProvider):
+    def __init__(
+        self,
+        invoice_repo: InvoiceRepository,
+        sheets_provider: SheetsProvider,
+        claim_size: int = 0,
+        lease_seconds: int = 900,
+        worker_id: str | None = None,
+        shard: Shard | None = None,
+        write_batch_size: int = 0,
+        write_flush_seconds: float = 5.0,
+        page_size: int = 500
+    ):
+        """
+        Args:
+            invoice_repo: Repository with processed invoices.
+            sheets_provider: Destination spreadsheet.
+            claim_size: If above 0, unsynced invoices are leased from the repository in
+                batches of this size, so parallel workers never append the same row twice.
+            lease_seconds: How long claimed invoices stay reserved for this worker.
+            worker_id: Lease owner name; defaults to host, Cloud Run task and process.
+            shard: Without leases, only unsynced invoices in this shard are read.
+                Defaults to the shard of the current Cloud Run job task.
+            write_batch_size: If above 1, sync status changes are buffered and written
+                in bulk once this many are pending, instead of one write each.
+            write_flush_seconds: Longest time a buffered status change waits for its batch.
+            page_size: Without leases, unsynced invoices are read lazily in pages of this size.
+        """
         self.invoice_repo = invoice_repo
         self.sheets_provider = sheets_provider
+        self.claim_size = claim_size
+        self.lease_seconds = lease_seconds
+        self.worker_id = worker_id or default_worker_id()
+        self.shard = shard or Shard.from_env()
+        self.page_size = page_size
+        self.status_writes = StatusWriteBuffer(
+            invoice_repo.update_processed_invoice_sync_statuses, write_batch_size, write_flush_seconds
+        ) if write_batch_size > 1 else None
 
-    def run(self) -> dict:
+    def run(self, invoices: Iterable[ProcessedInvoice] | None = None) -> dict:
+        """
+        Appends processed invoices to the sheet.
+
+        Args:
+            invoices: Invoices to export as they arrive (e.g. from a pipeline queue).
+                Defaults to all unsynced invoices in the repository.
+        """
         logger.info("Starting Sheets Sync Service...")
-        unsynced_invoices = self.invoice_repo.get_unsynced_processed_invoices()
-        logger.info(f"Found {len(unsynced_invoices)} unsynced invoices.")
+        if invoices is None and self.claim_size > 0:
+            logger.info(f"Claiming unsynced invoices in batches of {self.claim_size} as {self.worker_id}.")
+            invoices = iter_claimed(lambda: self.invoice_repo.claim_unsynced_processed_invoices(
+                self.worker_id, self.claim_size, self.lease_seconds
+            ))
+        elif invoices is None:
+            invoices = self.invoice_repo.iter_unsynced_processed_invoice_rows(shard=self.shard, page_size=self.page_size)
+            shard_label = f" in shard {self.shard.index + 1}/{self.shard.count}" if self.shard.is_partial else ""
+            logger.info(f"Reading unsynced invoices{shard_label} in pages of {self.page_size}.")
 
+        if self.status_writes is not None:
+            self.status_writes.failures = {}
+        total_count = 0
         success_count = 0
         failed_count = 0
 
-        for invoice in unsynced_invoices:
+        for invoice in invoices:
+            total_count += 1
             try:
                 self.sheets_provider.append_invoice(invoice)
-                self.invoice_repo.update_processed_invoice_sync_status(invoice.id, SyncStatus.SYNCED.value)
+                self._set_sync_status(invoice.id, SyncStatus.SYNCED)
                 logger.info(f"Successfully synced invoice {invoice.id} to Sheets.")
                 success_count += 1
             except Exception as e:
                 logger.error(f"Failed to sync invoice {invoice.id}: {e}")
-                self.invoice_repo.update_processed_invoice_sync_status(invoice.id, SyncStatus.FAILED.value, str(e))
+                self._set_sync_status(invoice.id, SyncStatus.FAILED, str(e))
                 failed_count += 1
-        
-        return {'total': len(unsynced_invoices), 'success': success_count, 'failed': failed_count}
+
+        stats = {'total': total_count, 'success': success_count, 'failed': failed_count}
+        if self.status_writes is not None:
+            self.status_writes.flush()
+            stats['write_failures'] = len(self.status_writes.failures)
+        return stats
+
+    def _set_sync_status(self, invoice_id: str, status: SyncStatus, error: str | None = None):
+        """Writes a sync status change, through the write buffer if enabled."""
+        if self.status_writes is not None:
+            self.status_writes.add(invoice_id, status.value, error)
+        elif error is None:
+            self.invoice_repo.update_processed_invoice_sync_status(invoice_id, status.value)
+        else:
+            self.invoice_repo.update_processed_invoice_sync_status(invoice_id, status.value, error)
@@ -0,0 +1,95 @@
+"""Buffers status transitions so they reach the repository in bulk writes."""
+import logging
+import threading
+import time
+from collections.abc import Callable
+from src.domain.entities import StatusUpdate, LEASE_LOST
+
+logger = logging.getLogger(__name__)
+
+
+class StatusWriteBuffer:
+    """
+    Collects status updates and hands them to `write` in batches.
+
+    A batch is written once `max_size` updates are buffered or the oldest one
+    has waited `max_delay_seconds`, and on `flush`. The delay is enforced by a
+    timer thread, so a quiet buffer is still written on time. With a `max_size`
+    of 1 or less every update is written immediately. `write` applies a list of updates
+    and returns the error messages of the ones that failed, keyed by invoice id
+    (e.g. `InvoiceRepository.update_raw_invoice_statuses`). Failures are logged
+    and collected in `failures`; they do not interrupt the caller. Updates the
+    repository skipped because their lease was lost while they waited in the
+    buffer are collected in `lease_lost` instead.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[list[StatusUpdate]], dict[str, str]],
+        max_size: int = 100,
+        max_delay_seconds: float = 5.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.write = write
+        self.max_size = max_size
+        self.max_delay_seconds = max_delay_seconds
+        self.clock = clock
+        self.failures: dict[str, str] = {}
+        self.lease_lost: set[str] = set()
+        self._pending: list[StatusUpdate] = []
+        self._oldest: float | None = None
+        self._timer: threading.Timer | None = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, invoice_id: str, status: str, error: str | None = None, lease_owner: str | None = None):
+        """
+        Buffers one update and writes the batch if it is full or old enough.
+
+        With `lease_owner`, the repository checks the lease when the batch is written;
+        an update whose lease was lost by then is skipped and reported in `failures`.
+        """
+        with self._lock:
+            if not self._pending:
+                self._oldest = self.clock()
+            self._pending.append(StatusUpdate(invoice_id, status, error, lease_owner))
+            due = len(self._pending) >= self.max_size or self.clock() - self._oldest >= self.max_delay_seconds
+            if not due and self._timer is None:
+                self._timer = threading.Timer(self.max_delay_seconds, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if due:
+            self.flush()
+
+    def flush(self) -> dict[str, str]:
+        """
+        Writes all buffered updates.
+
+        Returns:
+            Error messages of the updates in this batch that failed, keyed by invoice id.
+        """
+        with self._lock:
+            updates, self._pending, self._oldest = self._pending, [], None
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        if not updates:
+            return {}
+
+        try:
+            failed = self.write(updates)
+        except Exception as e:
+            failed = {update.invoice_id: str(e) for update in updates}
+
+        stale = {invoice_id for invoice_id, message in failed.items() if message == LEASE_LOST}
+        for invoice_id, message in failed.items():
+            if invoice_id in stale:
+                logger.warning(f"Status of invoice {invoice_id} not written: its lease was claimed by another worker")
+            else:
+                logger.error(f"Could not write status of invoice {invoice_id}: {message}")
+        with self._lock:
+            self.lease_lost.update(stale)
+            self.failures.update({invoice_id: message for invoice_id, message in failed.items() if invoice_id not in stale})
+        return failed
@@ -0,0 +1,159 @@
+"""
+Write-count tests against the Firestore emulator.
+
+Start the emulator (`gcloud emulators firestore start --host-port=localhost:8080`)
+and set FIRESTORE_EMULATOR_HOST=localhost:8080 to run it; it is skipped otherwise.
+"""
+import os
+import uuid
+import pytest
+from datetime import datetime
+from unittest.mock import Mock, patch
+from src.domain.entities import RawInvoice, ProcessedInvoice, Email, ProcessingStatus, SyncStatus, StatusUpdate
+from src.domain.sharding import Shard
+from src.domain.validation import map_extraction
+from src.services.processing_service import ProcessingService
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("FIRESTORE_EMULATOR_HOST"),
+    reason="FIRESTORE_EMULATOR_HOST is not set"
+)
+
+INVOICES = 200
+
+
+def make_adapter(count):
+    """An adapter on a fresh emulator project holding `count` pending raw invoices."""
+    from src.infrastructure.firestore_adapter import FirestoreAdapter
+    adapter = FirestoreAdapter(project_id=f"demo-{uuid.uuid4().hex[:12]}", database="(default)")
+    ids = [str(uuid.uuid4()) for _ in range(count)]
+    for invoice_id in ids:
+        adapter.save_raw_invoice(RawInvoice(
+            id=invoice_id,
+            email_id=invoice_id,
+            email_data=Email(id=invoice_id, sender="a@b.c", subject="Invoice", date=datetime.now(), attachment_path=f"/tmp/{invoice_id}.pdf"),
+            status=ProcessingStatus.PENDING,
+            created_at=datetime.now(),
+            updated_at=datetime.now()
+        ))
+    adapter.ids = ids
+    return adapter
+
+
+def make_llm():
+    llm = Mock()
+    llm.extract_invoice_data.side_effect = lambda path: {
+        "invoice_date": "2023-01-01", "category": "JEDZENIE", "vendor": "Vendor",
+        "net_amount": 100.0, "gross_amount": 123.0, "invoice_number": path, "payment_date": "2023-01-14"
+    }
+    return llm
+
+
+def test_bulk_status_updates_need_far_fewer_writes():
+    # Arrange
+    adapter = make_adapter(2 * INVOICES)
+    api = adapter.client._firestore_api
+    single_ids, bulk_ids = adapter.ids[:INVOICES], adapter.ids[INVOICES:]
+
+    # Act
+    with patch.object(api, "commit", wraps=api.commit) as commit:
+        for invoice_id in single_ids:
+            adapter.update_raw_invoice_status(invoice_id, ProcessingStatus.PROCESSED.value)
+    with patch.object(api, "batch_write", wraps=api.batch_write) as batch_write:
+        failures = adapter.update_raw_invoice_statuses(
+            [StatusUpdate(invoice_id, ProcessingStatus.PROCESSED.value) for invoice_id in bulk_ids]
+        )
+
+    # Assert
+    assert failures == {}
+    assert commit.call_count == INVOICES
+    assert batch_write.call_count <= INVOICES // 20
+    statuses = {doc.get("status") for doc in adapter.client.collection("raw_invoices").stream() if doc.id in bulk_ids}
+    assert statuses == {ProcessingStatus.PROCESSED.value}
+
+
+def test_processed_invoice_is_committed_in_one_round_trip():
+    # Arrange
+    adapter = make_adapter(40)
+    api = adapter.client._firestore_api
+    llm = make_llm()
+    two_write_ids = adapter.ids[:20]
+
+    # Act
+    # Previous path: save the processed invoice, then mark the raw invoice PROCESSED
+    with patch.object(api, "commit", wraps=api.commit) as two_writes:
+        for invoice_id in two_write_ids:
+            adapter.save_processed_invoice(ProcessedInvoice(
+                id=invoice_id,
+                raw_invoice_id=invoice_id,
+                extracted_data=map_extraction(llm.extract_invoice_data(f"/tmp/{invoice_id}.pdf")),
+                sync_status=SyncStatus.NOT_SYNCED,
+                created_at=datetime.now(),
+                updated_at=datetime.now()
+            ))
+            adapter.update_raw_invoice_status(invoice_id, ProcessingStatus.PROCESSED.value)
+    with patch.object(api, "commit", wraps=api.commit) as one_write:
+        stats = ProcessingService(adapter, llm, shard=Shard()).run()
+
+    # Assert
+    assert stats['success'] == 20
+    assert two_writes.call_count == 2 * len(two_write_ids)
+    assert one_write.call_count == stats['success']
+    assert adapter.get_pending_raw_invoices([ProcessingStatus.PENDING]) == []
+
+
+def test_crash_inside_the_commit_leaves_both_documents_unchanged():
+    # Arrange
+    adapter = make_adapter(1)
+    api = adapter.client._firestore_api
+    llm = make_llm()
+
+    # Act
+    with patch.object(api, "commit", side_effect=KeyboardInterrupt("worker killed")):
+        with pytest.raises(KeyboardInterrupt):
+            ProcessingService(adapter, llm, shard=Shard()).run()
+
+    # Assert
+    raw = adapter.client.collection("raw_invoices").document(adapter.ids[0]).get()
+    assert raw.get("status") == ProcessingStatus.PENDING.value
+    assert list(adapter.client.collection("processed_invoices").stream()) == []
+
+    # The next run extracts it again and saves it exactly once
+    stats = ProcessingService(adapter, llm, shard=Shard()).run()
+    assert stats['success'] == 1
+    assert llm.extract_invoice_data.call_count == 2
+    assert len(list(adapter.client.collection("processed_invoices").stream())) == 1
+
+
+def test_worker_that_lost_its_lease_cannot_commit():
+    # Arrange
+    adapter = make_adapter(1)
+    claimed = adapter.claim_raw_invoices("slow_task", limit=1, lease_seconds=-1)
+    adapter.claim_raw_invoices("task1", limit=1, lease_seconds=60)
+
+    # Act
+    stats = ProcessingService(adapter, make_llm(), claim_size=1, worker_id="slow_task").run(raw_invoices=claimed)
+
+    # Assert
+    assert stats['lease_lost'] == 1
+    assert list(adapter.client.collection("processed_invoices").stream()) == []
+    raw = adapter.client.collection("raw_invoices").document(adapter.ids[0]).get()
+    assert raw.get("lease_owner") == "task1"
+
+
+def test_status_writes_of_a_lost_lease_are_skipped():
+    # Arrange
+    adapter = make_adapter(2)
+    claimed = adapter.claim_raw_invoices("slow_task", limit=2, lease_seconds=-1)
+    adapter.claim_raw_invoices("task1", limit=2, lease_seconds=60)
+    llm = Mock()
+    llm.extract_invoice_data.side_effect = ValueError("Unreadable PDF")
+
+    # Act
+    ProcessingService(adapter, llm, claim_size=2, worker_id="slow_task").run(raw_invoices=claimed[:1])
+    stats = ProcessingService(adapter, llm, claim_size=2, worker_id="slow_task", write_batch_size=10).run(raw_invoices=claimed[1:])
+
+    # Assert
+    assert (stats['write_failures'], stats['lease_lost']) == (0, 1)
+    for doc in adapter.client.collection("raw_invoices").stream():
+        assert (doc.get("status"), doc.get("lease_owner")) == (ProcessingStatus.IN_PROGRESS.value, "task1")
@@ -51,10 +51,10 @@ def test_end_to_end_happy_path(
         attachment_path="/tmp/invoice.pdf"
     )
     
-    mock_email_provider.fetch_unread_emails_with_attachments.return_value = [email]
-    mock_invoice_repo.get_pending_raw_invoices.return_value = []  # Will be populated by retrieval
-    mock_invoice_repo.get_unsynced_processed_invoices.return_value = []
-    mock_invoice_repo.invoice_number_exists.return_value = False  # No duplicates
+    mock_email_provider.iter_unread_emails_with_attachments.return_value = iter([email])
+    mock_invoice_repo.iter_pending_raw_invoice_rows.return_value = []  # Will be populated by retrieval
+    mock_invoice_repo.iter_unsynced_processed_invoice_rows.return_value = []
+    mock_invoice_repo.get_invoice_keys.return_value = []  # No duplicates
     
     mock_llm_provider.extract_invoice_data.return_value = {
         "invoice_date": "2023-01-01",
@@ -80,17 +80,17 @@ def test_end_to_end_happy_path(
         created_at=datetime.now(),
         updated_at=datetime.now()
     )
-    mock_invoice_repo.get_pending_raw_invoices.return_value = [raw_invoice]
+    mock_invoice_repo.iter_pending_raw_invoice_rows.return_value = [raw_invoice]
     
     processing_service = ProcessingService(mock_invoice_repo, mock_llm_provider)
     processing_service.run()
     
     # Assert
-    mock_email_provider.fetch_unread_emails_with_attachments.assert_called_once()
+    mock_email_provider.iter_unread_emails_with_attachments.assert_called_once()
     mock_invoice_repo.save_raw_invoice.assert_called_once()
-    mock_email_provider.mark_as_processed.assert_called_once_with("email_1")
+    mock_email_provider.mark_many_as_processed.assert_called_once_with(["email_1"])
     mock_llm_provider.extract_invoice_data.assert_called_once()
-    mock_invoice_repo.save_processed_invoice.assert_called_once()
+    mock_invoice_repo.commit_processed_invoice.assert_called_once()
 
 
 def test_summary_generation_structure(mock_notification_provider):
@@ -131,7 +131,7 @@ def test_partial_failure_workflow(
         for i in range(3)
     ]
     
-    mock_email_provider.fetch_unread_emails_with_attachments.return_value = emails
+    mock_email_provider.iter_unread_emails_with_attachments.return_value = iter(emails)
     
     # Mock LLM to fail on second invoice
     mock_llm_provider.extract_invoice_data.side_effect = [
@@ -162,4 +162,4 @@ def test_partial_failure_workflow(
     
     # Assert - all emails should be retrieved despite later processing failures
     assert mock_invoice_repo.save_raw_invoice.call_count == 3
-    assert mock_email_provider.mark_as_processed.call_count == 3
+    mock_email_provider.mark_many_as_processed.assert_called_once_with(["email_0", "email_1", "email_2"])
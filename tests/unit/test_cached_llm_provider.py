@@ -0,0 +1,182 @@
+"""Unit tests for CachedLLMProvider."""
+import threading
+import pytest
+from unittest.mock import Mock
+from src.infrastructure.cached_llm_provider import CachedLLMProvider
+
+
+EXTRACTION = {
+    "invoice_date": "2023-01-01",
+    "category": "JEDZENIE",
+    "vendor": "Test Vendor",
+    "net_amount": 100.0,
+    "gross_amount": 123.0,
+    "invoice_number": "INV/001",
+    "payment_date": "2023-01-14"
+}
+
+
+@pytest.fixture
+def prompt_files(tmp_path):
+    instruction = tmp_path / "instruction.md"
+    categories = tmp_path / "categories.yaml"
+    instruction.write_text("Extract the invoice.", encoding="utf-8")
+    categories.write_text("categories:\n  - JEDZENIE\n", encoding="utf-8")
+    return instruction, categories
+
+
+@pytest.fixture
+def pdf_file(tmp_path):
+    pdf = tmp_path / "invoice.pdf"
+    pdf.write_bytes(b"%PDF-1.4 fake invoice")
+    return pdf
+
+
+@pytest.fixture
+def mock_llm_provider():
+    provider = Mock()
+    provider.model_name = "gemini-test"
+    provider.extract_invoice_data.return_value = dict(EXTRACTION)
+    return provider
+
+
+def make_cache(llm_provider, prompt_files, repo=None, max_memory_entries=10):
+    instruction, categories = prompt_files
+    return CachedLLMProvider(
+        llm_provider,
+        invoice_repo=repo,
+        max_memory_entries=max_memory_entries,
+        instruction_file=str(instruction),
+        categories_file=str(categories)
+    )
+
+
+def test_second_extraction_of_same_pdf_hits_memory(mock_llm_provider, prompt_files, pdf_file):
+    # Arrange
+    cache = make_cache(mock_llm_provider, prompt_files)
+
+    # Act
+    first = cache.extract_invoice_data(str(pdf_file))
+    second = cache.extract_invoice_data(str(pdf_file))
+
+    # Assert
+    assert first == second == EXTRACTION
+    mock_llm_provider.extract_invoice_data.assert_called_once()
+    assert cache.stats == {'memory_hits': 1, 'store_hits': 0, 'misses': 1}
+
+
+def test_persistent_tier_survives_new_instance(mock_llm_provider, prompt_files, pdf_file):
+    # Arrange
+    store = {}
+    repo = Mock()
+    repo.get_cached_extraction.side_effect = store.get
+    repo.save_cached_extraction.side_effect = store.__setitem__
+    make_cache(mock_llm_provider, prompt_files, repo).extract_invoice_data(str(pdf_file))
+
+    # Act - e.g. the next run after reset_pipeline.py
+    cache = make_cache(mock_llm_provider, prompt_files, repo)
+    result = cache.extract_invoice_data(str(pdf_file))
+
+    # Assert
+    assert result == EXTRACTION
+    mock_llm_provider.extract_invoice_data.assert_called_once()
+    assert cache.stats['store_hits'] == 1
+
+
+def test_prompt_change_invalidates_cache(mock_llm_provider, prompt_files, pdf_file):
+    # Arrange
+    cache = make_cache(mock_llm_provider, prompt_files)
+    cache.extract_invoice_data(str(pdf_file))
+    instruction, _ = prompt_files
+
+    # Act
+    instruction.write_text("Extract the invoice. Use ISO dates.", encoding="utf-8")
+    cache.extract_invoice_data(str(pdf_file))
+
+    # Assert
+    assert mock_llm_provider.extract_invoice_data.call_count == 2
+
+
+def test_memory_tier_is_bounded(mock_llm_provider, prompt_files, tmp_path):
+    # Arrange
+    cache = make_cache(mock_llm_provider, prompt_files, max_memory_entries=2)
+    pdfs = []
+    for i in range(3):
+        pdf = tmp_path / f"invoice{i}.pdf"
+        pdf.write_bytes(f"%PDF-1.4 invoice {i}".encode())
+        pdfs.append(str(pdf))
+
+    # Act
+    for pdf in pdfs:
+        cache.extract_invoice_data(pdf)
+    cache.extract_invoice_data(pdfs[0])  # evicted as least recently used
+
+    # Assert
+    assert len(cache._memory) == 2
+    assert mock_llm_provider.extract_invoice_data.call_count == 4
+
+
+def test_batch_extraction_sends_only_misses(mock_llm_provider, prompt_files, tmp_path, pdf_file):
+    # Arrange
+    cache = make_cache(mock_llm_provider, prompt_files)
+    cache.extract_invoice_data(str(pdf_file))
+    new_pdf = tmp_path / "new.pdf"
+    new_pdf.write_bytes(b"%PDF-1.4 new invoice")
+    mock_llm_provider.extract_invoice_data_batch.return_value = {"new": dict(EXTRACTION)}
+
+    # Act
+    results = cache.extract_invoice_data_batch({"cached": str(pdf_file), "new": str(new_pdf)})
+
+    # Assert
+    assert results == {"cached": EXTRACTION, "new": EXTRACTION}
+    mock_llm_provider.extract_invoice_data_batch.assert_called_once_with({"new": str(new_pdf)})
+    assert cache.extract_invoice_data(str(new_pdf)) == EXTRACTION
+    assert mock_llm_provider.extract_invoice_data.call_count == 1
+
+
+def test_invalid_result_is_not_cached(mock_llm_provider, prompt_files, pdf_file):
+    # Arrange
+    repo = Mock()
+    repo.get_cached_extraction.return_value = None
+    mock_llm_provider.extract_invoice_data.return_value = dict(EXTRACTION, gross_amount=12.3)
+    cache = make_cache(mock_llm_provider, prompt_files, repo=repo)
+
+    # Act
+    cache.extract_invoice_data(str(pdf_file))
+    cache.extract_invoice_data(str(pdf_file))
+
+    # Assert
+    assert mock_llm_provider.extract_invoice_data.call_count == 2
+    repo.save_cached_extraction.assert_not_called()
+
+
+def test_concurrent_workers_share_a_small_memory_tier(mock_llm_provider, prompt_files, tmp_path):
+    # Arrange
+    pdfs = []
+    for i in range(8):
+        pdf = tmp_path / f"invoice_{i}.pdf"
+        pdf.write_bytes(f"%PDF-1.4 invoice {i}".encode())
+        pdfs.append(str(pdf))
+    cache = make_cache(mock_llm_provider, prompt_files, max_memory_entries=2)
+    errors = []
+
+    def worker():
+        try:
+            for _ in range(50):
+                for pdf in pdfs:
+                    cache.extract_invoice_data(pdf)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+
+    # Act
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Assert
+    assert errors == []
+    assert sum(cache.stats.values()) == 8 * 50 * len(pdfs)
+    assert len(cache._memory) <= 2
@@ -0,0 +1,100 @@
+"""Unit tests for CascadeLLMProvider."""
+import pytest
+from unittest.mock import Mock
+from src.infrastructure.cascade_llm_provider import CascadeLLMProvider
+
+
+def extraction(net=100.0, gross=123.0):
+    return {
+        "invoice_date": "2023-01-01",
+        "category": "JEDZENIE",
+        "vendor": "Test Vendor",
+        "net_amount": net,
+        "gross_amount": gross,
+        "invoice_number": "INV/001",
+        "payment_date": "2023-01-14"
+    }
+
+
+def tier(model_name, result=None, side_effect=None):
+    provider = Mock()
+    provider.model_name = model_name
+    provider.extract_invoice_data.return_value = result
+    provider.extract_invoice_data.side_effect = side_effect
+    return provider
+
+
+def test_valid_cheap_result_is_not_escalated():
+    # Arrange
+    cheap, strong = tier("flash-lite", extraction()), tier("flash", extraction())
+    cascade = CascadeLLMProvider([cheap, strong])
+
+    # Act
+    result = cascade.extract_invoice_data("invoice.pdf")
+
+    # Assert
+    assert result == extraction()
+    strong.extract_invoice_data.assert_not_called()
+    assert cascade.stats["flash-lite"]["calls"] == 1
+    assert cascade.stats["flash"]["calls"] == 0
+
+
+@pytest.mark.parametrize("bad_result", [
+    extraction(net=123.0, gross=100.0),
+    {**extraction(), "invoice_date": "yesterday"},
+    extraction(net=-100.0, gross=123.0),
+])
+def test_implausible_cheap_result_escalates(bad_result):
+    # Arrange
+    cheap, strong = tier("flash-lite", bad_result), tier("flash", extraction())
+    cascade = CascadeLLMProvider([cheap, strong])
+
+    # Act
+    result = cascade.extract_invoice_data("invoice.pdf")
+
+    # Assert
+    assert result == extraction()
+    assert cascade.stats["flash-lite"] == {'calls': 1, 'escalations': 1, 'seconds': pytest.approx(0, abs=1)}
+    assert cascade.stats["flash"]["calls"] == 1
+
+
+def test_unparseable_output_escalates_and_api_errors_do_not():
+    # Arrange
+    cheap = tier("flash-lite", side_effect=[ValueError("Expecting value"), RuntimeError("429 RESOURCE_EXHAUSTED")])
+    strong = tier("flash", extraction())
+    cascade = CascadeLLMProvider([cheap, strong])
+
+    # Act / Assert
+    assert cascade.extract_invoice_data("a.pdf") == extraction()
+    with pytest.raises(RuntimeError, match="429"):
+        cascade.extract_invoice_data("b.pdf")
+    assert strong.extract_invoice_data.call_count == 1
+
+
+def test_last_tier_result_is_returned_even_if_implausible():
+    # Arrange
+    cascade = CascadeLLMProvider([tier("flash-lite", extraction(net=0.0)), tier("flash", extraction(net=0.0))])
+
+    # Act
+    result = cascade.extract_invoice_data("invoice.pdf")
+
+    # Assert
+    assert result["net_amount"] == 0.0
+
+
+def test_batch_escalates_only_rejected_items():
+    # Arrange
+    cheap, strong = tier("flash-lite"), tier("flash")
+    cheap.extract_invoice_data_batch.return_value = {"a": extraction(), "b": extraction(net=500.0), "c": RuntimeError("Unreadable PDF")}
+    strong.extract_invoice_data_batch.return_value = {"b": extraction()}
+    cascade = CascadeLLMProvider([cheap, strong])
+
+    # Act
+    results = cascade.extract_invoice_data_batch({"a": "a.pdf", "b": "b.pdf", "c": "c.pdf"})
+
+    # Assert
+    strong.extract_invoice_data_batch.assert_called_once_with({"b": "b.pdf"})
+    assert results["b"] == extraction()
+    assert isinstance(results["c"], RuntimeError)
+    assert cascade.stats["flash-lite"]["calls"] == 3
+    assert cascade.stats["flash"]["calls"] == 1
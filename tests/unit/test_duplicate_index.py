@@ -0,0 +1,191 @@
+"""Unit tests for duplicate detection (InvoiceKey and DuplicateIndex)."""
+import random
+import threading
+from datetime import date, datetime, timedelta
+from unittest.mock import Mock, patch
+from src.domain.duplicates import InvoiceKey, normalize_invoice_number, normalize_vendor
+from src.domain.entities import InvoiceData
+from src.services.duplicate_index import DuplicateIndex
+
+
+def make_invoice(vendor="Bukat Sp. z o.o.", number="F/0019864/2025", gross=851.19, issued=datetime(2025, 3, 7)):
+    return InvoiceData(
+        invoice_date=issued,
+        category="JEDZENIE",
+        vendor_name=vendor,
+        net_amount=round(gross / 1.23, 2),
+        gross_amount=gross,
+        invoice_number=number,
+        due_date=issued + timedelta(days=14)
+    )
+
+
+def make_index(known=()):
+    repo = Mock()
+    repo.get_invoice_keys.return_value = [InvoiceKey.from_invoice(invoice) for invoice in known]
+    return DuplicateIndex(repo), repo
+
+
+def test_normalization():
+    assert normalize_vendor("Bukat Sp. z o.o.") == normalize_vendor("BUKAT sp. z o. o.") == "bukat"
+    assert normalize_vendor("Kuchnie Świata S.A.") == "kuchnieswiata"
+    assert normalize_invoice_number("F/0019864/2025") == normalize_invoice_number("F 0019864/2025") == "F00198642025"
+    assert normalize_invoice_number("FV/O1/2025") == normalize_invoice_number("FV/01/2025")
+
+
+def test_number_read_with_different_separators_is_a_duplicate():
+    # Arrange
+    index, repo = make_index([make_invoice(number="F/0019864/2025")])
+
+    # Act
+    match = index.reserve(make_invoice(vendor="BUKAT SP Z O O", number="F 0019864/2025"))
+
+    # Assert
+    assert match.invoice_number == "F/0019864/2025"
+    repo.get_invoice_keys.assert_called_once_with()
+
+
+def test_same_number_from_another_vendor_is_not_a_duplicate():
+    # Arrange
+    index, _ = make_index([make_invoice(vendor="Bukat Sp. z o.o.", number="55/03/2025")])
+
+    # Act
+    match = index.reserve(make_invoice(vendor="Kuchnie Świata S.A.", number="55/03/2025", gross=120.0))
+
+    # Assert
+    assert match is None
+
+
+def test_truncated_number_with_same_amount_and_date_is_a_duplicate():
+    # Arrange
+    index, _ = make_index([make_invoice(number="F/0019864/2025")])
+
+    # Act
+    truncated = index.reserve(make_invoice(number="0019864/2025"))
+    next_invoice = index.reserve(make_invoice(number="F/0019865/2025"))
+
+    # Assert
+    assert truncated is not None
+    assert next_invoice is None
+
+
+def test_released_invoice_can_be_reserved_again():
+    # Arrange
+    index, _ = make_index()
+    invoice = make_invoice()
+    index.reserve(invoice)
+
+    # Act
+    index.release(invoice)
+
+    # Assert
+    assert index.reserve(invoice) is None
+    assert len(index) == 1
+
+
+def test_concurrent_reservations_admit_one_winner():
+    # Arrange
+    index, _ = make_index()
+    results = []
+    barrier = threading.Barrier(8)
+
+    def reserve():
+        barrier.wait()
+        results.append(index.reserve(make_invoice()))
+
+    threads = [threading.Thread(target=reserve) for _ in range(8)]
+
+    # Act
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Assert
+    assert results.count(None) == 1
+
+
+def test_misses_are_confirmed_when_other_tasks_write():
+    # Arrange
+    index, repo = make_index()
+    index.confirm_misses = True
+    saved = [InvoiceKey.from_invoice(make_invoice(number="FV/9/2025"))]
+    repo.get_invoice_keys.side_effect = lambda invoice_number=None: saved if invoice_number == "FV/9/2025" else []
+
+    # Act
+    saved_elsewhere = index.reserve(make_invoice(number="FV/9/2025"))
+    new = index.reserve(make_invoice(number="FV/10/2025"))
+
+    # Assert
+    assert saved_elsewhere is not None
+    assert new is None
+
+
+def test_same_number_from_another_vendor_saved_elsewhere_is_not_a_duplicate():
+    # Arrange
+    index, repo = make_index()
+    index.confirm_misses = True
+    saved = [InvoiceKey.from_invoice(make_invoice(vendor="Bukat Sp. z o.o.", number="FV/1/2024"))]
+    repo.get_invoice_keys.side_effect = lambda invoice_number=None: saved if invoice_number == "FV/1/2024" else []
+
+    # Act
+    other_vendor = index.reserve(make_invoice(vendor="Kuchnie Świata S.A.", number="FV/1/2024", gross=99.0))
+    same_vendor = index.reserve(make_invoice(vendor="BUKAT SP Z O O", number="FV/1/2024"))
+
+    # Assert
+    assert other_vendor is None
+    assert same_vendor == saved[0]
+    repo.get_invoice_keys.assert_any_call(invoice_number="FV/1/2024")
+
+
+def test_load_failure_falls_back_to_repository_queries():
+    # Arrange
+    repo = Mock()
+    known = [InvoiceKey.from_invoice(make_invoice())]
+
+    def get_invoice_keys(invoice_number=None):
+        if invoice_number is None:
+            raise RuntimeError("Firestore unavailable")
+        return known
+
+    repo.get_invoice_keys.side_effect = get_invoice_keys
+    index = DuplicateIndex(repo)
+
+    # Act
+    match = index.reserve(make_invoice())
+
+    # Assert
+    assert match == known[0]
+    repo.get_invoice_keys.assert_called_with(invoice_number="F/0019864/2025")
+
+
+def test_lookups_compare_only_a_few_candidates_at_100k_invoices():
+    # Arrange
+    rng = random.Random(0)
+    vendors = [f"Dostawca {i} Sp. z o.o." for i in range(500)]
+    known = [
+        InvoiceKey.from_fields(
+            rng.choice(vendors),
+            f"FV/{i:06d}/{rng.randint(2020, 2025)}",
+            rng.randint(1000, 500000) / 100,
+            date(2020, 1, 1) + timedelta(days=rng.randint(0, 2000))
+        )
+        for i in range(100_000)
+    ]
+    repo = Mock()
+    repo.get_invoice_keys.return_value = known
+    index = DuplicateIndex(repo)
+    index.find(known[0])
+    probes = [
+        InvoiceKey.from_fields(rng.choice(vendors), f"FV {rng.randint(0, 200_000):06d}/2025", 100.0, date(2024, 5, 1))
+        for _ in range(2000)
+    ]
+
+    # Act
+    with patch.object(InvoiceKey, "matches", autospec=True, side_effect=InvoiceKey.matches) as matches:
+        for probe in probes:
+            index.find(probe)
+
+    # Assert
+    assert len(index) == 100_000
+    assert matches.call_count / len(probes) < 5
@@ -4,6 +4,7 @@ from unittest.mock import Mock
 from datetime import datetime
 from src.services.processing_service import ProcessingService
 from src.services.notification_service import NotificationService
+from src.domain.duplicates import InvoiceKey
 from src.domain.entities import RawInvoice, ProcessingStatus, Email
 
 
@@ -46,9 +47,9 @@ class TestProcessingServiceErrorCollection:
     def test_run_returns_errors_list_for_duplicate_invoice(self, mock_invoice_repo, mock_llm_provider):
         """Test that duplicate invoice errors are collected with details."""
         # Arrange
-        mock_invoice_repo.invoice_number_exists.return_value = True
+        mock_invoice_repo.get_invoice_keys.return_value = [InvoiceKey.from_fields("Test Vendor", "INV/001", 123.0, "2023-01-01")]
         raw_invoice = create_raw_invoice(attachment_path="/tmp/Faktura_001.pdf")
-        mock_invoice_repo.get_pending_raw_invoices.return_value = [raw_invoice]
+        mock_invoice_repo.iter_pending_raw_invoice_rows.return_value = [raw_invoice]
         
         mock_llm_provider.extract_invoice_data.return_value = {
             "invoice_date": "2023-01-01",
@@ -74,9 +75,9 @@ class TestProcessingServiceErrorCollection:
     def test_run_returns_empty_errors_list_on_success(self, mock_invoice_repo, mock_llm_provider):
         """Test that successful processing returns empty errors list."""
         # Arrange
-        mock_invoice_repo.invoice_number_exists.return_value = False
+        mock_invoice_repo.get_invoice_keys.return_value = []
         raw_invoice = create_raw_invoice()
-        mock_invoice_repo.get_pending_raw_invoices.return_value = [raw_invoice]
+        mock_invoice_repo.iter_pending_raw_invoice_rows.return_value = [raw_invoice]
         
         mock_llm_provider.extract_invoice_data.return_value = {
             "invoice_date": "2023-01-01",
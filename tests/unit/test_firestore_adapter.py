@@ -0,0 +1,38 @@
+"""Unit tests for FirestoreAdapter paths that need no emulator."""
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock, patch
+from src.domain.entities import ProcessingStatus
+from src.infrastructure.firestore_adapter import FirestoreAdapter, MAX_CLAIM_ROUNDS
+
+
+def snapshot(doc_id, data):
+    doc = Mock(id=doc_id, exists=True)
+    doc.reference = f"raw_invoices/{doc_id}"
+    doc.to_dict.return_value = data
+    return doc
+
+
+def test_claim_gives_up_when_other_workers_keep_winning_every_candidate():
+    # Arrange
+    adapter = FirestoreAdapter(project_id="")
+    adapter.client = Mock()
+    collection_ref = adapter.client.collection.return_value
+    # The queries keep returning a pending invoice, but each transaction finds it already leased
+    pending = snapshot("raw_1", {"status": ProcessingStatus.PENDING.value})
+    collection_ref.where.return_value.limit.return_value.stream.return_value = [pending]
+    leased = snapshot("raw_1", {
+        "status": ProcessingStatus.IN_PROGRESS.value,
+        "lease_owner": "worker-b",
+        "lease_expires_at": datetime.now(timezone.utc) + timedelta(minutes=5)
+    })
+    transaction = adapter.client.transaction.return_value
+    transaction.get_all.return_value = [leased]
+
+    # Act
+    with patch('src.infrastructure.firestore_adapter.firestore.transactional', lambda fn: fn):
+        claimed = adapter.claim_raw_invoices("worker-a", limit=1, lease_seconds=60)
+
+    # Assert
+    assert claimed == []
+    assert transaction.get_all.call_count == MAX_CLAIM_ROUNDS
+    transaction.update.assert_not_called()
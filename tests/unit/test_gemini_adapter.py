@@ -0,0 +1,503 @@
+"""Unit tests for GeminiAdapter."""
+import json
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+import pytest
+from unittest.mock import Mock, patch
+from google.genai import errors, types
+from src.infrastructure.gemini_adapter import GeminiAdapter
+from src.domain.invoice_schema import InvoiceExtraction
+from src.infrastructure.pdf_preprocessor import PreparedPdf
+from src.config import settings
+
+
+def extraction(invoice_number):
+    return {
+        "invoice_date": "2023-01-01",
+        "category": "JEDZENIE",
+        "vendor": "Test Vendor",
+        "net_amount": 100.0,
+        "gross_amount": 123.0,
+        "invoice_number": invoice_number,
+        "payment_date": "2023-01-14"
+    }
+
+
+class FakeBatches:
+    """
+    Local stand-in for `client.batches` (Gemini Batch API).
+
+    A job stays RUNNING for `polls_until_done` polls, then succeeds. Files whose
+    name contains "broken" get a per-item error instead of a response; keys in
+    `implausible` get a result without a gross amount.
+    """
+
+    def __init__(self, polls_until_done=2, final_state=types.JobState.JOB_STATE_SUCCEEDED, implausible=()):
+        self.polls_until_done = polls_until_done
+        self.final_state = final_state
+        self.implausible = implausible
+        self.jobs = {}
+        self.polls = 0
+        self.cancelled = []
+
+    def create(self, model, src, config=None):
+        name = f"batches/{len(self.jobs) + 1}"
+        self.jobs[name] = src
+        return types.BatchJob(name=name, state=types.JobState.JOB_STATE_RUNNING)
+
+    def cancel(self, name):
+        self.cancelled.append(name)
+
+    def get(self, name):
+        self.polls += 1
+        if self.polls < self.polls_until_done:
+            return types.BatchJob(name=name, state=types.JobState.JOB_STATE_RUNNING)
+        if self.final_state != types.JobState.JOB_STATE_SUCCEEDED:
+            return types.BatchJob(name=name, state=self.final_state)
+
+        responses = []
+        for request in self.jobs[name]:
+            key = request.metadata["key"]
+            if "broken" in key:
+                responses.append(types.InlinedResponse(error=types.JobError(code=400, message="Unreadable PDF")))
+            else:
+                result = extraction(f"INV/{key}")
+                if key in self.implausible:
+                    result["gross_amount"] = 0.0
+                text = json.dumps(result)
+                responses.append(types.InlinedResponse(response=types.GenerateContentResponse(
+                    candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part.from_text(text=text)]))]
+                )))
+        return types.BatchJob(
+            name=name,
+            state=types.JobState.JOB_STATE_SUCCEEDED,
+            dest=types.BatchJobDestination(inlined_responses=responses)
+        )
+
+
+@pytest.fixture
+def pdf_files(tmp_path):
+    paths = {}
+    for key in ["raw_1", "raw_broken", "raw_3"]:
+        pdf = tmp_path / f"{key}.pdf"
+        pdf.write_bytes(b"%PDF-1.4 fake invoice")
+        paths[key] = str(pdf)
+    return paths
+
+
+@pytest.fixture
+def adapter_with_fake_batches():
+    with patch('src.infrastructure.gemini_adapter.genai.Client'):
+        adapter = GeminiAdapter(api_key="fake-key", model="gemini-test")
+    adapter.client = Mock()
+    adapter.client.batches = FakeBatches()
+    return adapter
+
+
+@pytest.fixture(autouse=True)
+def fast_polling():
+    with patch('src.infrastructure.gemini_adapter.settings.gemini_batch_poll_seconds', 0):
+        yield
+
+
+def test_batch_extraction_maps_results_back_to_keys(adapter_with_fake_batches, pdf_files):
+    # Act
+    results = adapter_with_fake_batches.extract_invoice_data_batch(pdf_files)
+
+    # Assert
+    assert results["raw_1"]["invoice_number"] == "INV/raw_1"
+    assert results["raw_3"]["invoice_number"] == "INV/raw_3"
+    assert isinstance(results["raw_broken"], RuntimeError)
+    assert "Unreadable PDF" in str(results["raw_broken"])
+    assert adapter_with_fake_batches.client.batches.polls == 2
+    adapter_with_fake_batches.client.models.generate_content.assert_not_called()
+
+
+def test_batch_extraction_reports_missing_file_without_submitting_it(adapter_with_fake_batches, pdf_files):
+    # Arrange
+    pdf_files["raw_missing"] = "/nonexistent/invoice.pdf"
+
+    # Act
+    results = adapter_with_fake_batches.extract_invoice_data_batch(pdf_files)
+
+    # Assert
+    assert isinstance(results["raw_missing"], FileNotFoundError)
+    submitted = adapter_with_fake_batches.client.batches.jobs["batches/1"]
+    assert [r.metadata["key"] for r in submitted] == ["raw_1", "raw_broken", "raw_3"]
+
+
+def test_failed_batch_job_raises(adapter_with_fake_batches, pdf_files):
+    # Arrange
+    adapter_with_fake_batches.client.batches = FakeBatches(final_state=types.JobState.JOB_STATE_EXPIRED)
+
+    # Act / Assert
+    with pytest.raises(RuntimeError, match="JOB_STATE_EXPIRED"):
+        adapter_with_fake_batches.extract_invoice_data_batch(pdf_files)
+
+
+def test_large_batch_is_split_into_jobs_under_the_inline_limit(adapter_with_fake_batches, tmp_path):
+    # Arrange
+    paths = {}
+    for i in range(5):
+        pdf = tmp_path / f"raw_{i}.pdf"
+        pdf.write_bytes(b"%PDF-1.4 " + b"x" * 3000)
+        paths[f"raw_{i}"] = str(pdf)
+
+    # Act
+    with patch('src.infrastructure.gemini_adapter.settings.gemini_batch_max_request_bytes', 9000):
+        results = adapter_with_fake_batches.extract_invoice_data_batch(paths)
+
+    # Assert
+    jobs = adapter_with_fake_batches.client.batches.jobs
+    assert [len(requests) for requests in jobs.values()] == [2, 2, 1]
+    assert all(results[key]["invoice_number"] == f"INV/{key}" for key in paths)
+
+
+def test_batch_jobs_are_cancelled_on_timeout(adapter_with_fake_batches, pdf_files):
+    # Arrange
+    adapter_with_fake_batches.client.batches = FakeBatches(polls_until_done=1000)
+
+    # Act
+    with patch('src.infrastructure.gemini_adapter.settings.gemini_batch_timeout_seconds', -1):
+        with pytest.raises(RuntimeError, match="did not finish in time"):
+            adapter_with_fake_batches.extract_invoice_data_batch(pdf_files)
+
+    # Assert
+    assert adapter_with_fake_batches.client.batches.cancelled == ["batches/1"]
+
+
+class FakeCaches:
+    """Local stand-in for `client.caches` (Gemini context caching)."""
+
+    def __init__(self, fail_with=None):
+        self.fail_with = fail_with
+        self.created = []
+        self.configs = []
+
+    def list(self, config=None):
+        return list(self.created)
+
+    def create(self, model, config):
+        if self.fail_with:
+            raise self.fail_with
+        self.configs.append(config)
+        cached = types.CachedContent(
+            name=f"cachedContents/{len(self.created) + 1}",
+            display_name=config.display_name,
+            model=model,
+            expire_time=datetime.now(timezone.utc) + timedelta(hours=1)
+        )
+        self.created.append(cached)
+        return cached
+
+
+@pytest.fixture
+def caching_adapter(tmp_path):
+    instruction = tmp_path / "instruction.md"
+    instruction.write_text("Extract invoices carefully.", encoding="utf-8")
+    with patch('src.infrastructure.gemini_adapter.genai.Client'):
+        adapter = GeminiAdapter(api_key="fake-key", model="gemini-test", context_cache=True)
+    adapter.client = Mock()
+    adapter.client.caches = FakeCaches()
+    adapter.client.models.generate_content.return_value = Mock(text=json.dumps(extraction("INV/1")))
+    adapter.client.models.count_tokens.return_value = Mock(total_tokens=2000)
+    with patch('src.infrastructure.gemini_adapter.settings.instruction_file', str(instruction)):
+        yield adapter
+
+
+def test_context_cache_is_created_once_and_referenced(caching_adapter, pdf_files):
+    # Act
+    with patch.object(type(settings), 'load_instruction', autospec=True, return_value="Extract invoices carefully.") as load:
+        for path in pdf_files.values():
+            caching_adapter.extract_invoice_data(path)
+
+    # Assert
+    assert len(caching_adapter.client.caches.created) == 1
+    assert load.call_count == 1
+    prefix = caching_adapter.client.caches.configs[0].system_instruction
+    assert prefix.startswith("Extract invoices carefully.")
+    assert "- JEDZENIE" in prefix and '"invoice_number"' in prefix
+    for call in caching_adapter.client.models.generate_content.call_args_list:
+        config = call.kwargs["config"]
+        assert config.cached_content == "cachedContents/1"
+        assert config.system_instruction is None
+        assert config.response_schema is not None
+
+
+def test_context_cache_failure_falls_back_to_inline_instruction(caching_adapter, pdf_files):
+    # Arrange
+    caching_adapter.client.caches = FakeCaches(fail_with=RuntimeError("Cached content is too small"))
+
+    # Act
+    result = caching_adapter.extract_invoice_data(pdf_files["raw_1"])
+    caching_adapter.extract_invoice_data(pdf_files["raw_3"])
+
+    # Assert
+    assert result["invoice_number"] == "INV/1"
+    config = caching_adapter.client.models.generate_content.call_args.kwargs["config"]
+    assert config.cached_content is None
+    assert config.system_instruction == "Extract invoices carefully."
+
+
+def test_without_context_cache_the_instruction_file_is_sent_unchanged(caching_adapter, pdf_files):
+    # Arrange
+    caching_adapter.context_cache = False
+
+    # Act
+    caching_adapter.extract_invoice_data(pdf_files["raw_1"])
+
+    # Assert
+    config = caching_adapter.client.models.generate_content.call_args.kwargs["config"]
+    assert config.system_instruction == "Extract invoices carefully."
+    assert config.cached_content is None
+    assert caching_adapter._instruction is None
+    caching_adapter.client.models.count_tokens.assert_not_called()
+
+
+def test_expired_context_cache_retries_inline(caching_adapter, pdf_files):
+    # Arrange
+    ok = Mock(text=json.dumps(extraction("INV/1")))
+    gone = errors.ClientError(404, {"error": {"code": 404, "message": "CachedContent not found", "status": "NOT_FOUND"}})
+    caching_adapter.client.models.generate_content.side_effect = [gone, ok]
+
+    # Act
+    result = caching_adapter.extract_invoice_data(pdf_files["raw_1"])
+
+    # Assert
+    assert result["invoice_number"] == "INV/1"
+    calls = caching_adapter.client.models.generate_content.call_args_list
+    assert calls[0].kwargs["config"].cached_content == "cachedContents/1"
+    assert calls[1].kwargs["config"].cached_content is None
+    assert caching_adapter._cached_contents == {}
+
+
+def test_other_errors_mentioning_cache_are_not_retried(caching_adapter, pdf_files):
+    # Arrange
+    caching_adapter.client.models.generate_content.side_effect = RuntimeError("cache miss in upstream proxy")
+
+    # Act / Assert
+    with pytest.raises(RuntimeError):
+        caching_adapter.extract_invoice_data(pdf_files["raw_1"])
+    assert caching_adapter.client.models.generate_content.call_count == 1
+
+
+def test_prefix_below_minimum_cacheable_size_is_not_submitted(caching_adapter, pdf_files):
+    # Arrange
+    caching_adapter.client.models.count_tokens.return_value = Mock(total_tokens=700)
+
+    # Act
+    caching_adapter.extract_invoice_data(pdf_files["raw_1"])
+    caching_adapter.extract_invoice_data(pdf_files["raw_3"])
+
+    # Assert
+    assert caching_adapter.client.caches.created == []
+    caching_adapter.client.models.count_tokens.assert_called_once()
+    config = caching_adapter.client.models.generate_content.call_args.kwargs["config"]
+    assert config.cached_content is None
+    assert config.system_instruction == "Extract invoices carefully."
+
+
+def test_real_sized_prefix_clears_the_minimum(caching_adapter, pdf_files, tmp_path):
+    """A production-sized prompt (instruction with per-category guidance) is cached as a whole."""
+    # Arrange
+    guidance = "\n".join(
+        f"- {category}: typical vendors, line items and VAT rates that identify this category on Polish invoices."
+        for category in settings.load_categories()
+    ) * 6
+    instruction = tmp_path / "instruction.md"
+    instruction.write_text(f"{Path(settings.instruction_file).read_text(encoding='utf-8')}\n{guidance}", encoding="utf-8")
+    # Roughly four characters per token, as the API counts for Polish/English prompts
+    caching_adapter.client.models.count_tokens.side_effect = lambda model, contents: Mock(total_tokens=len(contents) // 4)
+
+    # Act
+    with patch('src.infrastructure.gemini_adapter.settings.instruction_file', str(instruction)):
+        caching_adapter.extract_invoice_data(pdf_files["raw_1"])
+
+    # Assert
+    prefix = caching_adapter.client.caches.configs[0].system_instruction
+    assert len(prefix) // 4 >= settings.gemini_context_cache_min_tokens
+    assert "## Allowed categories" in prefix and "## Output schema" in prefix
+    config = caching_adapter.client.models.generate_content.call_args.kwargs["config"]
+    assert config.cached_content == "cachedContents/1" and config.system_instruction is None
+
+
+class FakePackedModels:
+    """
+    Local stand-in for `client.models` answering packed requests.
+
+    Each call adds `base_latency` plus `per_document_latency` for every PDF to
+    `simulated_seconds`, mimicking fixed per-request overhead without sleeping.
+    With `drop_last` the model "forgets" the last document of a pack; documents
+    listed in `implausible` (1-based) come back without a gross amount.
+    """
+
+    def __init__(self, base_latency=0.0, per_document_latency=0.0, drop_last=False, reverse=False, implausible=()):
+        self.base_latency = base_latency
+        self.per_document_latency = per_document_latency
+        self.drop_last = drop_last
+        self.reverse = reverse
+        self.implausible = implausible
+        self.calls = []
+        self.simulated_seconds = 0.0
+
+    def generate_content(self, model, contents, config):
+        documents = [part for part in contents if isinstance(part, types.Part) and part.inline_data]
+        self.calls.append(len(documents))
+        self.simulated_seconds += self.base_latency + self.per_document_latency * len(documents)
+        if config.response_schema is InvoiceExtraction:
+            return Mock(text=json.dumps(extraction("INV/single")))
+
+        entries = [{**extraction(f"INV/{i}"), "document_index": i} for i in range(1, len(documents) + 1)]
+        for i in self.implausible:
+            entries[i - 1]["gross_amount"] = 0.0
+        if self.drop_last:
+            entries = entries[:-1]
+        if self.reverse:
+            entries.reverse()
+        return Mock(text=json.dumps(entries))
+
+
+def packing_adapter(pack_size, models):
+    with patch('src.infrastructure.gemini_adapter.genai.Client'):
+        adapter = GeminiAdapter(api_key="fake-key", model="gemini-test", pack_size=pack_size)
+    adapter.client = Mock()
+    adapter.client.models = models
+    return adapter
+
+
+def test_packed_extraction_maps_entries_by_document_index(pdf_files):
+    # Arrange
+    models = FakePackedModels(reverse=True)
+    adapter = packing_adapter(3, models)
+
+    # Act
+    results = adapter.extract_invoice_data_batch(pdf_files)
+
+    # Assert
+    assert models.calls == [3]
+    assert [results[key]["invoice_number"] for key in pdf_files] == ["INV/1", "INV/2", "INV/3"]
+    assert "document_index" not in results["raw_1"]
+
+
+def test_packed_extraction_falls_back_to_single_requests_on_count_mismatch(pdf_files):
+    # Arrange
+    models = FakePackedModels(drop_last=True)
+    adapter = packing_adapter(3, models)
+
+    # Act
+    results = adapter.extract_invoice_data_batch(pdf_files)
+
+    # Assert
+    assert models.calls == [3, 1, 1, 1]
+    assert all(result["invoice_number"] == "INV/single" for result in results.values())
+
+
+def test_packed_extraction_throughput_by_pack_size(tmp_path):
+    """Invoices per simulated minute at different pack sizes with fixed per-request overhead."""
+    # Arrange
+    files = {}
+    for i in range(12):
+        pdf = tmp_path / f"invoice_{i}.pdf"
+        pdf.write_bytes(b"%PDF-1.4 fake invoice")
+        files[f"raw_{i}"] = str(pdf)
+
+    items = list(files.items())
+    throughput = {}
+    requests = {}
+    for pack_size in (1, 2, 4):
+        models = FakePackedModels(base_latency=0.02, per_document_latency=0.002)
+        adapter = packing_adapter(pack_size, models)
+
+        # Act
+        results = {}
+        for i in range(0, len(items), pack_size):
+            results.update(adapter.extract_invoice_data_packed(dict(items[i:i + pack_size])))
+
+        assert len(results) == len(files)
+        requests[pack_size] = len(models.calls)
+        throughput[pack_size] = len(files) / models.simulated_seconds * 60
+
+    # Assert
+    assert requests == {1: 12, 2: 6, 4: 3}
+    assert throughput[2] > throughput[1] * 1.5
+    assert throughput[4] > throughput[1] * 2.5
+
+
+class FakePreprocessor:
+    """Pretends to drop the last page of every PDF."""
+
+    def prepare(self, data):
+        return PreparedPdf(data=b"%PDF-1.4 reduced", original_pages=2, kept_pages=1, original_bytes=len(data))
+
+
+def test_implausible_result_from_reduced_pdf_retries_with_full_document(pdf_files):
+    # Arrange
+    with patch('src.infrastructure.gemini_adapter.genai.Client'):
+        adapter = GeminiAdapter(api_key="fake-key", model="gemini-test", preprocessor=FakePreprocessor())
+    adapter.client = Mock()
+    missing_totals = {**extraction("INV/1"), "gross_amount": 0.0}
+    adapter.client.models.generate_content.side_effect = [
+        Mock(text=json.dumps(missing_totals)),
+        Mock(text=json.dumps(extraction("INV/1")))
+    ]
+
+    # Act
+    result = adapter.extract_invoice_data(pdf_files["raw_1"])
+
+    # Assert
+    assert result["gross_amount"] == 123.0
+    sent = [call.kwargs["contents"][0].inline_data.data for call in adapter.client.models.generate_content.call_args_list]
+    assert sent == [b"%PDF-1.4 reduced", b"%PDF-1.4 fake invoice"]
+
+
+def test_plausible_result_from_reduced_pdf_is_kept(pdf_files):
+    # Arrange
+    with patch('src.infrastructure.gemini_adapter.genai.Client'):
+        adapter = GeminiAdapter(api_key="fake-key", model="gemini-test", preprocessor=FakePreprocessor())
+    adapter.client = Mock()
+    adapter.client.models.generate_content.return_value = Mock(text=json.dumps(extraction("INV/1")))
+
+    # Act
+    adapter.extract_invoice_data(pdf_files["raw_1"])
+
+    # Assert
+    adapter.client.models.generate_content.assert_called_once()
+
+
+def test_implausible_packed_entry_from_reduced_pdf_retries_with_full_document(pdf_files):
+    # Arrange
+    models = FakePackedModels(implausible=(2,))
+    with patch('src.infrastructure.gemini_adapter.genai.Client'):
+        adapter = GeminiAdapter(api_key="fake-key", model="gemini-test", pack_size=3, preprocessor=FakePreprocessor())
+    adapter.client = Mock()
+    adapter.client.models = models
+
+    # Act
+    results = adapter.extract_invoice_data_batch(pdf_files)
+
+    # Assert
+    assert models.calls == [3, 1]
+    assert results["raw_broken"]["invoice_number"] == "INV/single"
+    assert results["raw_1"]["invoice_number"] == "INV/1" and results["raw_3"]["invoice_number"] == "INV/3"
+
+
+def test_implausible_batch_item_from_reduced_pdf_retries_with_full_document(adapter_with_fake_batches, tmp_path):
+    # Arrange
+    files = {}
+    for key in ["raw_1", "raw_2"]:
+        pdf = tmp_path / f"{key}.pdf"
+        pdf.write_bytes(b"%PDF-1.4 fake invoice")
+        files[key] = str(pdf)
+    adapter_with_fake_batches.preprocessor = FakePreprocessor()
+    adapter_with_fake_batches.client.batches = FakeBatches(implausible=("raw_2",))
+    adapter_with_fake_batches.client.models.generate_content.return_value = Mock(text=json.dumps(extraction("INV/raw_2")))
+
+    # Act
+    results = adapter_with_fake_batches.extract_invoice_data_batch(files)
+
+    # Assert
+    assert results["raw_2"]["gross_amount"] == 123.0
+    assert results["raw_1"]["invoice_number"] == "INV/raw_1"
+    retried = adapter_with_fake_batches.client.models.generate_content.call_args
+    assert retried.kwargs["contents"][0].inline_data.data == b"%PDF-1.4 fake invoice"
+    adapter_with_fake_batches.client.models.generate_content.assert_called_once()
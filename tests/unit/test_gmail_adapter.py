@@ -1,10 +1,13 @@
 """Unit tests for GmailAdapter."""
+import threading
+import time
 import pytest
 from unittest.mock import Mock, patch, MagicMock
 from datetime import datetime
 from googleapiclient.errors import HttpError
 from src.infrastructure.gmail_adapter import GmailAdapter
 from src.domain.entities import Email
+from src.infrastructure.storage import LocalFileStorage
 
 
 @pytest.fixture
@@ -14,13 +17,14 @@ def mock_gmail_service():
 
 
 @pytest.fixture
-def gmail_adapter_with_mock_service(mock_gmail_service):
-    """Gmail adapter with mocked service."""
+def gmail_adapter_with_mock_service(mock_gmail_service, tmp_path):
+    """Gmail adapter with mocked service, saving attachments under tmp_path."""
     with patch('src.infrastructure.gmail_adapter.build', return_value=mock_gmail_service):
         with patch('src.infrastructure.gmail_adapter.Credentials'):
             with patch('os.path.exists', return_value=True):
                 adapter = GmailAdapter(credentials_path="fake_creds.json")
                 adapter.service = mock_gmail_service
+                adapter.storage = LocalFileStorage(base_dir=str(tmp_path))
                 return adapter
 
 
@@ -108,7 +112,7 @@ def test_email_with_multiple_attachments_including_pdf(gmail_adapter_with_mock_s
     assert len(emails) == 1
     assert emails[0].id == 'msg1'
     assert emails[0].subject == 'Invoice'
-    assert 'invoice.pdf' in emails[0].attachment_path
+    assert emails[0].attachment_filename == 'invoice.pdf'
 
 
 def test_gmail_api_error(gmail_adapter_with_mock_service, mock_gmail_service):
@@ -139,3 +143,255 @@ def test_mark_as_processed_success(gmail_adapter_with_mock_service, mock_gmail_s
     call_args = mock_gmail_service.users().messages().modify.call_args
     assert call_args[1]['id'] == email_id
     assert 'UNREAD' in call_args[1]['body']['removeLabelIds']
+
+
+def test_mark_many_as_processed_chunks_batch_modify(gmail_adapter_with_mock_service, mock_gmail_service):
+    """Test that bulk marking uses batchModify with at most 1000 IDs per call."""
+    # Arrange
+    email_ids = [f"msg{i}" for i in range(2500)]
+    mock_gmail_service.users().messages().batchModify.reset_mock()
+
+    # Act
+    gmail_adapter_with_mock_service.mark_many_as_processed(email_ids)
+
+    # Assert
+    calls = mock_gmail_service.users().messages().batchModify.call_args_list
+    assert [len(c[1]['body']['ids']) for c in calls] == [1000, 1000, 500]
+    assert calls[2][1]['body'] == {'ids': email_ids[2000:], 'removeLabelIds': ['UNREAD']}
+    mock_gmail_service.users().messages().modify.assert_not_called()
+
+
+class FakeBatch:
+    """Stand-in for googleapiclient's BatchHttpRequest answering from a mapping keyed by request_id."""
+
+    def __init__(self, responses, callback):
+        self.responses = responses
+        self.callback = callback
+        self.request_ids = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.request_ids.append(request_id)
+
+    def execute(self):
+        for request_id in self.request_ids:
+            self.callback(request_id, self.responses[request_id], None)
+
+
+def _invoice_message(msg_id):
+    return {
+        'payload': {
+            'headers': [
+                {'name': 'Subject', 'value': f'Invoice {msg_id}'},
+                {'name': 'From', 'value': 'vendor@example.com'},
+                {'name': 'Date', 'value': 'Mon, 1 Jan 2024 10:00:00'}
+            ],
+            'parts': [{'filename': f'{msg_id}.pdf', 'body': {'attachmentId': f'att_{msg_id}', 'size': 10}}]
+        },
+        'snippet': 'Invoice attached'
+    }
+
+
+def _setup_mailbox(mock_gmail_service, msg_ids):
+    mock_gmail_service.users().messages().list().execute.return_value = {
+        'messages': [{'id': msg_id} for msg_id in msg_ids]
+    }
+    messages = {msg_id: _invoice_message(msg_id) for msg_id in msg_ids}
+    attachments = {msg_id: {'data': 'ZmFrZSBwZGYgZGF0YQ=='} for msg_id in msg_ids}
+    mock_gmail_service.users().messages().get().execute.side_effect = lambda: messages[
+        mock_gmail_service.users().messages().get.call_args[1]['id']
+    ]
+    mock_gmail_service.users().messages().attachments().get().execute.return_value = attachments[msg_ids[0]]
+
+    # Within a run each message is batched twice: first its metadata, then its attachment.
+    fetched = set()
+
+    class Responses(dict):
+        def __getitem__(self, msg_id):
+            if msg_id in fetched:
+                return attachments[msg_id]
+            fetched.add(msg_id)
+            return messages[msg_id]
+
+    mock_gmail_service.new_batch_http_request.side_effect = lambda callback: FakeBatch(Responses(), callback)
+
+
+def test_batched_fetch_returns_same_emails(gmail_adapter_with_mock_service, mock_gmail_service, tmp_path):
+    """Test that batch mode returns the same emails, in order, as the per-message path."""
+    # Arrange
+    msg_ids = [f'msg{i}' for i in range(7)]
+    _setup_mailbox(mock_gmail_service, msg_ids)
+    gmail_adapter_with_mock_service.storage = LocalFileStorage(base_dir=str(tmp_path))
+    gmail_adapter_with_mock_service.batch_size = 3
+
+    # Act
+    emails = gmail_adapter_with_mock_service.fetch_unread_emails_with_attachments()
+
+    # Assert
+    assert [e.id for e in emails] == msg_ids
+    assert emails[2].subject == 'Invoice msg2'
+    assert emails[2].attachment_filename == 'msg2.pdf'
+    assert emails[2].content_hash is not None
+
+
+def test_batched_fetch_reduces_round_trips(gmail_adapter_with_mock_service, mock_gmail_service, tmp_path):
+    """Benchmark: round trips per run for 40 messages, sequential vs. batches of 20."""
+    # Arrange
+    msg_ids = [f'msg{i}' for i in range(40)]
+    _setup_mailbox(mock_gmail_service, msg_ids)
+    adapter = gmail_adapter_with_mock_service
+    adapter.storage = LocalFileStorage(base_dir=str(tmp_path))
+
+    # Act
+    adapter.batch_size = 0
+    sequential = adapter.fetch_unread_emails_with_attachments()
+    sequential_round_trips = adapter.round_trips
+
+    adapter.batch_size = 20
+    batched = adapter.fetch_unread_emails_with_attachments()
+    batched_round_trips = adapter.round_trips
+
+    # Assert
+    assert len(sequential) == len(batched) == 40
+    assert sequential_round_trips == 2 + 40 + 40  # profile + list, then get + attachment per message
+    assert batched_round_trips == 2 + 2 + 2  # profile + list, 2 message batches, 2 attachment batches
+
+
+def test_fetch_follows_next_page_token(gmail_adapter_with_mock_service, mock_gmail_service, tmp_path):
+    """Test that every page of messages.list results is read."""
+    # Arrange
+    _setup_mailbox(mock_gmail_service, ['msg1', 'msg2'])
+    mock_gmail_service.users().messages().list().execute.side_effect = [
+        {'messages': [{'id': 'msg1'}], 'nextPageToken': 'page2'},
+        {'messages': [{'id': 'msg2'}]}
+    ]
+    gmail_adapter_with_mock_service.storage = LocalFileStorage(base_dir=str(tmp_path))
+
+    # Act
+    emails = list(gmail_adapter_with_mock_service.iter_unread_emails_with_attachments())
+
+    # Assert
+    assert [e.id for e in emails] == ['msg1', 'msg2']
+    mock_gmail_service.users().messages().list.assert_called_with(
+        userId='me', q='is:unread has:attachment', pageToken='page2'
+    )
+
+
+def test_incremental_fetch_reads_history_since_checkpoint(gmail_adapter_with_mock_service, mock_gmail_service, tmp_path):
+    """Test that a checkpoint switches from the full search to users.history.list."""
+    # Arrange
+    _setup_mailbox(mock_gmail_service, ['msg1', 'msg2'])
+    mock_gmail_service.users().getProfile().execute.return_value = {'historyId': '200'}
+    mock_gmail_service.users().history().list().execute.return_value = {
+        'history': [
+            {'messagesAdded': [{'message': {'id': 'msg1'}}]},
+            {'messagesAdded': [{'message': {'id': 'msg2'}}, {'message': {'id': 'msg1'}}]}
+        ]
+    }
+    mock_gmail_service.users().messages().list.reset_mock()
+    adapter = gmail_adapter_with_mock_service
+    adapter.storage = LocalFileStorage(base_dir=str(tmp_path))
+
+    # Act
+    emails = list(adapter.iter_unread_emails_with_attachments(since_checkpoint='100'))
+
+    # Assert
+    assert [e.id for e in emails] == ['msg1', 'msg2']
+    mock_gmail_service.users().history().list.assert_called_with(
+        userId='me', startHistoryId='100', historyTypes=['messageAdded'], labelId='UNREAD'
+    )
+    mock_gmail_service.users().messages().list.assert_not_called()
+    assert adapter.get_sync_checkpoint() == '200'
+
+
+def test_incremental_fetch_falls_back_to_full_search_on_expired_checkpoint(gmail_adapter_with_mock_service, mock_gmail_service, tmp_path):
+    """Test that a 404 from users.history.list triggers the full unread search."""
+    # Arrange
+    _setup_mailbox(mock_gmail_service, ['msg1'])
+    mock_gmail_service.users().getProfile().execute.return_value = {'historyId': '200'}
+    mock_gmail_service.users().history().list().execute.side_effect = HttpError(
+        resp=Mock(status=404),
+        content=b'Requested entity was not found.'
+    )
+    gmail_adapter_with_mock_service.storage = LocalFileStorage(base_dir=str(tmp_path))
+
+    # Act
+    emails = list(gmail_adapter_with_mock_service.iter_unread_emails_with_attachments(since_checkpoint='1'))
+
+    # Assert
+    assert [e.id for e in emails] == ['msg1']
+    assert gmail_adapter_with_mock_service.get_sync_checkpoint() == '200'
+
+
+class SlowStorage:
+    """Records the adapter's in-flight attachment bytes during each upload."""
+
+    def __init__(self, adapter):
+        self.adapter = adapter
+        self.max_in_flight = 0
+        self.saved = []
+        self._lock = threading.Lock()
+
+    def save_file(self, filename, content):
+        with self._lock:
+            self.max_in_flight = max(self.max_in_flight, self.adapter._byte_budget.in_flight)
+        time.sleep(0.02)
+        with self._lock:
+            self.saved.append(filename)
+        return f"/tmp/{filename}"
+
+    def save_content_addressed(self, filename, content):
+        return self.save_file(filename, content), "digest"
+
+
+def test_pooled_download_respects_inflight_byte_cap(gmail_adapter_with_mock_service, mock_gmail_service):
+    """Test that the download pool stores every attachment while keeping in-flight bytes under the cap."""
+    # Arrange
+    msg_ids = [f'msg{i}' for i in range(6)]
+    _setup_mailbox(mock_gmail_service, msg_ids)
+    adapter = gmail_adapter_with_mock_service
+    adapter.download_workers = 4
+    adapter._byte_budget.limit = 25  # attachments are 10 bytes each, so at most 2 in flight
+    adapter.storage = SlowStorage(adapter)
+
+    # Act
+    emails = adapter.fetch_unread_emails_with_attachments()
+
+    # Assert
+    assert sorted(e.id for e in emails) == msg_ids
+    assert len(adapter.storage.saved) == 6
+    assert 0 < adapter.storage.max_in_flight <= 20
+    assert adapter._byte_budget.in_flight == 0
+    assert set(adapter.stage_timings) == {'metadata', 'download', 'upload', 'throttle'}
+    assert adapter.stage_timings['upload'] > 0
+
+
+def test_message_fetch_uses_field_mask_and_counts_bytes(gmail_adapter_with_mock_service, mock_gmail_service, tmp_path):
+    """Test that messages are fetched with a partial-response mask and a PDF nested in a multipart is found."""
+    # Arrange
+    mock_gmail_service.users().messages().list().execute.return_value = {'messages': [{'id': 'msg1'}]}
+    mock_gmail_service.users().messages().get().execute.return_value = {
+        'payload': {
+            'headers': [{'name': 'Subject', 'value': 'Fwd: Invoice'}],
+            'parts': [
+                {'mimeType': 'multipart/alternative', 'body': {'size': 0}, 'parts': [{'mimeType': 'text/plain', 'body': {'size': 12}}]},
+                {'mimeType': 'multipart/mixed', 'body': {'size': 0}, 'parts': [
+                    {'filename': 'invoice.pdf', 'body': {'attachmentId': 'att1', 'size': 13}}
+                ]}
+            ]
+        }
+    }
+    mock_gmail_service.users().messages().attachments().get().execute.return_value = {'data': 'ZmFrZSBwZGYgZGF0YQ=='}
+    adapter = gmail_adapter_with_mock_service
+    adapter.storage = LocalFileStorage(base_dir=str(tmp_path))
+
+    # Act
+    emails = adapter.fetch_unread_emails_with_attachments()
+
+    # Assert
+    assert len(emails) == 1 and emails[0].subject == 'Fwd: Invoice'
+    get_kwargs = mock_gmail_service.users().messages().get.call_args[1]
+    assert get_kwargs['format'] == 'full'
+    assert 'body(attachmentId,size)' in get_kwargs['fields']
+    assert 'data' not in get_kwargs['fields']
+    mock_gmail_service.users().messages().attachments().get.assert_called_with(userId='me', messageId='msg1', id='att1')
+    assert adapter.response_bytes > 0
@@ -0,0 +1,147 @@
+"""Unit tests for projection row queries (RawInvoiceRow, ProcessedInvoiceRow) and paged reads."""
+from datetime import datetime
+from unittest.mock import Mock
+from src.domain.entities import RawInvoice, RawInvoiceRow, ProcessedInvoiceRow, Email, ProcessingStatus
+from src.infrastructure.json_repository import JsonInvoiceRepository
+from src.services.processing_service import ProcessingService
+
+
+def stored_raw_invoice(content=None):
+    return {
+        "id": "raw_1",
+        "email_id": "email_1",
+        "email_data": {
+            "id": "email_1", "sender": "vendor@example.com", "subject": "Invoice",
+            "date": datetime(2025, 3, 7), "attachment_path": "/tmp/raw_1.pdf",
+            **({"content": content} if content else {})
+        },
+        "status": "PENDING",
+        "created_at": datetime(2025, 3, 7),
+        "updated_at": datetime(2025, 3, 7)
+    }
+
+
+def make_adapter():
+    from src.infrastructure.firestore_adapter import FirestoreAdapter
+    adapter = FirestoreAdapter(project_id="")
+    adapter.client = Mock()
+    return adapter
+
+
+def test_firestore_raw_rows_skip_the_email_body_until_loaded():
+    # Arrange
+    adapter = make_adapter()
+    collection_ref = adapter.client.collection.return_value
+    projection = collection_ref.where.return_value.select.return_value
+    projection.stream.return_value = [Mock(to_dict=Mock(return_value=stored_raw_invoice()))]
+    full_doc = collection_ref.document.return_value.get.return_value
+    full_doc.to_dict.return_value = stored_raw_invoice(content="Long email body")
+
+    # Act
+    rows = adapter.get_pending_raw_invoice_rows([ProcessingStatus.PENDING])
+    first, second = rows[0].load(), rows[0].load()
+
+    # Assert
+    fields = collection_ref.where.return_value.select.call_args.args[0]
+    assert "email_data.attachment_path" in fields and "email_data.content" not in fields
+    assert isinstance(rows[0], RawInvoiceRow) and rows[0].email_data.content is None
+    assert type(first) is RawInvoice and first.email_data.content == "Long email body"
+    assert first is second
+    collection_ref.document.assert_called_once_with("raw_1")
+
+
+def test_firestore_processed_rows_leave_out_line_items():
+    # Arrange
+    adapter = make_adapter()
+    collection_ref = adapter.client.collection.return_value
+    collection_ref.where.return_value.select.return_value.stream.return_value = [Mock(to_dict=Mock(return_value={
+        "id": "proc_1", "raw_invoice_id": "raw_1", "sync_status": "NOT_SYNCED",
+        "created_at": datetime(2025, 3, 7), "updated_at": datetime(2025, 3, 7),
+        "extracted_data": {
+            "invoice_date": datetime(2025, 3, 7), "category": "JEDZENIE", "vendor_name": "Bukat",
+            "net_amount": 100.0, "gross_amount": 123.0, "invoice_number": "FV/1", "due_date": datetime(2025, 3, 21)
+        }
+    }))]
+
+    # Act
+    rows = adapter.get_unsynced_processed_invoice_rows()
+
+    # Assert
+    fields = collection_ref.where.return_value.select.call_args.args[0]
+    assert not any(field.startswith("extracted_data.items") for field in fields)
+    assert isinstance(rows[0], ProcessedInvoiceRow)
+    assert rows[0].extracted_data.gross_amount == 123.0 and rows[0].extracted_data.items is None
+
+
+def test_json_rows_are_complete(tmp_path):
+    # Arrange
+    repo = JsonInvoiceRepository(data_dir=str(tmp_path))
+    stored = stored_raw_invoice(content="Body")
+    repo.save_raw_invoice(RawInvoice(
+        id=stored["id"],
+        email_id=stored["email_id"],
+        email_data=Email(**stored["email_data"]),
+        status=ProcessingStatus.PENDING,
+        created_at=stored["created_at"],
+        updated_at=stored["updated_at"]
+    ))
+
+    # Act
+    rows = repo.get_pending_raw_invoice_rows()
+
+    # Assert
+    assert rows[0].email_data.content == "Body"
+    assert rows[0].load() is rows[0]
+
+
+def test_firestore_pages_follow_the_last_document():
+    # Arrange
+    adapter = make_adapter()
+    docs = []
+    for i in range(5):
+        data = stored_raw_invoice()
+        data["id"] = f"raw_{i}"
+        docs.append(Mock(to_dict=Mock(return_value=data)))
+    query = adapter.client.collection.return_value.where.return_value.select.return_value.order_by.return_value.limit.return_value
+    query.stream.return_value = docs[:2]
+    pages = {docs[1]: docs[2:4], docs[3]: docs[4:]}
+    query.start_after.side_effect = lambda cursor: Mock(stream=Mock(return_value=pages[cursor]))
+
+    # Act
+    rows = adapter.iter_pending_raw_invoice_rows(page_size=2)
+    first = next(rows)
+
+    # Assert
+    query.start_after.assert_not_called()
+    assert [first.id] + [row.id for row in rows] == [f"raw_{i}" for i in range(5)]
+    assert [call.args[0] for call in query.start_after.call_args_list] == [docs[1], docs[3]]
+
+
+def test_processing_starts_before_the_backlog_is_read():
+    # Arrange
+    repo = Mock()
+    repo.get_invoice_keys.return_value = []
+    repo.content_hash_processed.return_value = False
+    reads = []
+
+    def pages(statuses, shard, page_size):
+        for i in range(3):
+            reads.append(i)
+            row = Mock(id=f"raw_{i}")
+            row.email_data.attachment_path = f"/tmp/raw_{i}.pdf"
+            row.email_data.content_hash = None
+            yield row
+
+    repo.iter_pending_raw_invoice_rows.side_effect = pages
+    llm = Mock()
+    llm.extract_invoice_data.side_effect = lambda path: reads.append(path) or {
+        "invoice_date": "2023-01-01", "category": "JEDZENIE", "vendor": "Vendor",
+        "net_amount": 100.0, "gross_amount": 123.0, "invoice_number": path, "payment_date": "2023-01-14"
+    }
+
+    # Act
+    stats = ProcessingService(repo, llm, page_size=1).run()
+
+    # Assert
+    assert stats['success'] == 3
+    assert reads == [0, "/tmp/raw_0.pdf", 1, "/tmp/raw_1.pdf", 2, "/tmp/raw_2.pdf"]
@@ -0,0 +1,164 @@
+"""Unit tests for JsonInvoiceRepository."""
+import threading
+import pytest
+from unittest.mock import Mock
+from datetime import datetime, timedelta, timezone
+from src.domain.entities import RawInvoice, Email, ProcessingStatus
+from src.infrastructure.json_repository import JsonInvoiceRepository
+from src.services.processing_service import ProcessingService
+
+
+@pytest.fixture
+def repo(tmp_path):
+    return JsonInvoiceRepository(data_dir=str(tmp_path))
+
+
+def add_raw_invoices(repo, count, status=ProcessingStatus.PENDING):
+    for index in range(count):
+        repo.save_raw_invoice(RawInvoice(
+            id=f"raw_{index}",
+            email_id=f"email_{index}",
+            email_data=Email(
+                id=f"email_{index}",
+                sender="vendor@example.com",
+                subject="Invoice",
+                date=datetime.now(),
+                attachment_path=f"/tmp/invoice_{index}.pdf"
+            ),
+            status=status,
+            created_at=datetime.now(timezone.utc) - timedelta(hours=1),
+            updated_at=datetime.now(timezone.utc) - timedelta(hours=1)
+        ))
+
+
+def test_concurrent_claims_never_overlap(repo):
+    # Arrange
+    add_raw_invoices(repo, 20)
+    claimed = {}
+
+    def worker(owner):
+        claimed[owner] = []
+        while batch := repo.claim_raw_invoices(owner, limit=3, lease_seconds=60):
+            claimed[owner].extend(invoice.id for invoice in batch)
+
+    threads = [threading.Thread(target=worker, args=(f"task{i}",)) for i in range(4)]
+
+    # Act
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Assert
+    all_claimed = [invoice_id for ids in claimed.values() for invoice_id in ids]
+    assert sorted(all_claimed) == sorted(f"raw_{i}" for i in range(20))
+
+
+def test_claimed_invoice_is_in_progress_until_its_status_is_set(repo):
+    # Arrange
+    add_raw_invoices(repo, 1)
+
+    # Act
+    [invoice] = repo.claim_raw_invoices("task0", limit=5, lease_seconds=60)
+    second_claim = repo.claim_raw_invoices("task1", limit=5, lease_seconds=60)
+    repo.update_raw_invoice_status(invoice.id, ProcessingStatus.RETRY.value, "429")
+    stored = repo._load_json(repo.raw_invoices_file)[0]
+
+    # Assert
+    assert invoice.status == ProcessingStatus.IN_PROGRESS
+    assert second_claim == []
+    assert stored['status'] == ProcessingStatus.RETRY.value
+    assert 'lease_owner' not in stored
+
+
+def test_expired_lease_is_claimed_again(repo):
+    # Arrange
+    add_raw_invoices(repo, 1)
+    repo.claim_raw_invoices("crashed_task", limit=5, lease_seconds=-1)
+
+    # Act
+    reclaimed = repo.claim_raw_invoices("task1", limit=5, lease_seconds=60)
+
+    # Assert
+    assert [invoice.id for invoice in reclaimed] == ["raw_0"]
+    assert repo._load_json(repo.raw_invoices_file)[0]['lease_owner'] == "task1"
+
+
+def test_worker_that_lost_its_lease_cannot_commit(repo):
+    # Arrange
+    add_raw_invoices(repo, 1)
+    claimed = repo.claim_raw_invoices("slow_task", limit=5, lease_seconds=-1)
+    repo.claim_raw_invoices("task1", limit=5, lease_seconds=60)
+    llm_provider = Mock()
+    llm_provider.extract_invoice_data.return_value = {
+        "invoice_date": "2023-01-01", "category": "JEDZENIE", "vendor": "Vendor",
+        "net_amount": 100.0, "gross_amount": 123.0, "invoice_number": "INV/1", "payment_date": "2023-01-14"
+    }
+    slow = ProcessingService(repo, llm_provider, claim_size=5, worker_id="slow_task")
+
+    # Act
+    stats = slow.run(raw_invoices=claimed)
+    stored = repo._load_json(repo.raw_invoices_file)[0]
+
+    # Assert
+    assert stats['lease_lost'] == 1
+    assert repo._load_json(repo.processed_invoices_file) == []
+    assert (stored['status'], stored['lease_owner']) == (ProcessingStatus.IN_PROGRESS.value, "task1")
+
+
+def test_status_writes_of_a_lost_lease_are_skipped(repo):
+    # Arrange
+    add_raw_invoices(repo, 2)
+    claimed = repo.claim_raw_invoices("slow_task", limit=5, lease_seconds=-1)
+    repo.claim_raw_invoices("task1", limit=5, lease_seconds=60)
+    llm_provider = Mock()
+    llm_provider.extract_invoice_data.side_effect = ValueError("Unreadable PDF")
+    slow = ProcessingService(repo, llm_provider, claim_size=5, worker_id="slow_task")
+    buffered = ProcessingService(repo, llm_provider, claim_size=5, worker_id="slow_task", write_batch_size=10)
+
+    # Act
+    slow.run(raw_invoices=claimed[:1])
+    stats = buffered.run(raw_invoices=claimed[1:])
+    stored = repo._load_json(repo.raw_invoices_file)
+
+    # Assert
+    assert [(item['status'], item['lease_owner']) for item in stored] == [(ProcessingStatus.IN_PROGRESS.value, "task1")] * 2
+    assert (stats['write_failures'], stats['lease_lost']) == (0, 1)
+
+
+def test_invoices_updated_after_the_cutoff_are_not_claimed(repo):
+    # Arrange
+    add_raw_invoices(repo, 2, status=ProcessingStatus.RETRY)
+    cutoff = datetime.now(timezone.utc)
+    repo.update_raw_invoice_status("raw_1", ProcessingStatus.RETRY.value)
+
+    # Act
+    claimed = repo.claim_raw_invoices("task0", limit=5, lease_seconds=60, updated_before=cutoff)
+
+    # Assert
+    assert [invoice.id for invoice in claimed] == ["raw_0"]
+
+
+def test_crash_after_extraction_does_not_extract_again(repo):
+    # Arrange
+    add_raw_invoices(repo, 1)
+    llm = Mock()
+    llm.extract_invoice_data.return_value = {
+        "invoice_date": "2023-01-01", "category": "JEDZENIE", "vendor": "Vendor",
+        "net_amount": 100.0, "gross_amount": 123.0, "invoice_number": "FV/1/2023", "payment_date": "2023-01-14"
+    }
+
+    def crash(_processed):
+        raise KeyboardInterrupt("worker killed")
+
+    with pytest.raises(KeyboardInterrupt):
+        ProcessingService(repo, llm).run(on_processed=crash)
+
+    # Act
+    stats = ProcessingService(repo, llm).run()
+
+    # Assert
+    assert llm.extract_invoice_data.call_count == 1
+    assert stats['total'] == 0
+    assert len(repo._load_json(repo.processed_invoices_file)) == 1
+    assert repo._load_json(repo.raw_invoices_file)[0]['status'] == ProcessingStatus.PROCESSED.value
@@ -0,0 +1,58 @@
+"""Unit tests for PdfPreprocessor."""
+import io
+import pytest
+from src.infrastructure.pdf_preprocessor import PdfPreprocessor, TOKENS_PER_PAGE
+
+pypdf = pytest.importorskip("pypdf")
+
+
+def test_appendix_pages_are_dropped():
+    # Arrange
+    data = open("sample_data/Faktura_bukat.pdf", "rb").read()
+
+    # Act
+    prepared = PdfPreprocessor().prepare(data)
+
+    # Assert
+    assert (prepared.original_pages, prepared.kept_pages) == (3, 2)
+    assert prepared.tokens_saved == TOKENS_PER_PAGE
+    assert prepared.bytes_saved > 0
+    text = pypdf.PdfReader(io.BytesIO(prepared.data)).pages[1].extract_text()
+    assert "DO ZAPŁATY: 851,19" in text
+
+
+def test_high_dpi_scan_is_downsampled():
+    # Arrange
+    Image = pytest.importorskip("PIL.Image")
+    buffer = io.BytesIO()
+    Image.effect_noise((2480, 3508), 50).convert("RGB").save(buffer, "PDF", resolution=300)
+
+    # Act
+    prepared = PdfPreprocessor(max_image_dpi=100).prepare(buffer.getvalue())
+
+    # Assert
+    assert prepared.kept_pages == 1
+    assert len(prepared.data) < prepared.original_bytes / 4
+    image = pypdf.PdfReader(io.BytesIO(prepared.data)).pages[0].images[0].image
+    assert image.size[0] <= 2480 / 3 + 1
+
+
+def test_small_single_page_pdf_is_returned_unchanged():
+    # Arrange
+    data = open("sample_data/faktura_euromeat.pdf", "rb").read()
+
+    # Act
+    prepared = PdfPreprocessor().prepare(data)
+
+    # Assert
+    assert prepared.data == data
+    assert not prepared.changed
+
+
+def test_unreadable_pdf_is_returned_unchanged():
+    # Act
+    prepared = PdfPreprocessor().prepare(b"not a pdf")
+
+    # Assert
+    assert prepared.data == b"not a pdf"
+    assert not prepared.changed
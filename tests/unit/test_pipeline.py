@@ -0,0 +1,163 @@
+"""Unit tests for PipelineRunner."""
+import threading
+import time
+import pytest
+from unittest.mock import Mock
+from datetime import datetime
+from src.domain.entities import Email, RawInvoice, ProcessingStatus
+from src.services.pipeline import PipelineRunner
+from src.services.processing_service import ProcessingService
+from src.services.retrieval_service import RetrievalService
+from src.services.sheets_service import SheetsService
+
+STAGE_DELAY = 0.02
+
+
+def make_email(index):
+    return Email(
+        id=f"email_{index}",
+        sender="vendor@example.com",
+        subject=f"Invoice {index}",
+        date=datetime.now(),
+        attachment_path=f"/tmp/invoice_{index}.pdf"
+    )
+
+
+def extraction(file_path):
+    time.sleep(STAGE_DELAY)
+    return {
+        "invoice_date": "2023-01-01",
+        "category": "JEDZENIE",
+        "vendor": "Test Vendor",
+        "net_amount": 80.0,
+        "gross_amount": 100.0,
+        "invoice_number": file_path,
+        "payment_date": "2023-01-14"
+    }
+
+
+@pytest.fixture
+def mock_invoice_repo():
+    repo = Mock()
+    repo.get_pending_raw_invoice_rows.return_value = []
+    repo.get_unsynced_processed_invoice_rows.return_value = []
+    repo.get_invoice_keys.return_value = []
+    return repo
+
+
+def make_runner(invoice_repo, emails, email_delay=STAGE_DELAY, queue_size=100, llm_provider=None):
+    def iter_emails(since_checkpoint=None):
+        for email in emails:
+            time.sleep(email_delay)
+            yield email
+
+    email_provider = Mock()
+    email_provider.iter_unread_emails_with_attachments.side_effect = iter_emails
+    if llm_provider is None:
+        llm_provider = Mock()
+        llm_provider.extract_invoice_data.side_effect = extraction
+    sheets_provider = Mock()
+    sheets_provider.append_invoice.side_effect = lambda invoice: time.sleep(STAGE_DELAY)
+
+    runner = PipelineRunner(
+        invoice_repo,
+        RetrievalService(email_provider, invoice_repo),
+        ProcessingService(invoice_repo, llm_provider),
+        SheetsService(invoice_repo, sheets_provider),
+        queue_size=queue_size
+    )
+    return runner, sheets_provider
+
+
+def test_pipeline_overlaps_stages(mock_invoice_repo):
+    # Arrange
+    emails = [make_email(i) for i in range(10)]
+    runner, sheets_provider = make_runner(mock_invoice_repo, emails)
+    first_export = threading.Event()
+    exported_before_last_email = []
+
+    def iter_emails(since_checkpoint=None):
+        for email in emails[:-1]:
+            yield email
+        # Sequential phases cannot export anything before retrieval has finished
+        exported_before_last_email.append(first_export.wait(timeout=5))
+        yield emails[-1]
+
+    runner.retrieval_service.email_provider.iter_unread_emails_with_attachments.side_effect = iter_emails
+    sheets_provider.append_invoice.side_effect = lambda invoice: first_export.set()
+
+    # Act
+    stats = runner.run()
+
+    # Assert
+    assert stats['retrieval'] == {'total': 10, 'success': 10}
+    assert stats['processing']['total'] == 10
+    assert stats['processing']['success'] == 10
+    assert stats['sheets'] == {'total': 10, 'success': 10, 'failed': 0}
+    exported = [call.args[0].extracted_data.invoice_number for call in sheets_provider.append_invoice.call_args_list]
+    assert exported == [f"/tmp/invoice_{i}.pdf" for i in range(10)]
+    assert exported_before_last_email == [True]
+
+
+def test_pipeline_includes_backlog_from_earlier_runs(mock_invoice_repo):
+    # Arrange
+    backlog = RawInvoice(
+        id="raw_backlog",
+        email_id="email_old",
+        email_data=make_email("old"),
+        status=ProcessingStatus.RETRY,
+        created_at=datetime.now(),
+        updated_at=datetime.now()
+    )
+    unsynced = Mock()
+    mock_invoice_repo.get_pending_raw_invoice_rows.return_value = [backlog]
+    mock_invoice_repo.get_unsynced_processed_invoice_rows.return_value = [unsynced]
+    runner, sheets_provider = make_runner(mock_invoice_repo, [make_email(1)])
+
+    # Act
+    stats = runner.run()
+
+    # Assert
+    assert stats['processing']['success'] == 2
+    assert stats['sheets']['success'] == 3
+    assert sheets_provider.append_invoice.call_args_list[0].args[0] is unsynced
+
+
+def test_full_queue_blocks_retrieval(mock_invoice_repo):
+    # Arrange
+    ingested = []
+    taken = []
+    lead = []
+    lock = threading.Lock()
+
+    def slow_extraction(file_path):
+        with lock:
+            taken.append(file_path)
+            lead.append(len(ingested) - len(taken))
+        return extraction(file_path)
+
+    llm_provider = Mock()
+    llm_provider.extract_invoice_data.side_effect = slow_extraction
+    mock_invoice_repo.save_raw_invoice.side_effect = lambda raw_invoice: ingested.append(raw_invoice.id)
+    emails = [make_email(i) for i in range(12)]
+    runner, _ = make_runner(mock_invoice_repo, emails, email_delay=0, queue_size=2, llm_provider=llm_provider)
+
+    # Act
+    stats = runner.run()
+
+    # Assert
+    assert stats['processing']['success'] == 12
+    # Queued items plus the one retrieval is blocked on handing over
+    assert max(lead) <= 2 + 1
+
+
+def test_failed_stage_does_not_block_the_others(mock_invoice_repo):
+    # Arrange
+    emails = [make_email(i) for i in range(5)]
+    runner, _ = make_runner(mock_invoice_repo, emails, email_delay=0, queue_size=1)
+    runner.sheets_service.run = Mock(side_effect=RuntimeError("Sheets down"))
+
+    # Act / Assert
+    with pytest.raises(RuntimeError, match="Sheets down"):
+        runner.run()
+    assert mock_invoice_repo.save_raw_invoice.call_count == 5
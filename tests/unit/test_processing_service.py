@@ -14,8 +14,8 @@ def mock_adk_agent():
 
 @pytest.fixture
 def processing_service(mock_invoice_repo, mock_adk_agent):
-    # Set default return value for invoice_number_exists
-    mock_invoice_repo.invoice_number_exists.return_value = False
+    # No invoices processed yet
+    mock_invoice_repo.get_invoice_keys.return_value = []
     return ProcessingService(mock_invoice_repo, mock_adk_agent)
 
 def test_processing_service_extracts_and_saves(processing_service, mock_invoice_repo, mock_adk_agent):
@@ -28,7 +28,7 @@ def test_processing_service_extracts_and_saves(processing_service, mock_invoice_
         created_at=datetime.now(),
         updated_at=datetime.now()
     )
-    mock_invoice_repo.get_pending_raw_invoices.return_value = [raw_invoice]
+    mock_invoice_repo.iter_pending_raw_invoice_rows.return_value = [raw_invoice]
     
     # Mock LLM response
     mock_adk_agent.extract_invoice_data.return_value = {
@@ -47,5 +47,5 @@ def test_processing_service_extracts_and_saves(processing_service, mock_invoice_
     # Assert
     # Since we added retry logic, we verify the underlying call
     mock_adk_agent.extract_invoice_data.assert_called_once_with("p")
-    mock_invoice_repo.save_processed_invoice.assert_called_once()
-    mock_invoice_repo.update_raw_invoice_status.assert_called_with("inv_1", "PROCESSED")
+    mock_invoice_repo.commit_processed_invoice.assert_called_once()
+    assert mock_invoice_repo.commit_processed_invoice.call_args[0][0].raw_invoice_id == "inv_1"
@@ -1,10 +1,15 @@
 """Extended unit tests for ProcessingService."""
+import threading
+import time
 import pytest
-from unittest.mock import Mock, patch
+from unittest.mock import Mock
 from datetime import datetime
-from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable
+from google.api_core.exceptions import ResourceExhausted
 from src.services.processing_service import ProcessingService
+from src.services.rate_limiter import AdaptiveLimiter
+from src.domain.duplicates import InvoiceKey
 from src.domain.entities import RawInvoice, ProcessingStatus, Email
+from src.infrastructure.json_repository import JsonInvoiceRepository
 
 
 @pytest.fixture
@@ -19,8 +24,8 @@ def mock_llm_provider():
 
 @pytest.fixture
 def processing_service(mock_invoice_repo, mock_llm_provider):
-    # Set default return value for invoice_number_exists
-    mock_invoice_repo.invoice_number_exists.return_value = False
+    # No invoices processed yet
+    mock_invoice_repo.get_invoice_keys.return_value = []
     return ProcessingService(mock_invoice_repo, mock_llm_provider)
 
 
@@ -42,11 +47,14 @@ def create_raw_invoice(invoice_id="inv_1", email_id="email_1", attachment_path="
     )
 
 
-def test_llm_429_error_with_retry(processing_service, mock_invoice_repo, mock_llm_provider):
+def test_llm_429_error_with_retry(mock_invoice_repo, mock_llm_provider):
     """Test that 429 errors trigger retry logic."""
     # Arrange
+    mock_invoice_repo.get_invoice_keys.return_value = []
+    limiter = AdaptiveLimiter(pause_seconds=0.01)
+    processing_service = ProcessingService(mock_invoice_repo, mock_llm_provider, concurrency_limiter=limiter)
     raw_invoice = create_raw_invoice()
-    mock_invoice_repo.get_pending_raw_invoices.return_value = [raw_invoice]
+    mock_invoice_repo.iter_pending_raw_invoice_rows.return_value = [raw_invoice]
     
     # Mock LLM to fail twice with 429, then succeed
     mock_llm_provider.extract_invoice_data.side_effect = [
@@ -68,15 +76,16 @@ def test_llm_429_error_with_retry(processing_service, mock_invoice_repo, mock_ll
     
     # Assert
     assert mock_llm_provider.extract_invoice_data.call_count == 3
-    mock_invoice_repo.save_processed_invoice.assert_called_once()
-    mock_invoice_repo.update_raw_invoice_status.assert_called_with("inv_1", "PROCESSED")
+    mock_invoice_repo.commit_processed_invoice.assert_called_once()
+    assert mock_invoice_repo.commit_processed_invoice.call_args[0][0].raw_invoice_id == "inv_1"
+    assert limiter.metrics()['throttles'] == 2
 
 
 def test_llm_returns_invalid_data(processing_service, mock_invoice_repo, mock_llm_provider):
     """Test handling of invalid LLM response data."""
     # Arrange
     raw_invoice = create_raw_invoice()
-    mock_invoice_repo.get_pending_raw_invoices.return_value = [raw_invoice]
+    mock_invoice_repo.iter_pending_raw_invoice_rows.return_value = [raw_invoice]
     
     # Mock LLM to return invalid data (missing required fields)
     mock_llm_provider.extract_invoice_data.return_value = {
@@ -89,7 +98,7 @@ def test_llm_returns_invalid_data(processing_service, mock_invoice_repo, mock_ll
     processing_service.run()
     
     # Assert
-    mock_invoice_repo.save_processed_invoice.assert_not_called()
+    mock_invoice_repo.commit_processed_invoice.assert_not_called()
     # Verify it was marked as failed with an error message
     # Note: status update is called twice (once in _process_single_invoice, once in run)
     calls = mock_invoice_repo.update_raw_invoice_status.call_args_list
@@ -108,7 +117,7 @@ def test_batch_processing_with_partial_failures(processing_service, mock_invoice
     invoice2 = create_raw_invoice("inv_2", "email_2", "/tmp/test2.pdf")
     invoice3 = create_raw_invoice("inv_3", "email_3", "/tmp/test3.pdf")
     
-    mock_invoice_repo.get_pending_raw_invoices.return_value = [invoice1, invoice2, invoice3]
+    mock_invoice_repo.iter_pending_raw_invoice_rows.return_value = [invoice1, invoice2, invoice3]
     
     # Mock LLM: first succeeds, second fails, third succeeds
     mock_llm_provider.extract_invoice_data.side_effect = [
@@ -137,10 +146,9 @@ def test_batch_processing_with_partial_failures(processing_service, mock_invoice
     processing_service.run()
     
     # Assert
-    assert mock_invoice_repo.save_processed_invoice.call_count == 2
-    # Note: update_raw_invoice_status is called twice for failed invoice (once in _process_single_invoice, once in run)
-    # So we expect 4 total calls: 2 success + 2 for the failed one
-    assert mock_invoice_repo.update_raw_invoice_status.call_count >= 3
+    assert mock_invoice_repo.commit_processed_invoice.call_count == 2
+    # Successful invoices are marked PROCESSED by the commit, so only the failed one is updated
+    assert mock_invoice_repo.update_raw_invoice_status.call_count == 1
     
     # Verify invoice 2 was marked as failed
     failed_calls = [call for call in mock_invoice_repo.update_raw_invoice_status.call_args_list 
@@ -153,10 +161,10 @@ def test_duplicate_invoice_detection(processing_service, mock_invoice_repo, mock
     """Test that duplicate invoices (same invoice_number) are detected."""
     # Arrange
     raw_invoice = create_raw_invoice()
-    mock_invoice_repo.get_pending_raw_invoices.return_value = [raw_invoice]
+    mock_invoice_repo.iter_pending_raw_invoice_rows.return_value = [raw_invoice]
     
     # Mock that an invoice with this number already exists
-    mock_invoice_repo.invoice_number_exists.return_value = True
+    mock_invoice_repo.get_invoice_keys.return_value = [InvoiceKey.from_fields("Test Vendor", "INV/001", 123.0, "2023-01-01")]
     
     mock_llm_provider.extract_invoice_data.return_value = {
         "invoice_date": "2023-01-01",
@@ -172,8 +180,9 @@ def test_duplicate_invoice_detection(processing_service, mock_invoice_repo, mock
     processing_service.run()
     
     # Assert - should not save if duplicate
-    mock_invoice_repo.invoice_number_exists.assert_called_once_with("INV/001")
-    mock_invoice_repo.save_processed_invoice.assert_not_called()
+    mock_invoice_repo.get_invoice_keys.assert_called_once()
+    mock_invoice_repo.invoice_number_exists.assert_not_called()
+    mock_invoice_repo.commit_processed_invoice.assert_not_called()
     # Should be marked as failed with duplicate message
     failed_calls = [c for c in mock_invoice_repo.update_raw_invoice_status.call_args_list 
                     if c[0][1] == "FAILED"]
@@ -185,7 +194,7 @@ def test_processing_service_extracts_and_saves(processing_service, mock_invoice_
     """Test successful invoice processing and saving."""
     # Arrange
     raw_invoice = create_raw_invoice()
-    mock_invoice_repo.get_pending_raw_invoices.return_value = [raw_invoice]
+    mock_invoice_repo.iter_pending_raw_invoice_rows.return_value = [raw_invoice]
     
     mock_llm_provider.extract_invoice_data.return_value = {
         "invoice_date": "2023-01-01",
@@ -202,15 +211,15 @@ def test_processing_service_extracts_and_saves(processing_service, mock_invoice_
     
     # Assert
     mock_llm_provider.extract_invoice_data.assert_called_once()
-    mock_invoice_repo.save_processed_invoice.assert_called_once()
-    mock_invoice_repo.update_raw_invoice_status.assert_called_with("inv_1", "PROCESSED")
+    mock_invoice_repo.commit_processed_invoice.assert_called_once()
+    assert mock_invoice_repo.commit_processed_invoice.call_args[0][0].raw_invoice_id == "inv_1"
 
 
 def test_multiple_date_formats_handled(processing_service, mock_invoice_repo, mock_llm_provider):
     """Test that various date formats are handled correctly."""
     # Arrange
     raw_invoice = create_raw_invoice()
-    mock_invoice_repo.get_pending_raw_invoices.return_value = [raw_invoice]
+    mock_invoice_repo.iter_pending_raw_invoice_rows.return_value = [raw_invoice]
     
     # Test with Polish date format
     mock_llm_provider.extract_invoice_data.return_value = {
@@ -227,8 +236,285 @@ def test_multiple_date_formats_handled(processing_service, mock_invoice_repo, mo
     processing_service.run()
     
     # Assert
-    mock_invoice_repo.save_processed_invoice.assert_called_once()
-    saved_invoice = mock_invoice_repo.save_processed_invoice.call_args[0][0]
+    mock_invoice_repo.commit_processed_invoice.assert_called_once()
+    saved_invoice = mock_invoice_repo.commit_processed_invoice.call_args[0][0]
     assert saved_invoice.extracted_data.invoice_date.year == 2023
     assert saved_invoice.extracted_data.invoice_date.month == 1
     assert saved_invoice.extracted_data.invoice_date.day == 1
+
+
+def test_identical_pdf_skips_llm_extraction(processing_service, mock_invoice_repo, mock_llm_provider):
+    """Test that a PDF whose hash already produced a processed invoice is never sent to the LLM."""
+    # Arrange
+    raw_invoice = create_raw_invoice(attachment_path="/tmp/sha256/abc123/Faktura_001.pdf")
+    raw_invoice.email_data.content_hash = "abc123"
+    mock_invoice_repo.iter_pending_raw_invoice_rows.return_value = [raw_invoice]
+    mock_invoice_repo.content_hash_processed.return_value = True
+
+    # Act
+    stats = processing_service.run()
+
+    # Assert
+    mock_invoice_repo.content_hash_processed.assert_called_once_with("abc123")
+    mock_llm_provider.extract_invoice_data.assert_not_called()
+    mock_invoice_repo.commit_processed_invoice.assert_not_called()
+    assert stats['failed'] == 1
+    assert stats['errors'][0]['filename'] == "Faktura_001.pdf"
+    assert "Duplicate attachment" in stats['errors'][0]['reason']
+
+
+def test_batch_mode_processes_bulk_results_and_per_item_failures(mock_invoice_repo, mock_llm_provider):
+    """Test that batch mode submits a chunk at once and handles each result like the sequential path."""
+    # Arrange
+    service = ProcessingService(mock_invoice_repo, mock_llm_provider, batch_size=10, max_attempts=1)
+    mock_invoice_repo.get_invoice_keys.return_value = []
+    invoices = [create_raw_invoice(f"inv_{i}", f"email_{i}", f"/tmp/test{i}.pdf") for i in range(3)]
+    mock_invoice_repo.iter_pending_raw_invoice_rows.return_value = invoices
+    mock_llm_provider.extract_invoice_data_batch.return_value = {
+        "inv_0": {
+            "invoice_date": "2023-01-01", "category": "JEDZENIE", "vendor": "Vendor 1",
+            "net_amount": 100.0, "gross_amount": 123.0, "invoice_number": "INV/001", "payment_date": "2023-01-14"
+        },
+        "inv_1": RuntimeError("Batch item failed: 400 Unreadable PDF"),
+        "inv_2": RuntimeError("Batch item failed: 429 RESOURCE_EXHAUSTED"),
+    }
+
+    # Act
+    stats = service.run()
+
+    # Assert
+    mock_llm_provider.extract_invoice_data_batch.assert_called_once_with(
+        {"inv_0": "/tmp/test0.pdf", "inv_1": "/tmp/test1.pdf", "inv_2": "/tmp/test2.pdf"}
+    )
+    mock_llm_provider.extract_invoice_data.assert_not_called()
+    assert (stats['success'], stats['failed'], stats['retried']) == (1, 1, 1)
+    statuses = {c[0][0]: c[0][1] for c in mock_invoice_repo.update_raw_invoice_status.call_args_list}
+    assert statuses == {"inv_1": "FAILED", "inv_2": "RETRY"}
+    assert mock_invoice_repo.commit_processed_invoice.call_args[0][0].raw_invoice_id == "inv_0"
+
+
+def test_batch_mode_marks_chunk_retry_when_job_fails(mock_invoice_repo, mock_llm_provider):
+    """Test that a failed batch job leaves its invoices for the next run."""
+    # Arrange
+    service = ProcessingService(mock_invoice_repo, mock_llm_provider, batch_size=10)
+    invoices = [create_raw_invoice(f"inv_{i}", f"email_{i}") for i in range(2)]
+    mock_invoice_repo.iter_pending_raw_invoice_rows.return_value = invoices
+    mock_llm_provider.extract_invoice_data_batch.side_effect = RuntimeError("Gemini batch job ended in state JOB_STATE_EXPIRED")
+
+    # Act
+    stats = service.run()
+
+    # Assert
+    assert stats['retried'] == 2
+    assert [c[0][1] for c in mock_invoice_repo.update_raw_invoice_status.call_args_list] == ["RETRY", "RETRY"]
+
+
+def test_batch_mode_goes_through_limiters_and_resends_throttled_items(mock_invoice_repo, mock_llm_provider):
+    """Test that bulk calls are weighted in the rate limiter and only throttled items are sent again."""
+    # Arrange
+    rate_limiter = Mock()
+    limiter = AdaptiveLimiter(max_limit=2, pause_seconds=0)
+    service = ProcessingService(
+        mock_invoice_repo, mock_llm_provider, batch_size=10,
+        rate_limiter=rate_limiter, concurrency_limiter=limiter
+    )
+    mock_invoice_repo.get_invoice_keys.return_value = []
+    mock_invoice_repo.iter_pending_raw_invoice_rows.return_value = [
+        create_raw_invoice(f"inv_{i}", f"email_{i}", f"/tmp/test{i}.pdf") for i in range(3)
+    ]
+
+    def extracted(number):
+        return {
+            "invoice_date": "2023-01-01", "category": "JEDZENIE", "vendor": "Vendor",
+            "net_amount": 100.0, "gross_amount": 123.0, "invoice_number": number, "payment_date": "2023-01-14"
+        }
+
+    mock_llm_provider.extract_invoice_data_batch.side_effect = [
+        {"inv_0": extracted("INV/0"), "inv_1": RuntimeError("429 RESOURCE_EXHAUSTED"), "inv_2": extracted("INV/2")},
+        ResourceExhausted("quota"),
+        {"inv_1": extracted("INV/1")},
+    ]
+
+    # Act
+    stats = service.run()
+
+    # Assert
+    calls = [c[0][0] for c in mock_llm_provider.extract_invoice_data_batch.call_args_list]
+    assert calls == [
+        {"inv_0": "/tmp/test0.pdf", "inv_1": "/tmp/test1.pdf", "inv_2": "/tmp/test2.pdf"},
+        {"inv_1": "/tmp/test1.pdf"},
+        {"inv_1": "/tmp/test1.pdf"},
+    ]
+    assert [c[0] for c in rate_limiter.acquire.call_args_list] == [(3,), (1,), (1,)]
+    assert limiter.throttles == 2
+    assert stats['success'] == 3
+
+
+class SlowLLMProvider:
+    """Fake LLMProvider simulating Gemini latency; invoices whose path contains 'bad' fail."""
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+
+    def extract_invoice_data(self, file_path):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self._lock:
+            self.in_flight -= 1
+        if "bad" in file_path:
+            raise ValueError("LLM Error")
+        number = file_path.rsplit("/", 1)[-1].removesuffix(".pdf")
+        return {
+            "invoice_date": "2023-01-01", "category": "JEDZENIE", "vendor": "Vendor",
+            "net_amount": 100.0, "gross_amount": 123.0, "invoice_number": number, "payment_date": "2023-01-14"
+        }
+
+
+def _pending_batch(count):
+    return [
+        create_raw_invoice(f"inv_{i}", f"email_{i}", f"/tmp/{'bad' if i % 5 == 0 else 'inv'}{i}.pdf")
+        for i in range(count)
+    ]
+
+
+def test_concurrent_mode_matches_sequential_stats_and_overlaps_calls(mock_invoice_repo):
+    """20 invoices at 50 ms simulated latency, sequential vs 8 workers."""
+    # Arrange
+    mock_invoice_repo.get_invoice_keys.return_value = []
+    invoices = _pending_batch(20)
+    mock_invoice_repo.iter_pending_raw_invoice_rows.return_value = invoices
+    sequential_llm, concurrent_llm = SlowLLMProvider(), SlowLLMProvider()
+    sequential = ProcessingService(mock_invoice_repo, sequential_llm)
+    concurrent = ProcessingService(mock_invoice_repo, concurrent_llm, max_workers=8)
+
+    # Act
+    sequential_stats = sequential.run()
+    concurrent_stats = concurrent.run()
+
+    # Assert
+    assert concurrent_stats == sequential_stats
+    assert (concurrent_stats['success'], concurrent_stats['failed']) == (16, 4)
+    assert sequential_llm.peak_in_flight == 1
+    assert 1 < concurrent_llm.peak_in_flight <= 8
+
+
+def test_concurrent_mode_acquires_rate_limit_per_call(mock_invoice_repo):
+    """Test that every LLM call goes through the shared rate limiter."""
+    # Arrange
+    mock_invoice_repo.get_invoice_keys.return_value = []
+    mock_invoice_repo.iter_pending_raw_invoice_rows.return_value = _pending_batch(6)
+    limiter = Mock()
+    service = ProcessingService(mock_invoice_repo, SlowLLMProvider(latency=0), max_workers=3, rate_limiter=limiter)
+
+    # Act
+    service.run()
+
+    # Assert
+    assert limiter.acquire.call_count == 6
+
+
+class QuotaLLMProvider:
+    """
+    Simulated quota: more than `max_concurrent` calls in flight are rejected
+    with ResourceExhausted, like Gemini answering 429 under load.
+    """
+
+    def __init__(self, max_concurrent=3, latency=0.01):
+        self.max_concurrent = max_concurrent
+        self.latency = latency
+        self.in_flight = 0
+        self.peak_accepted = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def extract_invoice_data(self, file_path):
+        with self.lock:
+            if self.in_flight >= self.max_concurrent:
+                self.rejected += 1
+                raise ResourceExhausted("Quota exceeded")
+            self.in_flight += 1
+            self.peak_accepted = max(self.peak_accepted, self.in_flight)
+        try:
+            time.sleep(self.latency)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        number = file_path.rsplit("/", 1)[-1].removesuffix(".pdf")
+        return {
+            "invoice_date": "2023-01-01", "category": "JEDZENIE", "vendor": "Vendor",
+            "net_amount": 100.0, "gross_amount": 123.0, "invoice_number": number, "payment_date": "2023-01-14"
+        }
+
+
+def test_adaptive_limiter_settles_under_simulated_quota(mock_invoice_repo):
+    """8 workers against a quota of 3 concurrent calls: the limiter backs off instead of failing invoices."""
+    # Arrange
+    mock_invoice_repo.get_invoice_keys.return_value = []
+    mock_invoice_repo.iter_pending_raw_invoice_rows.return_value = [
+        create_raw_invoice(f"inv_{i}", f"email_{i}", f"/tmp/inv{i}.pdf") for i in range(40)
+    ]
+    llm = QuotaLLMProvider(max_concurrent=3)
+    limiter = AdaptiveLimiter(max_limit=8, pause_seconds=0.01, max_pause_seconds=0.05)
+    service = ProcessingService(mock_invoice_repo, llm, max_workers=8, concurrency_limiter=limiter, max_attempts=10)
+
+    # Act
+    stats = service.run()
+
+    # Assert
+    metrics = limiter.metrics()
+    assert stats['success'] == 40
+    assert stats['retried'] == 0
+    assert metrics['throttles'] == llm.rejected > 0
+    assert metrics['limit'] < 8
+    assert metrics['in_flight'] == 0
+    # Far fewer rejections than one per worker per invoice
+    assert llm.rejected < 40
+
+
+def test_parallel_workers_with_leases_extract_each_invoice_once(tmp_path):
+    """Two job tasks draining one repository: no invoice is extracted twice, throttled ones wait for the next run."""
+    # Arrange
+    repo = JsonInvoiceRepository(data_dir=str(tmp_path))
+    for i in range(12):
+        repo.save_raw_invoice(create_raw_invoice(f"inv_{i}", f"email_{i}", f"/tmp/inv{i}.pdf"))
+    extracted = []
+    lock = threading.Lock()
+
+    def extract(file_path):
+        with lock:
+            extracted.append(file_path)
+        time.sleep(0.005)
+        if file_path == "/tmp/inv3.pdf":
+            raise ResourceExhausted("429 Quota exceeded")
+        number = file_path.rsplit("/", 1)[-1].removesuffix(".pdf")
+        return {
+            "invoice_date": "2023-01-01", "category": "JEDZENIE", "vendor": "Vendor",
+            "net_amount": 100.0, "gross_amount": 123.0, "invoice_number": number, "payment_date": "2023-01-14"
+        }
+
+    llm = Mock()
+    llm.extract_invoice_data.side_effect = extract
+    services = [
+        ProcessingService(repo, llm, claim_size=2, worker_id=f"task{i}", max_attempts=1,
+                          concurrency_limiter=AdaptiveLimiter(pause_seconds=0))
+        for i in range(2)
+    ]
+    stats = {}
+    threads = [threading.Thread(target=lambda s=service: stats.setdefault(s.worker_id, s.run())) for service in services]
+
+    # Act
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Assert
+    assert sorted(extracted) == sorted(f"/tmp/inv{i}.pdf" for i in range(12))
+    assert sum(s['success'] for s in stats.values()) == 11
+    assert sum(s['retried'] for s in stats.values()) == 1
+    assert {item['status'] for item in repo._load_json(repo.raw_invoices_file)} == {"PROCESSED", "RETRY"}
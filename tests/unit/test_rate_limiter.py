@@ -0,0 +1,101 @@
+"""Unit tests for the token-bucket rate limiter."""
+from src.services.rate_limiter import TokenBucket, RateLimiter, AdaptiveLimiter
+
+
+class FakeClock:
+    """Manual clock; sleeping advances time instantly."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_bucket_allows_burst_then_paces_to_rate():
+    # Arrange
+    clock = FakeClock()
+    bucket = TokenBucket(rate_per_minute=60, clock=clock, sleep=clock.sleep)
+
+    # Act - a full minute's quota is available immediately, then one per second
+    for _ in range(60):
+        bucket.acquire()
+    burst_end = clock.now
+    for _ in range(10):
+        bucket.acquire()
+
+    # Assert
+    assert burst_end == 0.0
+    assert abs(clock.now - 10.0) < 1e-6
+
+
+def test_limiter_is_bound_by_the_tighter_quota():
+    # Arrange - 600 RPM allows 10/s but 60k TPM at 6k tokens per request allows only 1/6 per second
+    clock = FakeClock()
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=60_000, tokens_per_request=6_000, clock=clock, sleep=clock.sleep)
+
+    # Act
+    for _ in range(10 + 5):
+        limiter.acquire()
+
+    # Assert - 10 requests fit the initial token burst, the next 5 take 6 s each
+    assert abs(clock.now - 30.0) < 1e-6
+
+
+def test_limiter_without_quotas_never_waits():
+    # Arrange
+    clock = FakeClock()
+    limiter = RateLimiter(clock=clock, sleep=clock.sleep)
+
+    # Act
+    for _ in range(1000):
+        limiter.acquire()
+
+    # Assert
+    assert clock.now == 0.0
+
+
+def test_adaptive_limiter_halves_once_per_burst_and_grows_back():
+    # Arrange
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(max_limit=8, pause_seconds=5, clock=clock)
+    tickets = [limiter.acquire() for _ in range(8)]
+
+    # Act: every call in flight is throttled
+    clock.now = 1.0
+    for ticket in tickets:
+        limiter.release(ticket, throttled=True)
+
+    # Assert
+    metrics = limiter.metrics()
+    assert metrics['limit'] == 4
+    assert metrics['throttles'] == 8
+    assert metrics['paused_seconds'] == 5
+
+    # Act: successes after the pause
+    clock.now = 6.0
+    for _ in range(8):
+        limiter.release(limiter.acquire())
+
+    # Assert
+    assert 5 < limiter.limit < 6
+
+
+def test_adaptive_limiter_backoff_doubles_while_throttled():
+    # Arrange
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(max_limit=4, pause_seconds=1, max_pause_seconds=3, clock=clock)
+
+    # Act
+    for now in (0.0, 10.0, 20.0):
+        clock.now = now
+        ticket = limiter.acquire()
+        clock.now = now + 0.1
+        limiter.release(ticket, throttled=True)
+
+    # Assert
+    assert limiter.metrics()['paused_seconds'] == 1 + 2 + 3
+    assert limiter.limit == 1
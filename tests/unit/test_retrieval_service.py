@@ -25,20 +25,20 @@ def test_retrieval_service_fetches_and_saves_emails(retrieval_service, mock_emai
         date=datetime.now(),
         attachment_path="/tmp/invoice.pdf"
     )
-    mock_email_provider.fetch_unread_emails_with_attachments.return_value = [email]
+    mock_email_provider.iter_unread_emails_with_attachments.return_value = iter([email])
 
     # Act
     retrieval_service.run()
 
     # Assert
-    mock_email_provider.fetch_unread_emails_with_attachments.assert_called_once()
+    mock_email_provider.iter_unread_emails_with_attachments.assert_called_once_with(since_checkpoint=None)
     mock_invoice_repo.save_raw_invoice.assert_called_once()
     saved_invoice = mock_invoice_repo.save_raw_invoice.call_args[0][0]
     assert isinstance(saved_invoice, RawInvoice)
     assert saved_invoice.email_id == "email_1"
     assert saved_invoice.status == ProcessingStatus.PENDING
     
-    mock_email_provider.mark_as_processed.assert_called_once_with("email_1")
+    mock_email_provider.mark_many_as_processed.assert_called_once_with(["email_1"])
 
 def test_retrieval_service_handles_exception(retrieval_service, mock_email_provider, mock_invoice_repo):
     # Arrange
@@ -49,7 +49,7 @@ def test_retrieval_service_handles_exception(retrieval_service, mock_email_provi
         date=datetime.now(),
         attachment_path="/tmp/invoice.pdf"
     )
-    mock_email_provider.fetch_unread_emails_with_attachments.return_value = [email]
+    mock_email_provider.iter_unread_emails_with_attachments.return_value = iter([email])
     mock_invoice_repo.save_raw_invoice.side_effect = Exception("DB Error")
 
     # Act
@@ -58,4 +58,95 @@ def test_retrieval_service_handles_exception(retrieval_service, mock_email_provi
     # Assert
     # Should log error and NOT mark as processed (or handle accordingly)
     mock_invoice_repo.save_raw_invoice.assert_called_once()
-    mock_email_provider.mark_as_processed.assert_not_called()
+    mock_email_provider.mark_many_as_processed.assert_not_called()
+
+def test_retrieval_service_saves_each_email_as_it_arrives(retrieval_service, mock_email_provider, mock_invoice_repo):
+    # Arrange
+    emails = [
+        Email(id=f"email_{i}", sender="vendor@example.com", subject=f"Invoice {i}",
+              date=datetime.now(), attachment_path=f"/tmp/invoice{i}.pdf")
+        for i in range(3)
+    ]
+
+    def stream():
+        for i, email in enumerate(emails):
+            # Everything yielded so far must already be persisted
+            assert mock_invoice_repo.save_raw_invoice.call_count == i
+            yield email
+
+    mock_email_provider.iter_unread_emails_with_attachments.return_value = stream()
+
+    # Act
+    stats = retrieval_service.run()
+
+    # Assert
+    assert stats == {'total': 3, 'success': 3}
+
+def test_incremental_retrieval_advances_checkpoint(mock_email_provider, mock_invoice_repo):
+    # Arrange
+    service = RetrievalService(mock_email_provider, mock_invoice_repo, incremental=True)
+    email = Email(id="email_1", sender="vendor@example.com", subject="Invoice 123",
+                  date=datetime.now(), attachment_path="/tmp/invoice.pdf")
+    mock_invoice_repo.get_sync_checkpoint.return_value = "100"
+    mock_email_provider.iter_unread_emails_with_attachments.return_value = iter([email])
+    mock_email_provider.get_sync_checkpoint.return_value = "200"
+
+    # Act
+    service.run()
+
+    # Assert
+    mock_email_provider.iter_unread_emails_with_attachments.assert_called_once_with(since_checkpoint="100")
+    mock_invoice_repo.save_sync_checkpoint.assert_called_once_with("email_history", "200")
+
+def test_incremental_retrieval_keeps_checkpoint_after_failure(mock_email_provider, mock_invoice_repo):
+    # Arrange
+    service = RetrievalService(mock_email_provider, mock_invoice_repo, incremental=True)
+    email = Email(id="email_1", sender="vendor@example.com", subject="Invoice 123",
+                  date=datetime.now(), attachment_path="/tmp/invoice.pdf")
+    mock_invoice_repo.get_sync_checkpoint.return_value = "100"
+    mock_invoice_repo.save_raw_invoice.side_effect = Exception("DB Error")
+    mock_email_provider.iter_unread_emails_with_attachments.return_value = iter([email])
+    mock_email_provider.get_sync_checkpoint.return_value = "200"
+
+    # Act
+    service.run()
+
+    # Assert
+    mock_invoice_repo.save_sync_checkpoint.assert_not_called()
+
+def test_incremental_retrieval_keeps_checkpoint_when_marking_fails(mock_email_provider, mock_invoice_repo):
+    # Arrange
+    service = RetrievalService(mock_email_provider, mock_invoice_repo, incremental=True)
+    email = Email(id="email_1", sender="vendor@example.com", subject="Invoice 123",
+                  date=datetime.now(), attachment_path="/tmp/invoice.pdf")
+    mock_invoice_repo.get_sync_checkpoint.return_value = "100"
+    mock_email_provider.iter_unread_emails_with_attachments.return_value = iter([email])
+    mock_email_provider.mark_many_as_processed.side_effect = Exception("Gmail API Error")
+    mock_email_provider.get_sync_checkpoint.return_value = "200"
+
+    # Act
+    stats = service.run()
+
+    # Assert
+    assert stats == {'total': 1, 'success': 1}
+    mock_invoice_repo.save_sync_checkpoint.assert_not_called()
+
+def test_retrieval_service_marks_saved_emails_in_chunks(mock_email_provider, mock_invoice_repo):
+    # Arrange
+    service = RetrievalService(mock_email_provider, mock_invoice_repo, mark_batch_size=2)
+    emails = [
+        Email(id=f"email_{i}", sender="vendor@example.com", subject=f"Invoice {i}",
+              date=datetime.now(), attachment_path=f"/tmp/invoice{i}.pdf")
+        for i in range(5)
+    ]
+    mock_email_provider.iter_unread_emails_with_attachments.return_value = iter(emails)
+    # The third email fails to persist and must never be marked
+    mock_invoice_repo.save_raw_invoice.side_effect = [None, None, Exception("DB Error"), None, None]
+
+    # Act
+    stats = service.run()
+
+    # Assert
+    assert stats == {'total': 5, 'success': 4}
+    marked = [c[0][0] for c in mock_email_provider.mark_many_as_processed.call_args_list]
+    assert marked == [["email_0", "email_1"], ["email_3", "email_4"]]
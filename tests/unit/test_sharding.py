@@ -0,0 +1,202 @@
+"""Unit tests for Shard and sharded processing."""
+import random
+import threading
+import time
+import uuid
+import pytest
+from unittest.mock import Mock
+from datetime import datetime, timezone
+from src.domain.entities import RawInvoice, Email, ProcessingStatus
+from src.domain.sharding import Shard
+from src.infrastructure.json_repository import JsonInvoiceRepository
+from src.services.leases import RetrievalBarrier
+from src.services.processing_service import ProcessingService
+from src.services.retrieval_service import RetrievalService
+from src.services.sheets_service import SheetsService
+
+
+def test_shards_partition_any_id():
+    # Arrange
+    ids = ["", "0", "00000000", "7fffffff-x", "80000000", "ffffffff-ffff", "inv_1", "ZZZ", "-1"]
+    rng = random.Random(0)
+    ids += [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(1000)]
+
+    for count in (1, 2, 3, 7, 16):
+        shards = [Shard(index, count) for index in range(count)]
+
+        # Act
+        owners = [[shard.index for shard in shards if shard.contains(document_id)] for document_id in ids]
+
+        # Assert
+        assert all(len(owner) == 1 for owner in owners)
+
+
+def test_uuid_ids_are_spread_evenly():
+    # Arrange
+    rng = random.Random(0)
+    ids = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(4000)]
+
+    # Act
+    sizes = [sum(Shard(index, 4).contains(document_id) for document_id in ids) for index in range(4)]
+
+    # Assert
+    assert min(sizes) > 800
+
+
+def test_shard_index_must_be_below_count():
+    with pytest.raises(ValueError):
+        Shard(index=3, count=3)
+
+
+def test_shard_defaults_to_cloud_run_task(monkeypatch):
+    # Arrange
+    monkeypatch.setenv("CLOUD_RUN_TASK_INDEX", "2")
+    monkeypatch.setenv("CLOUD_RUN_TASK_COUNT", "5")
+
+    # Act
+    shard = Shard.from_env()
+
+    # Assert
+    assert shard == Shard(index=2, count=5)
+
+
+def test_simulated_tasks_process_every_invoice_exactly_once(tmp_path):
+    """N job tasks, each with its own shard of one repository: no overlap, nothing missed."""
+    # Arrange
+    repo = JsonInvoiceRepository(data_dir=str(tmp_path))
+    rng = random.Random(42)
+    for i in range(60):
+        invoice_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        repo.save_raw_invoice(RawInvoice(
+            id=invoice_id,
+            email_id=f"email_{i}",
+            email_data=Email(
+                id=f"email_{i}",
+                sender="vendor@example.com",
+                subject="Invoice",
+                date=datetime.now(),
+                attachment_path=f"/tmp/{invoice_id}.pdf"
+            ),
+            status=ProcessingStatus.RETRY if i % 5 == 0 else ProcessingStatus.PENDING,
+            created_at=datetime.now(timezone.utc),
+            updated_at=datetime.now(timezone.utc)
+        ))
+    task_count = 4
+    processed_by_task = []
+
+    # Act
+    for index in range(task_count):
+        llm = Mock()
+        llm.extract_invoice_data.side_effect = lambda path: {
+            "invoice_date": "2023-01-01", "category": "JEDZENIE", "vendor": "Vendor",
+            "net_amount": 100.0, "gross_amount": 123.0, "invoice_number": path, "payment_date": "2023-01-14"
+        }
+        service = ProcessingService(repo, llm, shard=Shard(index, task_count))
+        stats = service.run()
+        processed_by_task.append({call.args[0] for call in llm.extract_invoice_data.call_args_list})
+        assert stats['success'] == len(processed_by_task[-1])
+
+    # Assert
+    all_paths = {f"/tmp/{item['id']}.pdf" for item in repo._load_json(repo.raw_invoices_file)}
+    assert sum(len(paths) for paths in processed_by_task) == len(all_paths) == 60
+    assert set().union(*processed_by_task) == all_paths
+    assert all(paths for paths in processed_by_task)
+    assert {item['status'] for item in repo._load_json(repo.raw_invoices_file)} == {"PROCESSED"}
+
+
+def test_parallel_tasks_process_and_export_mail_ingested_in_the_same_run(tmp_path):
+    """Task 0 reads the mailbox while tasks 1..N-1 wait; every task exports what it extracted."""
+    # Arrange
+    repo = JsonInvoiceRepository(data_dir=str(tmp_path))
+    task_count = 3
+    emails = [
+        Email(id=f"email_{i}", sender="vendor@example.com", subject="Invoice", date=datetime.now(), attachment_path=f"/tmp/email_{i}.pdf")
+        for i in range(30)
+    ]
+    email_provider = Mock()
+    email_provider.iter_unread_emails_with_attachments.return_value = iter(emails)
+    others_waiting = threading.Semaphore(0)
+    extracted_by_task = [set() for _ in range(task_count)]
+    exported_by_task = [set() for _ in range(task_count)]
+
+    def waiting_sleep(seconds):
+        others_waiting.release()
+        time.sleep(0.01)
+
+    def task(index):
+        barrier = RetrievalBarrier(repo, execution_id="exec-1", poll_seconds=0.01, sleep=waiting_sleep)
+        if index == 0:
+            # Retrieval only starts once every other task is already waiting
+            for _ in range(task_count - 1):
+                others_waiting.acquire()
+            RetrievalService(email_provider, repo).run()
+            barrier.mark_done()
+        else:
+            assert barrier.wait()
+        llm = Mock()
+        llm.extract_invoice_data.side_effect = lambda path: {
+            "invoice_date": "2023-01-01", "category": "JEDZENIE", "vendor": "Vendor",
+            "net_amount": 100.0, "gross_amount": 123.0, "invoice_number": path, "payment_date": "2023-01-14"
+        }
+        shard = Shard(index, task_count)
+        ProcessingService(repo, llm, shard=shard).run(
+            on_processed=lambda invoice: extracted_by_task[index].add(invoice.raw_invoice_id)
+        )
+        sheets = Mock()
+        sheets.append_invoice.side_effect = lambda invoice: exported_by_task[index].add(invoice.raw_invoice_id)
+        SheetsService(repo, sheets, shard=shard).run()
+
+    threads = [threading.Thread(target=task, args=(index,)) for index in range(task_count)]
+
+    # Act
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Assert
+    raw_ids = {item['id'] for item in repo._load_json(repo.raw_invoices_file)}
+    assert len(raw_ids) == 30
+    assert sum(len(ids) for ids in extracted_by_task) == 30
+    assert set().union(*extracted_by_task) == raw_ids
+    assert exported_by_task == extracted_by_task
+    assert {item['sync_status'] for item in repo._load_json(repo.processed_invoices_file)} == {"SYNCED"}
+
+
+def test_retrieval_barrier_gives_up_after_the_timeout():
+    # Arrange
+    repo = Mock()
+    repo.get_sync_checkpoint.return_value = "exec-0"
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    barrier = RetrievalBarrier(repo, execution_id="exec-1", timeout_seconds=30, poll_seconds=5, clock=lambda: now[0], sleep=sleep)
+
+    # Act
+    finished = barrier.wait()
+
+    # Assert
+    assert finished is False
+    assert now[0] == 30
+
+
+def test_firestore_query_is_limited_to_the_shard_range():
+    # Arrange
+    from src.infrastructure.firestore_adapter import FirestoreAdapter
+    adapter = FirestoreAdapter(project_id="")
+    adapter.client = Mock()
+    collection_ref = adapter.client.collection.return_value
+    collection_ref.document.side_effect = lambda document_id: f"raw_invoices/{document_id}"
+    status_query = collection_ref.where.return_value
+    status_query.where.return_value.where.return_value.stream.return_value = []
+
+    # Act
+    adapter.get_pending_raw_invoices([ProcessingStatus.PENDING], shard=Shard(index=1, count=4))
+
+    # Assert
+    lower = status_query.where.call_args.kwargs['filter']
+    upper = status_query.where.return_value.where.call_args.kwargs['filter']
+    assert (lower.field_path, lower.op_string, lower.value) == ("__name__", ">=", "raw_invoices/40000000")
+    assert (upper.field_path, upper.op_string, upper.value) == ("__name__", "<", "raw_invoices/80000000")
@@ -0,0 +1,22 @@
+"""Unit tests for file storage."""
+import hashlib
+from src.infrastructure.storage import LocalFileStorage
+
+
+def test_content_addressed_save_stores_identical_pdf_once(tmp_path):
+    """Test that resending the same bytes, under any filename, reuses the stored file and returns the same digest."""
+    # Arrange
+    storage = LocalFileStorage(base_dir=str(tmp_path))
+    content = b"%PDF-1.4 fake invoice"
+
+    # Act
+    first_path, first_hash = storage.save_content_addressed("invoice.pdf", content)
+    second_path, second_hash = storage.save_content_addressed("Faktura_resent.pdf", content)
+    other_path, other_hash = storage.save_content_addressed("invoice.pdf", b"%PDF-1.4 other invoice")
+
+    # Assert
+    assert first_hash == second_hash == hashlib.sha256(content).hexdigest()
+    assert first_path == second_path
+    assert first_path.endswith(f"sha256/{first_hash}.pdf")
+    assert other_hash != first_hash and other_path != first_path
+    assert len(list(tmp_path.rglob("*.pdf"))) == 2
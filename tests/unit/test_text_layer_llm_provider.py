@@ -0,0 +1,163 @@
+"""Unit tests for TextLayerLLMProvider."""
+import pytest
+from unittest.mock import Mock
+from src.infrastructure.text_layer_llm_provider import TextLayerLLMProvider, parse_amount
+
+
+def bukat_text(number, issued, due, net, gross):
+    """Text layer of a fixed-layout invoice, as pypdf would return it."""
+    return "\n".join([
+        "BUKAT Sp. z o.o.",
+        "ul. Przemysłowa 1, 00-001 Warszawa",
+        f"Faktura VAT nr {number}",
+        f"Data wystawienia: {issued}",
+        f"Termin płatności: {due}",
+        "Lp. Nazwa Ilość Cena netto",
+        "1 Ser żółty 10 12,34",
+        f"Razem: {net} 23% {gross}",
+    ])
+
+
+def bukat_result(number, issued, due, net, gross):
+    return {
+        "invoice_date": issued,
+        "category": "JEDZENIE",
+        "vendor": "Bukat Sp. z o.o.",
+        "net_amount": net,
+        "gross_amount": gross,
+        "invoice_number": number,
+        "payment_date": due
+    }
+
+
+INVOICES = {
+    "a.pdf": (bukat_text("F/0019864/2025", "05.03.2025", "19.03.2025", "1 000,00", "1 230,00"),
+              bukat_result("F/0019864/2025", "2025-03-05", "2025-03-19", 1000.0, 1230.0)),
+    "b.pdf": (bukat_text("F/0019901/2025", "12.03.2025", "26.03.2025", "250,50", "308,12"),
+              bukat_result("F/0019901/2025", "2025-03-12", "2025-03-26", 250.5, 308.12)),
+    "c.pdf": (bukat_text("F/0020017/2025", "20.03.2025", "03.04.2025", "80,00", "98,40"),
+              bukat_result("F/0020017/2025", "2025-03-20", "2025-04-03", 80.0, 98.4)),
+}
+
+
+@pytest.fixture
+def mock_llm_provider():
+    provider = Mock()
+    provider.extract_invoice_data.side_effect = lambda path: dict(INVOICES[path][1])
+    return provider
+
+
+def make_provider(llm_provider, repo=None, texts=None):
+    texts = texts or {path: text for path, (text, _) in INVOICES.items()}
+    return TextLayerLLMProvider(llm_provider, invoice_repo=repo, min_confirmations=2, text_extractor=lambda path: texts.get(path, ""))
+
+
+def test_trusted_layout_skips_the_llm(mock_llm_provider):
+    # Arrange
+    provider = make_provider(mock_llm_provider)
+
+    # Act
+    provider.extract_invoice_data("a.pdf")
+    provider.extract_invoice_data("b.pdf")
+    result = provider.extract_invoice_data("c.pdf")
+
+    # Assert
+    assert result == INVOICES["c.pdf"][1]
+    assert mock_llm_provider.extract_invoice_data.call_count == 2
+    assert provider.stats == {'text_layer_hits': 1, 'llm_calls': 2}
+    assert provider.hit_rate == pytest.approx(1 / 3)
+
+
+def test_layout_is_not_trusted_after_a_single_result(mock_llm_provider):
+    # Arrange
+    provider = make_provider(mock_llm_provider)
+
+    # Act
+    provider.extract_invoice_data("a.pdf")
+    provider.extract_invoice_data("c.pdf")
+
+    # Assert
+    assert mock_llm_provider.extract_invoice_data.call_count == 2
+
+
+def test_pdf_without_text_layer_goes_to_llm(mock_llm_provider):
+    # Arrange
+    repo = Mock()
+    repo.get_vendor_layouts.return_value = {}
+    provider = make_provider(mock_llm_provider, repo=repo, texts={"a.pdf": INVOICES["a.pdf"][0], "b.pdf": INVOICES["b.pdf"][0]})
+    provider.extract_invoice_data("a.pdf")
+    provider.extract_invoice_data("b.pdf")
+
+    # Act
+    provider.extract_invoice_data("c.pdf")
+
+    # Assert
+    assert mock_llm_provider.extract_invoice_data.call_count == 3
+    assert provider.stats['text_layer_hits'] == 0
+    saved = repo.save_vendor_layout.call_args.args
+    assert saved[0] == "bukat_sp_z_o_o"
+    assert saved[1]['confirmations'] == 2
+
+
+def test_inconsistent_amounts_fall_back_to_llm(mock_llm_provider):
+    # Arrange
+    texts = {path: text for path, (text, _) in INVOICES.items()}
+    texts["c.pdf"] = bukat_text("F/0020017/2025", "20.03.2025", "03.04.2025", "98,40", "80,00")
+    provider = make_provider(mock_llm_provider, texts=texts)
+    provider.extract_invoice_data("a.pdf")
+    provider.extract_invoice_data("b.pdf")
+
+    # Act
+    provider.extract_invoice_data("c.pdf")
+
+    # Assert
+    assert mock_llm_provider.extract_invoice_data.call_count == 3
+
+
+def test_batch_sends_only_unrecognized_invoices_to_llm(mock_llm_provider):
+    # Arrange
+    mock_llm_provider.extract_invoice_data_batch.side_effect = lambda paths: {key: dict(INVOICES.get(path, INVOICES["a.pdf"])[1]) for key, path in paths.items()}
+    provider = make_provider(mock_llm_provider)
+    provider.extract_invoice_data("a.pdf")
+    provider.extract_invoice_data("b.pdf")
+
+    # Act
+    results = provider.extract_invoice_data_batch({"raw_c": "c.pdf", "raw_scan": "scan.pdf"})
+
+    # Assert
+    assert results["raw_c"]["invoice_number"] == "F/0020017/2025"
+    mock_llm_provider.extract_invoice_data_batch.assert_called_once_with({"raw_scan": "scan.pdf"})
+
+
+def test_parse_amount_formats():
+    assert parse_amount("1 234,56") == 1234.56
+    assert parse_amount("1.234,56") == 1234.56
+    assert parse_amount("1,234.56") == 1234.56
+    assert parse_amount("99.90") == 99.9
+
+
+def test_sample_invoice_is_learned_from_its_real_text_layer():
+    # Arrange
+    pytest.importorskip("pypdf")
+    from src.infrastructure.text_layer_llm_provider import extract_text_layer
+    expected = {
+        "invoice_date": "2025-03-07",
+        "category": "JEDZENIE",
+        "vendor": "Bukat sp. z o.o.",
+        "net_amount": 810.66,
+        "gross_amount": 851.19,
+        "invoice_number": "F/0019864/2025",
+        "payment_date": "2025-03-12"
+    }
+    llm_provider = Mock()
+    llm_provider.extract_invoice_data.side_effect = lambda path: dict(expected)
+    provider = TextLayerLLMProvider(llm_provider, text_extractor=extract_text_layer)
+    provider.extract_invoice_data("sample_data/Faktura_bukat.pdf")
+    provider.extract_invoice_data("sample_data/Faktura_bukat.pdf")
+
+    # Act
+    result = provider.extract_invoice_data("sample_data/Faktura_bukat.pdf")
+
+    # Assert
+    assert result == expected
+    assert llm_provider.extract_invoice_data.call_count == 2
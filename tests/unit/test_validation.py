@@ -0,0 +1,46 @@
+"""Unit tests for extraction mapping and sanity checks."""
+import pytest
+from datetime import datetime
+from src.domain.validation import map_extraction, check_amounts, validate_extraction
+
+
+RESULT = {
+    "invoice_date": "07.03.2025",
+    "category": "JEDZENIE",
+    "vendor": "Bukat",
+    "net_amount": 810.66,
+    "gross_amount": 851.19,
+    "invoice_number": "F/0019864/2025",
+    "payment_date": "2025-03-12"
+}
+
+
+def test_map_extraction_parses_dates_in_either_format():
+    invoice = map_extraction(RESULT)
+
+    assert invoice.invoice_date == datetime(2025, 3, 7)
+    assert invoice.due_date == datetime(2025, 3, 12)
+    assert invoice.vendor_name == "Bukat"
+
+
+def test_consistent_amounts_have_no_problems():
+    assert check_amounts(map_extraction(RESULT)) == []
+
+
+def test_credit_note_with_negative_amounts_is_accepted():
+    assert check_amounts(map_extraction({**RESULT, "net_amount": -810.66, "gross_amount": -851.19})) == []
+
+
+def test_validate_extraction_rejects_swapped_amounts():
+    with pytest.raises(ValueError, match="net amount exceeds gross amount"):
+        validate_extraction({**RESULT, "net_amount": 851.19, "gross_amount": 810.66})
+
+
+@pytest.mark.parametrize("net, gross, problem", [
+    (0.0, 851.19, "net amount is zero"),
+    (-810.66, 851.19, "opposite signs"),
+    (-851.19, -810.66, "net amount exceeds gross amount"),
+])
+def test_validate_extraction_rejects_inconsistent_amounts(net, gross, problem):
+    with pytest.raises(ValueError, match=problem):
+        validate_extraction({**RESULT, "net_amount": net, "gross_amount": gross})
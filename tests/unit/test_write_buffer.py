@@ -0,0 +1,140 @@
+"""Unit tests for buffered status writes (StatusWriteBuffer and bulk repository updates)."""
+import threading
+from datetime import datetime
+from unittest.mock import Mock
+from src.domain.entities import RawInvoice, Email, ProcessingStatus, StatusUpdate, LEASE_LOST
+from src.infrastructure.json_repository import JsonInvoiceRepository
+from src.services.sheets_service import SheetsService
+from src.services.write_buffer import StatusWriteBuffer
+
+
+def test_buffer_writes_when_full():
+    # Arrange
+    write = Mock(return_value={})
+    buffer = StatusWriteBuffer(write, max_size=3, max_delay_seconds=60)
+
+    # Act
+    for i in range(7):
+        buffer.add(f"inv_{i}", "PROCESSED")
+
+    # Assert
+    assert [len(call.args[0]) for call in write.call_args_list] == [3, 3]
+    assert len(buffer) == 1
+    assert buffer.flush() == {}
+    assert write.call_count == 3
+
+
+def test_buffer_writes_when_oldest_update_is_due():
+    # Arrange
+    now = [0.0]
+    write = Mock(return_value={})
+    buffer = StatusWriteBuffer(write, max_size=100, max_delay_seconds=5, clock=lambda: now[0])
+    buffer.add("inv_1", "PROCESSED")
+    now[0] = 4.0
+    buffer.add("inv_2", "PROCESSED")
+    write.assert_not_called()
+
+    # Act
+    now[0] = 5.0
+    buffer.add("inv_3", "FAILED", "Duplicate invoice number: 1")
+
+    # Assert
+    write.assert_called_once_with([
+        StatusUpdate("inv_1", "PROCESSED"),
+        StatusUpdate("inv_2", "PROCESSED"),
+        StatusUpdate("inv_3", "FAILED", "Duplicate invoice number: 1")
+    ])
+
+
+def test_buffer_writes_due_updates_without_further_adds():
+    # Arrange
+    written = threading.Event()
+    write = Mock(side_effect=lambda updates: written.set() or {})
+    buffer = StatusWriteBuffer(write, max_size=100, max_delay_seconds=0.05)
+
+    # Act
+    buffer.add("inv_1", "PROCESSED")
+
+    # Assert
+    assert written.wait(timeout=5)
+    assert write.call_args.args[0] == [StatusUpdate("inv_1", "PROCESSED")]
+    assert len(buffer) == 0
+
+
+def test_failed_updates_are_reported_per_document():
+    # Arrange
+    write = Mock(side_effect=[{"inv_2": "NOT_FOUND"}, RuntimeError("deadline exceeded")])
+    buffer = StatusWriteBuffer(write, max_size=2)
+
+    # Act
+    buffer.add("inv_1", "SYNCED")
+    buffer.add("inv_2", "SYNCED")
+    buffer.add("inv_3", "SYNCED")
+    last = buffer.flush()
+
+    # Assert
+    assert last == {"inv_3": "deadline exceeded"}
+    assert buffer.failures == {"inv_2": "NOT_FOUND", "inv_3": "deadline exceeded"}
+
+
+def test_updates_whose_lease_was_lost_while_buffered_are_flagged_not_failed():
+    # Arrange
+    write = Mock(return_value={"inv_2": LEASE_LOST, "inv_3": "NOT_FOUND"})
+    buffer = StatusWriteBuffer(write, max_size=10)
+    for i in range(1, 4):
+        buffer.add(f"inv_{i}", "RETRY", "429", lease_owner="task0")
+
+    # Act
+    buffer.flush()
+
+    # Assert
+    assert {update.lease_owner for update in write.call_args.args[0]} == {"task0"}
+    assert buffer.lease_lost == {"inv_2"}
+    assert buffer.failures == {"inv_3": "NOT_FOUND"}
+
+
+def test_json_bulk_update_applies_all_statuses_in_one_write(tmp_path):
+    # Arrange
+    repo = JsonInvoiceRepository(data_dir=str(tmp_path))
+    for i in range(3):
+        repo.save_raw_invoice(RawInvoice(
+            id=f"raw_{i}",
+            email_id=f"email_{i}",
+            email_data=Email(id=f"email_{i}", sender="a@b.c", subject="Invoice", date=datetime.now(), attachment_path=f"/tmp/{i}.pdf"),
+            status=ProcessingStatus.PENDING,
+            created_at=datetime.now(),
+            updated_at=datetime.now()
+        ))
+    repo._save_json = Mock(wraps=repo._save_json)
+
+    # Act
+    failures = repo.update_raw_invoice_statuses([
+        StatusUpdate("raw_0", ProcessingStatus.PROCESSED.value),
+        StatusUpdate("raw_1", ProcessingStatus.FAILED.value, "Unreadable PDF"),
+        StatusUpdate("missing", ProcessingStatus.PROCESSED.value)
+    ])
+
+    # Assert
+    items = {item['id']: item for item in repo._load_json(repo.raw_invoices_file)}
+    assert failures == {"missing": "Document not found"}
+    assert repo._save_json.call_count == 1
+    assert [items[f"raw_{i}"]['status'] for i in range(3)] == ["PROCESSED", "FAILED", "PENDING"]
+    assert items["raw_1"]['error_message'] == "Unreadable PDF"
+
+
+def test_sheets_service_buffers_sync_statuses():
+    # Arrange
+    repo = Mock()
+    repo.update_processed_invoice_sync_statuses.return_value = {"inv_4": "NOT_FOUND"}
+    sheets = Mock()
+    service = SheetsService(repo, sheets, write_batch_size=50)
+    invoices = [Mock(id=f"inv_{i}") for i in range(5)]
+
+    # Act
+    stats = service.run(invoices)
+
+    # Assert
+    repo.update_processed_invoice_sync_status.assert_not_called()
+    repo.update_processed_invoice_sync_statuses.assert_called_once()
+    assert len(repo.update_processed_invoice_sync_statuses.call_args.args[0]) == 5
+    assert stats == {'total': 5, 'success': 5, 'failed': 0, 'write_failures': 1}